@@ -0,0 +1,357 @@
+"""
+End-to-end load benchmark: proxy + mock upstream.
+
+Launches benchmarks/mock_upstream.py and the proxy (BASE_URL pointed at the
+mock), then replays synthetic Claude Code conversations - long system
+prompt, a full tool schema set, multi-turn tool_use/tool_result history
+with large file contents - against POST /v1/messages. Reports:
+
+  * throughput (completed requests/s and output events/s)
+  * p50/p99 time-to-first-token (first content_block_delta)
+  * p50/p99 inter-token latency (gap between content_block_delta events)
+  * proxy CPU-ms per request and RSS (peak / end)
+
+--json writes the report; --baseline compares against a previous report and
+exits non-zero when any metric regresses by more than --tolerance, so the
+suite can gate a deploy.
+
+    uv run benchmarks/load.py --concurrency 32 --duration 30 --tokens-per-s 400
+    uv run benchmarks/load.py --json current.json --baseline main.json
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import pathlib
+import random
+import statistics
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from mock_upstream import add_mock_arguments
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+BENCH = ROOT / "benchmarks"
+
+TOOL_NAMES = ["Read", "Write", "Edit", "Bash", "Glob", "Grep", "LS", "WebFetch", "TodoWrite", "NotebookEdit"]
+
+
+# ---------------------------------------------------------------------------
+# Workload
+# ---------------------------------------------------------------------------
+
+
+def _tool_schema(name: str) -> Dict[str, Any]:
+    return {
+        "name": name,
+        "description": f"{name} tool. " + "Use it carefully and prefer absolute paths. " * 8,
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "path": {"type": "string", "description": "Absolute path to operate on."},
+                "content": {"type": "string", "description": "New content, when writing."},
+                "pattern": {"type": "string", "description": "Glob or regex pattern."},
+                "limit": {"type": "integer", "minimum": 1, "description": "Maximum results."},
+                "options": {
+                    "type": "object",
+                    "properties": {"recursive": {"type": "boolean"}, "timeout": {"type": "number"}},
+                },
+            },
+            "required": ["path"],
+        },
+    }
+
+
+def _file_contents(rng: random.Random, kb: int) -> str:
+    line = "    result = process(item, options=options)  # keep the loop tight\n"
+    return f"# file {rng.randrange(1 << 30):x}\n" + line * (kb * 1024 // len(line))
+
+
+def build_conversation(rng: random.Random, max_turns: int, tool_result_kb: int, stream: bool = True) -> Dict[str, Any]:
+    """One Claude Code-shaped request: n tool round trips, then a user question."""
+    messages: List[Dict[str, Any]] = [{"role": "user", "content": "Fix the failing test in src/main.py and explain the change."}]
+    for turn in range(rng.randint(0, max_turns)):
+        tool_id = f"toolu_{turn:04d}{rng.randrange(1 << 20):05x}"
+        name = rng.choice(TOOL_NAMES)
+        messages.append({
+            "role": "assistant",
+            "content": [
+                {"type": "text", "text": f"Let me use {name} to look at that."},
+                {"type": "tool_use", "id": tool_id, "name": name, "input": {"path": f"/repo/src/module_{turn}.py"}},
+            ],
+        })
+        messages.append({
+            "role": "user",
+            "content": [{"type": "tool_result", "tool_use_id": tool_id,
+                         "content": _file_contents(rng, rng.randint(1, tool_result_kb))}],
+        })
+    messages.append({"role": "user", "content": "Continue."})
+    return {
+        "model": rng.choice(["claude-sonnet-4", "claude-opus-4", "claude-3-5-haiku"]),
+        "max_tokens": 4096,
+        "stream": stream,
+        "system": [{"type": "text", "text": "You are Claude Code, a CLI coding assistant. " * 150}],
+        "tools": [_tool_schema(n) for n in TOOL_NAMES],
+        "messages": messages,
+    }
+
+
+# ---------------------------------------------------------------------------
+# Measurement
+# ---------------------------------------------------------------------------
+
+
+@dataclass
+class Samples:
+    ttft_s: List[float] = field(default_factory=list)
+    itl_s: List[float] = field(default_factory=list)
+    completed: int = 0
+    errors: int = 0
+    events: int = 0
+
+
+def _pct(values: List[float], q: int) -> float:
+    if not values:
+        return float("nan")
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
+
+
+class ProcessSampler:
+    """CPU seconds and RSS of a process, via psutil when installed, else /proc."""
+
+    def __init__(self, pid: int) -> None:
+        self.pid = pid
+        self.peak_rss_mb = 0.0
+        try:
+            import psutil  # type: ignore[import-not-found]
+
+            self._proc = psutil.Process(pid)
+        except ImportError:
+            self._proc = None
+
+    def cpu_s(self) -> float:
+        if self._proc is not None:
+            t = self._proc.cpu_times()
+            return t.user + t.system
+        fields = pathlib.Path(f"/proc/{self.pid}/stat").read_text().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+    def rss_mb(self) -> float:
+        if self._proc is not None:
+            rss = self._proc.memory_info().rss / 2**20
+        else:
+            rss = 0.0
+            for line in pathlib.Path(f"/proc/{self.pid}/status").read_text().splitlines():
+                if line.startswith("VmRSS:"):
+                    rss = int(line.split()[1]) / 1024
+        self.peak_rss_mb = max(self.peak_rss_mb, rss)
+        return rss
+
+
+async def _one_request(client: httpx.AsyncClient, payload: Dict[str, Any], samples: Samples) -> None:
+    started = time.monotonic()
+    last_delta: Optional[float] = None
+    try:
+        async with client.stream("POST", "/v1/messages", json=payload) as resp:
+            if resp.status_code != 200:
+                await resp.aread()
+                samples.errors += 1
+                return
+            if not payload["stream"]:
+                await resp.aread()
+                samples.ttft_s.append(time.monotonic() - started)
+                samples.completed += 1
+                return
+            async for line in resp.aiter_lines():
+                if line.startswith("event: "):
+                    samples.events += 1
+                    if line == "event: error":
+                        samples.errors += 1
+                        return
+                    if line == "event: content_block_delta":
+                        now = time.monotonic()
+                        if last_delta is None:
+                            samples.ttft_s.append(now - started)
+                        else:
+                            samples.itl_s.append(now - last_delta)
+                        last_delta = now
+        samples.completed += 1
+    except httpx.HTTPError:
+        samples.errors += 1
+
+
+async def drive(
+    base_url: str,
+    payloads: List[Dict[str, Any]],
+    concurrency: int,
+    duration_s: float,
+    sampler: ProcessSampler,
+) -> Tuple[Samples, float, float]:
+    """Returns (samples, wall seconds, proxy CPU seconds) for the measured window."""
+    samples = Samples()
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=300) as client:
+        await _wait_ready(client, "/")
+        cpu_before = sampler.cpu_s()
+        started = time.monotonic()
+        stop_at = started + duration_s
+        next_payload = 0
+
+        async def worker() -> None:
+            nonlocal next_payload
+            while time.monotonic() < stop_at:
+                payload = payloads[next_payload % len(payloads)]
+                next_payload += 1
+                await _one_request(client, payload, samples)
+
+        async def watch_rss() -> None:
+            while time.monotonic() < stop_at:
+                sampler.rss_mb()
+                await asyncio.sleep(0.25)
+
+        await asyncio.gather(watch_rss(), *(worker() for _ in range(concurrency)))
+        return samples, time.monotonic() - started, sampler.cpu_s() - cpu_before
+
+
+async def _wait_ready(client: httpx.AsyncClient, url: str, timeout_s: float = 60.0) -> None:
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get(url)).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"{client.base_url} did not become ready")
+
+
+# ---------------------------------------------------------------------------
+# Entry point
+# ---------------------------------------------------------------------------
+
+# metric -> True when higher is better
+REPORT_METRICS = {
+    "requests_per_s": True,
+    "ttft_p50_ms": False,
+    "ttft_p99_ms": False,
+    "itl_p50_ms": False,
+    "itl_p99_ms": False,
+    "cpu_ms_per_request": False,
+    "peak_rss_mb": False,
+}
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    regressions = []
+    for metric, higher_is_better in REPORT_METRICS.items():
+        old, new = baseline.get(metric), report.get(metric)
+        if not old or new is None or new != new:  # missing / zero / NaN
+            continue
+        change = (new - old) / old
+        if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+            regressions.append(f"{metric}: {old:.2f} -> {new:.2f} ({change:+.0%})")
+    return regressions
+
+
+def _spawn(args: List[str], env: Dict[str, str]) -> subprocess.Popen:
+    return subprocess.Popen(args, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--conversations", type=int, default=50, help="distinct payloads to cycle through")
+    parser.add_argument("--max-turns", type=int, default=12)
+    parser.add_argument("--tool-result-kb", type=int, default=16)
+    parser.add_argument("--non-streaming", action="store_true")
+    parser.add_argument("--proxy-port", type=int, default=18082)
+    parser.add_argument("--mock-port", type=int, default=18100)
+    parser.add_argument("--proxy-env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra proxy setting, e.g. UPSTREAM_STREAM_MODE=raw")
+    parser.add_argument("--json", type=pathlib.Path, help="write the report here")
+    parser.add_argument("--baseline", type=pathlib.Path, help="previous --json report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10)
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    mock_flags = [
+        f"--{name.replace('_', '-')}={getattr(args, name)}"
+        for name in ("tokens_per_s", "chunk_tokens", "output_tokens", "ttft_ms", "ttft_dist", "ttft_jitter",
+                     "error_rate", "error_status", "midstream_abort_rate", "tool_call_rate", "seed")
+    ]
+    env = {
+        **os.environ,
+        "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "bench-key"),
+        "BIG_MODEL_NAME": os.environ.get("BIG_MODEL_NAME", "bench/big"),
+        "SMALL_MODEL_NAME": os.environ.get("SMALL_MODEL_NAME", "bench/small"),
+        "BASE_URL": f"http://127.0.0.1:{args.mock_port}/v1",
+        "PORT": str(args.proxy_port),
+        "RELOAD": "false",
+        "LOG_LEVEL": "WARNING",
+        "LOG_FILE_PATH": "",
+        **dict(kv.split("=", 1) for kv in args.proxy_env),
+    }
+    rng = random.Random(args.seed)
+    payloads = [
+        build_conversation(rng, args.max_turns, args.tool_result_kb, stream=not args.non_streaming)
+        for _ in range(args.conversations)
+    ]
+
+    mock = _spawn([sys.executable, str(BENCH / "mock_upstream.py"), f"--port={args.mock_port}", *mock_flags], env)
+    proxy = _spawn([sys.executable, str(ROOT / "src" / "main.py")], env)
+    try:
+        sampler = ProcessSampler(proxy.pid)
+        samples, wall_s, cpu_s = asyncio.run(
+            drive(f"http://127.0.0.1:{args.proxy_port}", payloads, args.concurrency, args.duration, sampler)
+        )
+        end_rss = sampler.rss_mb()
+    finally:
+        for proc in (proxy, mock):
+            proc.terminate()
+            proc.wait(timeout=30)
+
+    finished = samples.completed + samples.errors
+    report = {
+        "requests": samples.completed,
+        "errors": samples.errors,
+        "requests_per_s": samples.completed / wall_s,
+        "events_per_s": samples.events / wall_s,
+        "ttft_p50_ms": _pct(samples.ttft_s, 50) * 1000,
+        "ttft_p99_ms": _pct(samples.ttft_s, 99) * 1000,
+        "itl_p50_ms": _pct(samples.itl_s, 50) * 1000,
+        "itl_p99_ms": _pct(samples.itl_s, 99) * 1000,
+        "cpu_ms_per_request": cpu_s * 1000 / finished if finished else float("nan"),
+        "peak_rss_mb": sampler.peak_rss_mb,
+        "end_rss_mb": end_rss,
+        "config": {k: (str(v) if isinstance(v, pathlib.Path) else v) for k, v in vars(args).items()},
+    }
+
+    print(f"requests      {samples.completed} ok / {samples.errors} errors in {wall_s:.1f} s")
+    print(f"throughput    {report['requests_per_s']:.1f} req/s, {report['events_per_s']:.0f} events/s")
+    print(f"TTFT          p50 {report['ttft_p50_ms']:.1f} ms   p99 {report['ttft_p99_ms']:.1f} ms")
+    print(f"inter-token   p50 {report['itl_p50_ms']:.2f} ms   p99 {report['itl_p99_ms']:.2f} ms")
+    print(f"proxy CPU     {report['cpu_ms_per_request']:.2f} ms/request")
+    print(f"proxy RSS     peak {report['peak_rss_mb']:.1f} MiB, end {end_rss:.1f} MiB")
+
+    if args.json:
+        args.json.write_text(json.dumps(report, indent=2))
+    if args.baseline:
+        regressions = compare(report, json.loads(args.baseline.read_text()), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
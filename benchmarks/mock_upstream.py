@@ -0,0 +1,210 @@
+"""
+Fake OpenAI-compatible upstream for benchmarks.
+
+Serves POST /v1/chat/completions (streaming and non-streaming) with a
+tunable time-to-first-token distribution, token rate, chunk size, error
+injection and tool-call streams, so the proxy can be load-tested without
+touching a real provider. Every knob is a CLI flag:
+
+    uv run benchmarks/mock_upstream.py --port 18100 --tokens-per-s 200 \\
+        --ttft-ms 300 --ttft-dist lognormal --error-rate 0.02 --tool-call-rate 0.3
+
+Point the proxy at it with BASE_URL=http://127.0.0.1:18100/v1.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, AsyncGenerator, Dict, List
+
+import fastapi
+import uvicorn
+from fastapi.responses import JSONResponse, StreamingResponse
+
+WORDS = (
+    "the proxy converts anthropic messages into openai chat completions and "
+    "streams the translated events back to the client while counting tokens"
+).split()
+
+
+@dataclass
+class MockConfig:
+    tokens_per_s: float = 100.0
+    chunk_tokens: int = 1
+    output_tokens: int = 200
+    ttft_ms: float = 200.0
+    ttft_dist: str = "fixed"  # fixed | uniform | lognormal
+    ttft_jitter: float = 0.5
+    # "headers": wait before responding; "body": send headers (and the role
+    # chunk) at once and go quiet inside the stream, as OpenRouter does
+    ttft_phase: str = "headers"
+    error_rate: float = 0.0
+    error_status: int = 503
+    midstream_abort_rate: float = 0.0
+    tool_call_rate: float = 0.0
+    seed: int = 0
+
+
+def _sample_ttft_s(cfg: MockConfig, rng: random.Random) -> float:
+    base = cfg.ttft_ms / 1000
+    if cfg.ttft_dist == "uniform":
+        return max(0.0, rng.uniform(base * (1 - cfg.ttft_jitter), base * (1 + cfg.ttft_jitter)))
+    if cfg.ttft_dist == "lognormal":
+        # median == ttft_ms, sigma controls the tail
+        return base * rng.lognormvariate(0.0, cfg.ttft_jitter)
+    return base
+
+
+def _chunk(completion_id: str, model: str, delta: Dict[str, Any], finish_reason=None) -> bytes:
+    payload = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(payload)}\n\n".encode()
+
+
+def _text_pieces(cfg: MockConfig) -> List[str]:
+    words = [WORDS[i % len(WORDS)] + " " for i in range(cfg.output_tokens)]
+    return ["".join(words[i : i + cfg.chunk_tokens]) for i in range(0, len(words), cfg.chunk_tokens)]
+
+
+def _tool_argument_pieces(cfg: MockConfig) -> List[str]:
+    arguments = json.dumps({"path": "src/main.py", "content": " ".join(WORDS[i % len(WORDS)] for i in range(cfg.output_tokens))})
+    step = max(1, 4 * cfg.chunk_tokens)  # ~4 characters per token
+    return [arguments[i : i + step] for i in range(0, len(arguments), step)]
+
+
+def _error_response(status: int) -> JSONResponse:
+    return JSONResponse(
+        status_code=status,
+        content={"error": {"message": f"mock upstream injected {status}", "type": "mock_error", "code": status}},
+    )
+
+
+def create_mock_app(cfg: MockConfig) -> fastapi.FastAPI:
+    app = fastapi.FastAPI()
+    rng = random.Random(cfg.seed)
+    stats = {"requests": 0, "errors": 0, "aborts": 0}
+
+    @app.get("/stats")
+    async def get_stats() -> Dict[str, int]:
+        return stats
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: fastapi.Request):
+        body = await request.json()
+        stats["requests"] += 1
+        model = body.get("model", "mock")
+        completion_id = f"gen-{uuid.uuid4().hex[:12]}"
+        prompt_tokens = len(json.dumps(body.get("messages", []))) // 4
+
+        ttft_s = _sample_ttft_s(cfg, rng)
+        if cfg.ttft_phase == "headers" or not body.get("stream"):
+            await asyncio.sleep(ttft_s)
+            ttft_s = 0.0
+        if rng.random() < cfg.error_rate:
+            stats["errors"] += 1
+            return _error_response(cfg.error_status)
+
+        use_tool = bool(body.get("tools")) and rng.random() < cfg.tool_call_rate
+        abort = rng.random() < cfg.midstream_abort_rate
+        pieces = _tool_argument_pieces(cfg) if use_tool else _text_pieces(cfg)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": cfg.output_tokens,
+            "total_tokens": prompt_tokens + cfg.output_tokens,
+        }
+
+        if not body.get("stream"):
+            await asyncio.sleep(cfg.output_tokens / cfg.tokens_per_s)
+            if use_tool:
+                message = {"role": "assistant", "content": None, "tool_calls": [
+                    {"id": "call_mock", "type": "function",
+                     "function": {"name": body["tools"][0]["function"]["name"], "arguments": "".join(pieces)}}
+                ]}
+                finish_reason = "tool_calls"
+            else:
+                message = {"role": "assistant", "content": "".join(pieces)}
+                finish_reason = "stop"
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+                "usage": usage,
+            }
+
+        delay = cfg.chunk_tokens / cfg.tokens_per_s
+
+        async def stream() -> AsyncGenerator[bytes, None]:
+            yield _chunk(completion_id, model, {"role": "assistant", "content": ""})
+            if ttft_s:
+                await asyncio.sleep(ttft_s)
+            for i, piece in enumerate(pieces):
+                if abort and i == len(pieces) // 2:
+                    stats["aborts"] += 1
+                    raise RuntimeError("mock upstream aborted the stream")
+                if use_tool:
+                    call: Dict[str, Any] = {"index": 0, "function": {"arguments": piece}}
+                    if i == 0:
+                        call.update(id="call_mock", type="function")
+                        call["function"]["name"] = body["tools"][0]["function"]["name"]
+                    yield _chunk(completion_id, model, {"tool_calls": [call]})
+                else:
+                    yield _chunk(completion_id, model, {"content": piece})
+                await asyncio.sleep(delay)
+            yield _chunk(completion_id, model, {}, "tool_calls" if use_tool else "stop")
+            if (body.get("stream_options") or {}).get("include_usage"):
+                yield (
+                    "data: " + json.dumps({"id": completion_id, "object": "chat.completion.chunk",
+                                           "created": int(time.time()), "model": model,
+                                           "choices": [], "usage": usage}) + "\n\n"
+                ).encode()
+            yield b"data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    return app
+
+
+def add_mock_arguments(parser: argparse.ArgumentParser) -> None:
+    """Shared by the load driver, which launches this server itself."""
+    defaults = MockConfig()
+    parser.add_argument("--tokens-per-s", type=float, default=defaults.tokens_per_s)
+    parser.add_argument("--chunk-tokens", type=int, default=defaults.chunk_tokens)
+    parser.add_argument("--output-tokens", type=int, default=defaults.output_tokens)
+    parser.add_argument("--ttft-ms", type=float, default=defaults.ttft_ms)
+    parser.add_argument("--ttft-dist", choices=["fixed", "uniform", "lognormal"], default=defaults.ttft_dist)
+    parser.add_argument("--ttft-jitter", type=float, default=defaults.ttft_jitter)
+    parser.add_argument("--ttft-phase", choices=["headers", "body"], default=defaults.ttft_phase)
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate)
+    parser.add_argument("--error-status", type=int, default=defaults.error_status)
+    parser.add_argument("--midstream-abort-rate", type=float, default=defaults.midstream_abort_rate)
+    parser.add_argument("--tool-call-rate", type=float, default=defaults.tool_call_rate)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+
+
+def mock_config_from_args(args: argparse.Namespace) -> MockConfig:
+    return MockConfig(**{field: getattr(args, field) for field in MockConfig.__dataclass_fields__})
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18100)
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(create_mock_app(mock_config_from_args(args)), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+"""
+Recorded-traffic replay.
+
+With LOG_LEVEL=DEBUG the proxy writes every incoming Anthropic body
+(`anthropic_body`) and the converted OpenAI parameters (`openai_request`)
+to log.jsonl. This tool turns those records into a corpus and replays it:
+
+    # 1. pull request pairs out of one or more log files
+    uv run benchmarks/replay.py extract log.jsonl -o corpus.jsonl
+
+    # 2. replay against an in-process proxy + mock upstream
+    uv run benchmarks/replay.py replay corpus.jsonl --concurrency 16
+    uv run benchmarks/replay.py replay corpus.jsonl --pace original --speed 4
+
+Replay captures the request body the proxy sends upstream for every corpus
+entry and diffs it against the recorded `openai_request`, so converter
+changes show up as a list of JSON paths. The run also reports throughput
+and latency percentiles for the production-shaped mix. Exits non-zero when
+any converted request differs (use --ignore for keys that legitimately
+vary, e.g. --ignore model when the model mapping changed).
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import pathlib
+import statistics
+import sys
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src"))
+os.environ.setdefault("OPENAI_API_KEY", "replay-key")
+os.environ.setdefault("BIG_MODEL_NAME", "replay/big")
+os.environ.setdefault("SMALL_MODEL_NAME", "replay/small")
+os.environ["LOG_LEVEL"] = os.environ.get("REPLAY_LOG_LEVEL", "WARNING")
+os.environ["LOG_FILE_PATH"] = ""
+
+import httpx  # noqa: E402
+
+from mock_upstream import add_mock_arguments, create_mock_app, mock_config_from_args  # noqa: E402
+
+# corpus entry id of the replayed request currently running in this task
+_current_entry: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "_current_entry", default=None
+)
+
+
+# ---------------------------------------------------------------------------
+# Corpus extraction
+# ---------------------------------------------------------------------------
+
+
+def iter_log_records(paths: List[pathlib.Path]) -> Iterator[Dict[str, Any]]:
+    for path in paths:
+        with path.open(encoding="utf-8") as fh:
+            for line in fh:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if isinstance(record.get("detail"), dict):
+                    yield record
+
+
+def extract_corpus(paths: List[pathlib.Path]) -> List[Dict[str, Any]]:
+    """Pairs each request's anthropic_body with its prepared openai_request."""
+    entries: Dict[str, Dict[str, Any]] = {}
+    for record in iter_log_records(paths):
+        detail = record["detail"]
+        request_id, data = detail.get("request_id"), detail.get("data") or {}
+        if not request_id:
+            continue
+        if detail.get("event") == "anthropic_body" and "body" in data:
+            entries.setdefault(request_id, {"id": request_id})
+            entries[request_id].update(
+                timestamp=record.get("timestamp"), anthropic_body=data["body"]
+            )
+        elif detail.get("event") == "openai_request" and "params" in data:
+            entry = entries.setdefault(request_id, {"id": request_id})
+            entry.setdefault("openai_request", data["params"])
+    return [e for e in entries.values() if "anthropic_body" in e]
+
+
+# ---------------------------------------------------------------------------
+# Diffing
+# ---------------------------------------------------------------------------
+
+
+def json_diff(
+    recorded: Any, replayed: Any, ignore: frozenset, path: str = "$"
+) -> Iterator[Tuple[str, Any, Any]]:
+    """Yields (json_path, recorded, replayed) for every differing leaf."""
+    if isinstance(recorded, dict) and isinstance(replayed, dict):
+        for key in sorted(set(recorded) | set(replayed)):
+            if path == "$" and key in ignore:
+                continue
+            yield from json_diff(
+                recorded.get(key, "<missing>"), replayed.get(key, "<missing>"), ignore, f"{path}.{key}"
+            )
+    elif isinstance(recorded, list) and isinstance(replayed, list):
+        if len(recorded) != len(replayed):
+            yield f"{path}.length", len(recorded), len(replayed)
+        for i, (a, b) in enumerate(zip(recorded, replayed)):
+            yield from json_diff(a, b, ignore, f"{path}[{i}]")
+    elif recorded != replayed:
+        yield path, recorded, replayed
+
+
+def _short(value: Any, limit: int = 80) -> str:
+    text = json.dumps(value, ensure_ascii=False)
+    return text if len(text) <= limit else text[: limit - 3] + "..."
+
+
+# ---------------------------------------------------------------------------
+# Replay
+# ---------------------------------------------------------------------------
+
+
+def build_clients(mock_app, captured: Dict[str, List[Dict[str, Any]]]):
+    """Proxy app plus an upstream transport that records what the proxy sends."""
+    import main
+    import openai
+
+    mock_transport = httpx.ASGITransport(app=mock_app)
+
+    class CapturingTransport(httpx.AsyncBaseTransport):
+        async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+            entry_id = _current_entry.get()
+            if entry_id is not None and request.url.path.endswith("/chat/completions"):
+                captured.setdefault(entry_id, []).append(json.loads(request.content))
+            return await mock_transport.handle_async_request(request)
+
+    transport = CapturingTransport()
+    main._openai_client = openai.AsyncClient(
+        api_key="replay", base_url="http://upstream/v1", http_client=httpx.AsyncClient(transport=transport)
+    )
+    main._upstream_http_client = httpx.AsyncClient(transport=transport, base_url="http://upstream/v1/")
+    proxy_client = httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=main.create_app()), base_url="http://proxy", timeout=300
+    )
+    return proxy_client
+
+
+async def _send(client: httpx.AsyncClient, entry: Dict[str, Any], latencies: List[float], errors: List[str]) -> None:
+    _current_entry.set(entry["id"])
+    started = time.monotonic()
+    try:
+        async with client.stream("POST", "/v1/messages", json=entry["anthropic_body"]) as resp:
+            await resp.aread()
+            if resp.status_code != 200:
+                errors.append(f"{entry['id']}: HTTP {resp.status_code}")
+                return
+        latencies.append(time.monotonic() - started)
+    except httpx.HTTPError as exc:
+        errors.append(f"{entry['id']}: {exc!r}")
+
+
+def _offsets(corpus: List[Dict[str, Any]], speed: float) -> List[float]:
+    stamps = [datetime.fromisoformat(e["timestamp"]).timestamp() if e.get("timestamp") else None for e in corpus]
+    first = min((s for s in stamps if s is not None), default=0.0)
+    return [((s - first) / speed) if s is not None else 0.0 for s in stamps]
+
+
+async def run_replay(
+    corpus: List[Dict[str, Any]],
+    client: httpx.AsyncClient,
+    pace: str,
+    speed: float,
+    concurrency: int,
+) -> Tuple[List[float], List[str], float]:
+    latencies: List[float] = []
+    errors: List[str] = []
+    started = time.monotonic()
+
+    if pace == "original":
+        async def at(offset: float, entry: Dict[str, Any]) -> None:
+            await asyncio.sleep(max(0.0, started + offset - time.monotonic()))
+            await _send(client, entry, latencies, errors)
+
+        order = sorted(zip(_offsets(corpus, speed), range(len(corpus))))
+        await asyncio.gather(*(at(offset, corpus[i]) for offset, i in order))
+    else:
+        queue: asyncio.Queue = asyncio.Queue()
+        for entry in corpus:
+            queue.put_nowait(entry)
+
+        async def worker() -> None:
+            while not queue.empty():
+                await _send(client, queue.get_nowait(), latencies, errors)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors, time.monotonic() - started
+
+
+def _pct(values: List[float], q: int) -> float:
+    if len(values) < 2:
+        return values[0] if values else float("nan")
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
+
+
+def cmd_extract(args: argparse.Namespace) -> int:
+    corpus = extract_corpus(args.logs)
+    with args.output.open("w", encoding="utf-8") as fh:
+        for entry in corpus:
+            fh.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    paired = sum(1 for e in corpus if "openai_request" in e)
+    print(f"wrote {len(corpus)} requests ({paired} with a recorded openai_request) to {args.output}")
+    return 0
+
+
+def cmd_replay(args: argparse.Namespace) -> int:
+    corpus = [json.loads(line) for line in args.corpus.open(encoding="utf-8") if line.strip()]
+    if args.limit:
+        corpus = corpus[: args.limit]
+    captured: Dict[str, List[Dict[str, Any]]] = {}
+
+    async def go():
+        async with build_clients(create_mock_app(mock_config_from_args(args)), captured) as client:
+            return await run_replay(corpus, client, args.pace, args.speed, args.concurrency)
+
+    latencies, errors, wall_s = asyncio.run(go())
+
+    ignore = frozenset(args.ignore)
+    compared = mismatched = 0
+    for entry in corpus:
+        recorded, sent = entry.get("openai_request"), captured.get(entry["id"])
+        if recorded is None or not sent:
+            continue
+        compared += 1
+        diffs = list(json_diff(recorded, sent[0], ignore))
+        if diffs:
+            mismatched += 1
+            print(f"DIFF {entry['id']} ({len(diffs)} paths)")
+            for path, old, new in diffs[: args.max_diffs]:
+                print(f"  {path}: {_short(old)} -> {_short(new)}")
+
+    for line in errors[: args.max_diffs]:
+        print(f"ERROR {line}")
+    print(f"replayed {len(corpus)} requests in {wall_s:.2f} s ({len(corpus) / wall_s:.1f} req/s), {len(errors)} errors")
+    print(f"latency p50 {_pct(latencies, 50) * 1000:.1f} ms, p99 {_pct(latencies, 99) * 1000:.1f} ms")
+    print(f"converted requests: {compared - mismatched}/{compared} identical to the recording")
+    return 1 if mismatched or errors else 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    extract = sub.add_parser("extract", help="build a corpus from log.jsonl files")
+    extract.add_argument("logs", type=pathlib.Path, nargs="+")
+    extract.add_argument("-o", "--output", type=pathlib.Path, default=pathlib.Path("corpus.jsonl"))
+    extract.set_defaults(func=cmd_extract)
+
+    replay = sub.add_parser("replay", help="replay a corpus and diff converted requests")
+    replay.add_argument("corpus", type=pathlib.Path)
+    replay.add_argument("--pace", choices=["closed", "original"], default="closed",
+                        help="closed: --concurrency workers back to back; original: recorded arrival times")
+    replay.add_argument("--speed", type=float, default=1.0, help="time compression for --pace original")
+    replay.add_argument("--concurrency", type=int, default=8)
+    replay.add_argument("--limit", type=int, default=0)
+    replay.add_argument("--ignore", nargs="*", default=[], help="top-level keys to leave out of the diff")
+    replay.add_argument("--max-diffs", type=int, default=10)
+    add_mock_arguments(replay)
+    replay.set_defaults(func=cmd_replay, ttft_ms=0.0, tokens_per_s=1e6, output_tokens=20)
+
+    args = parser.parse_args()
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
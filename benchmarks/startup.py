@@ -0,0 +1,126 @@
+"""
+Cold-start benchmark.
+
+Imports `main` in a fresh interpreter under `-X importtime` and reports the
+total import time plus the most expensive top-level imports. With
+--budget-ms the script exits non-zero when the median import exceeds the
+budget, so it can gate CI. --serve additionally measures time until the
+server answers its health check.
+
+    uv run benchmarks/startup.py --runs 5 --budget-ms 600
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import pathlib
+import re
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List, Tuple
+
+import httpx
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+SRC = ROOT / "src"
+
+_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s+)(\S+)")
+
+
+def _env(**extra: str) -> Dict[str, str]:
+    return {
+        **os.environ,
+        "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "bench-key"),
+        "BIG_MODEL_NAME": os.environ.get("BIG_MODEL_NAME", "bench/big"),
+        "SMALL_MODEL_NAME": os.environ.get("SMALL_MODEL_NAME", "bench/small"),
+        "LOG_FILE_PATH": "",
+        "LOG_LEVEL": "WARNING",
+        **extra,
+    }
+
+
+def measure_import() -> Tuple[float, List[Tuple[float, str]]]:
+    """Returns (cumulative ms for `main`, [(ms, module)] for its direct imports)."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=SRC,
+        env=_env(),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    total_ms = 0.0
+    # children are printed before their parent, one indent level deeper
+    children: List[Tuple[float, str]] = []
+    top_level: List[Tuple[float, str]] = []
+    for line in proc.stderr.splitlines():
+        m = _LINE.match(line)
+        if not m:
+            continue
+        cumulative_us, indent, module = int(m.group(2)), len(m.group(3)), m.group(4)
+        if indent == 3:
+            children.append((cumulative_us / 1000, module))
+        elif indent == 1:
+            if module == "main":
+                total_ms = cumulative_us / 1000
+                top_level = children
+            children = []
+    return total_ms, sorted(top_level, reverse=True)
+
+
+def measure_serve(port: int, timeout_s: float = 60.0) -> float:
+    """Seconds from process launch until GET / returns 200."""
+    started = time.monotonic()
+    proc = subprocess.Popen(
+        [sys.executable, str(SRC / "main.py")],
+        env=_env(RELOAD="false", PORT=str(port)),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.monotonic() - started < timeout_s:
+            try:
+                if httpx.get(f"http://127.0.0.1:{port}/", timeout=1).status_code == 200:
+                    return time.monotonic() - started
+            except httpx.HTTPError:
+                time.sleep(0.05)
+        raise RuntimeError("server did not become ready")
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--budget-ms", type=float, default=None)
+    parser.add_argument("--serve", action="store_true", help="also measure time-to-ready")
+    parser.add_argument("--port", type=int, default=18090)
+    args = parser.parse_args()
+
+    totals = []
+    breakdown: List[Tuple[float, str]] = []
+    for _ in range(args.runs):
+        total_ms, breakdown = measure_import()
+        totals.append(total_ms)
+    median_ms = statistics.median(totals)
+
+    print(f"import main: median {median_ms:.1f} ms (min {min(totals):.1f}, max {max(totals):.1f}, n={args.runs})")
+    print(f"top {args.top} direct imports (last run):")
+    for ms, module in breakdown[: args.top]:
+        print(f"  {ms:8.1f} ms  {module}")
+
+    if args.serve:
+        print(f"time to first health check: {measure_serve(args.port):.2f} s")
+
+    if args.budget_ms is not None and median_ms > args.budget_ms:
+        print(f"FAIL: import time {median_ms:.1f} ms exceeds budget {args.budget_ms:.1f} ms")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+"""
+Streaming translator memory benchmark.
+
+Runs N concurrent streams (default 1000) through
+AnthropicStreamTranslator, each a short text preamble followed by one large
+tool call (e.g. a file write) split into many argument fragments. All
+streams advance in lock-step, so every translator is alive at once, and
+tracemalloc reports the peak Python heap attributable to translator state.
+Compare --validate (incremental JSON validation of the arguments) with the
+default forward-only mode.
+
+    uv run benchmarks/stream_memory.py --streams 1000 --tool-kb 32
+    uv run benchmarks/stream_memory.py --streams 1000 --tool-kb 32 --validate
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import pathlib
+import sys
+import time
+import tracemalloc
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src"))
+os.environ.setdefault("OPENAI_API_KEY", "bench-key")
+os.environ.setdefault("BIG_MODEL_NAME", "bench/big")
+os.environ.setdefault("SMALL_MODEL_NAME", "bench/small")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ["LOG_FILE_PATH"] = ""
+
+import main  # noqa: E402
+
+
+class _CheapEncoder:
+    """Keeps tiktoken's own allocations out of the measurement."""
+
+    def encode(self, text: str) -> range:
+        return range(len(text) // 4)
+
+
+def build_chunks(tool_kb: int, fragment_chars: int):
+    payload = json.dumps({"path": "/repo/big_file.py", "content": "x = 1\n" * (tool_kb * 1024 // 6)})
+    chunks = [{"choices": [{"index": 0, "delta": {"content": "Writing the file now."}}]}]
+    for i in range(0, len(payload), fragment_chars):
+        call = {"index": 0, "function": {"arguments": payload[i : i + fragment_chars]}}
+        if i == 0:
+            call.update(id="call_1", type="function")
+            call["function"]["name"] = "Write"
+        chunks.append({"choices": [{"index": 0, "delta": {"tool_calls": [call]}}]})
+    chunks.append({"choices": [{"index": 0, "delta": {}, "finish_reason": "tool_calls"}]})
+    # each stream decodes its own copy, so argument strings aren't shared
+    return [json.dumps(c) for c in chunks]
+
+
+async def run_stream(chunks, validate: bool, barrier_every: int) -> int:
+    translator = main.AnthropicStreamTranslator(
+        "claude-sonnet", 1000, "bench", _CheapEncoder(), validate_tool_arguments=validate
+    )
+    sent = sum(len(e) for e in translator.start())
+    for i, line in enumerate(chunks):
+        for event in translator.feed(main._RawChunk(json.loads(line))):
+            sent += len(event)  # events are handed to the transport and dropped
+        if i % barrier_every == 0:
+            await asyncio.sleep(0)
+    sent += sum(len(e) for e in translator.finish())
+    return sent
+
+
+async def run_all(streams: int, chunks, validate: bool, barrier_every: int) -> int:
+    results = await asyncio.gather(*(run_stream(chunks, validate, barrier_every) for _ in range(streams)))
+    return sum(results)
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--streams", type=int, default=1000)
+    parser.add_argument("--tool-kb", type=int, default=32)
+    parser.add_argument("--fragment-chars", type=int, default=64)
+    parser.add_argument("--validate", action="store_true", help="validate arguments incrementally")
+    parser.add_argument("--barrier-every", type=int, default=1, help="yield to the loop every N chunks")
+    args = parser.parse_args()
+
+    main.get_token_encoder = lambda *a, **k: _CheapEncoder()  # type: ignore[assignment]
+    chunks = build_chunks(args.tool_kb, args.fragment_chars)
+
+    tracemalloc.start()
+    baseline, _ = tracemalloc.get_traced_memory()
+    started = time.perf_counter()
+    sent = asyncio.run(run_all(args.streams, chunks, args.validate, args.barrier_every))
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    peak_mb = (peak - baseline) / 2**20
+    print(f"streams            {args.streams} x {len(chunks)} chunks ({args.tool_kb} KiB tool call each)")
+    print(f"validate           {args.validate}")
+    print(f"peak heap          {peak_mb:.1f} MiB ({peak_mb * 1024 / args.streams:.1f} KiB per stream)")
+    print(f"SSE bytes          {sent / 2**20:.1f} MiB in {elapsed:.2f} s (tracemalloc on)")
+
+
+if __name__ == "__main__":
+    main_cli()
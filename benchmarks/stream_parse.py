@@ -0,0 +1,103 @@
+"""
+Streaming translator throughput: OpenAI SDK chunks vs the raw SSE path.
+
+Feeds the same synthetic upstream SSE body (text deltas followed by a long
+tool call) through both upstream modes via an in-process httpx transport
+and drains handle_anthropic_streaming_response_from_openai_stream. Reports
+chunks per CPU-second, i.e. chunks/sec per core.
+
+    uv run benchmarks/stream_parse.py --chunks 5000 --repeat 5
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import pathlib
+import sys
+import time
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src"))
+os.environ.setdefault("OPENAI_API_KEY", "bench-key")
+os.environ.setdefault("BIG_MODEL_NAME", "bench/big")
+os.environ.setdefault("SMALL_MODEL_NAME", "bench/small")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ["LOG_FILE_PATH"] = ""
+
+import httpx  # noqa: E402
+import openai  # noqa: E402
+
+import main  # noqa: E402
+
+
+def build_sse_body(n_chunks: int) -> bytes:
+    text_chunks = n_chunks // 2
+    tool_chunks = n_chunks - text_chunks
+    events = [
+        {"id": "gen-1", "object": "chat.completion.chunk", "created": 0, "model": "bench",
+         "choices": [{"index": 0, "delta": {"role": "assistant", "content": f"token{i} "}, "finish_reason": None}]}
+        for i in range(text_chunks)
+    ]
+    events.append(
+        {"id": "gen-1", "object": "chat.completion.chunk", "created": 0, "model": "bench",
+         "choices": [{"index": 0, "delta": {"tool_calls": [
+             {"index": 0, "id": "call_1", "type": "function", "function": {"name": "write_file", "arguments": "{\"content\": \""}}
+         ]}, "finish_reason": None}]}
+    )
+    events.extend(
+        {"id": "gen-1", "object": "chat.completion.chunk", "created": 0, "model": "bench",
+         "choices": [{"index": 0, "delta": {"tool_calls": [
+             {"index": 0, "function": {"arguments": "line of file content\\n"}}
+         ]}, "finish_reason": None}]}
+        for _ in range(tool_chunks - 2)
+    )
+    events.append(
+        {"id": "gen-1", "object": "chat.completion.chunk", "created": 0, "model": "bench",
+         "choices": [{"index": 0, "delta": {"tool_calls": [{"index": 0, "function": {"arguments": "\"}"}}]},
+                      "finish_reason": "tool_calls"}]}
+    )
+    body = "".join(f"data: {json.dumps(e)}\n\n" for e in events) + "data: [DONE]\n\n"
+    return body.encode()
+
+
+async def drain(mode: str, body: bytes) -> None:
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, content=body, headers={"content-type": "text/event-stream"}))
+    params = {"model": "bench", "messages": [{"role": "user", "content": "hi"}], "stream": True}
+    if mode == "raw":
+        main._upstream_http_client = httpx.AsyncClient(transport=transport, base_url="http://bench/v1/")
+        stream = await main._safe_create_raw_stream(params, "bench")
+    else:
+        main._openai_client = openai.AsyncClient(
+            api_key="bench", base_url="http://bench/v1", http_client=httpx.AsyncClient(transport=transport)
+        )
+        stream = await main._safe_create_completion_stream(params, "bench")
+    async for _ in main.handle_anthropic_streaming_response_from_openai_stream(
+        stream, "claude-sonnet", 100, "bench", time.monotonic()
+    ):
+        pass
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    body = build_sse_body(args.chunks)
+    main.get_token_encoder()  # keep tokenizer loading out of the measurement
+    results = {}
+    for mode in ("sdk", "raw"):
+        asyncio.run(drain(mode, body))  # warm-up
+        cpu = time.process_time()
+        for _ in range(args.repeat):
+            asyncio.run(drain(mode, body))
+        cpu = time.process_time() - cpu
+        results[mode] = args.chunks * args.repeat / cpu
+        print(f"{mode:>4}: {results[mode]:>10.0f} chunks/s per core ({cpu / args.repeat * 1000:.1f} ms CPU per stream)")
+    print(f"raw/sdk speedup: {results['raw'] / results['sdk']:.2f}x")
+
+
+if __name__ == "__main__":
+    main_cli()
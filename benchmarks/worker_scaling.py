@@ -0,0 +1,109 @@
+"""
+Worker scaling benchmark.
+
+Starts the proxy with WORKERS=1,2,4,... and drives /v1/messages/count_tokens
+(pure CPU: validation + tiktoken, no upstream) with concurrent clients.
+Throughput should grow roughly linearly with the worker count until the
+machine runs out of cores.
+
+    uv run benchmarks/worker_scaling.py --workers 1 2 4 --duration 10
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import pathlib
+import subprocess
+import sys
+import time
+
+import httpx
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+PAYLOAD = {
+    "model": "claude-sonnet-4",
+    "system": "You are Claude Code. " * 200,
+    "messages": [
+        {"role": "user", "content": "Refactor the module below.\n" + "def f(x):\n    return x\n" * 400},
+        {"role": "assistant", "content": "Sure, reading the file first."},
+    ],
+}
+
+
+async def _wait_ready(client: httpx.AsyncClient, url: str, timeout_s: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get(url)).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"proxy at {url} did not become ready")
+
+
+async def _drive(base_url: str, concurrency: int, duration_s: float) -> float:
+    done = 0
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        await _wait_ready(client, "/")
+        stop_at = time.monotonic() + duration_s
+
+        async def worker() -> None:
+            nonlocal done
+            while time.monotonic() < stop_at:
+                resp = await client.post("/v1/messages/count_tokens", json=PAYLOAD)
+                resp.raise_for_status()
+                done += 1
+
+        started = time.monotonic()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return done / (time.monotonic() - started)
+
+
+def run(workers: int, port: int, concurrency: int, duration_s: float) -> float:
+    env = {
+        **os.environ,
+        "WORKERS": str(workers),
+        "RELOAD": "false",
+        "PORT": str(port),
+        "LOG_LEVEL": "WARNING",
+        "LOG_FILE_PATH": "",
+        "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "bench-key"),
+        "BIG_MODEL_NAME": os.environ.get("BIG_MODEL_NAME", "bench/big"),
+        "SMALL_MODEL_NAME": os.environ.get("SMALL_MODEL_NAME", "bench/small"),
+    }
+    proc = subprocess.Popen(
+        [sys.executable, str(ROOT / "src" / "main.py")],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        return asyncio.run(_drive(f"http://127.0.0.1:{port}", concurrency, duration_s))
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--concurrency-per-worker", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--port", type=int, default=18080)
+    args = parser.parse_args()
+
+    baseline = None
+    print(f"{'workers':>8} {'req/s':>10} {'speedup':>8} {'efficiency':>10}")
+    for n in args.workers:
+        rps = run(n, args.port, args.concurrency_per_worker * n, args.duration)
+        baseline = baseline or rps / n
+        speedup = rps / baseline
+        print(f"{n:>8} {rps:>10.1f} {speedup:>8.2f} {speedup / n:>10.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,11 +6,10 @@ from __future__ import annotations
 import functools
 import json
 import logging
+import os
 import pathlib
 import time
-from typing import Final
-
-import requests  # add to your deps; tiny
+from typing import Final, NamedTuple, Optional
 
 # ---------------------------------------------------------------------------
 # CONFIGURATION
@@ -109,6 +108,8 @@ MODEL_CAPABILITIES_OVERRIDES: dict[str, set[str]] = {
 
 def _remote_supported_models() -> list[dict]:
     """Hit OpenRouter and return raw JSON list."""
+    import requests  # only needed when a refresh actually happens
+
     resp = requests.get(OPENROUTER_ENDPOINT, timeout=10)
     resp.raise_for_status()
     return resp.json()["data"]
@@ -129,7 +130,10 @@ def _ensure_fresh_local_copy() -> None:
 
     try:
         data = _remote_supported_models()
-        CAPS_PATH.write_text(json.dumps({"data": data}, indent=2))
+        # write-then-rename so concurrent workers never read a partial file
+        tmp_path = CAPS_PATH.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps({"data": data}, indent=2))
+        os.replace(tmp_path, CAPS_PATH)
         logging.info("Refreshed %s (%s models)", CAPS_PATH.name, len(data))
     except Exception as exc:
         logging.warning("Could not refresh model list: %s", exc)
@@ -148,6 +152,67 @@ def _load_capabilities_file() -> dict[str, set[str]]:
         return {}
 
 
+class ModelLimits(NamedTuple):
+    context_length: Optional[int]
+    max_completion_tokens: Optional[int]
+
+
+@functools.lru_cache(maxsize=1)
+def _load_model_limits_file() -> dict[str, ModelLimits]:
+    try:
+        parsed = json.loads(CAPS_PATH.read_text())["data"]
+    except Exception as exc:
+        logging.warning("Model limits unavailable: %s", exc)
+        return {}
+
+    limits: dict[str, ModelLimits] = {}
+    for m in parsed:
+        top = m.get("top_provider") or {}
+        limits[m["id"]] = ModelLimits(
+            context_length=top.get("context_length") or m.get("context_length"),
+            max_completion_tokens=top.get("max_completion_tokens"),
+        )
+    return limits
+
+
+class ModelPricing(NamedTuple):
+    """USD per token (prompt / completion) and per request, from the catalog."""
+
+    prompt: float
+    completion: float
+    request: float
+
+    def cost(self, prompt_tokens: int, completion_tokens: int) -> float:
+        return self.prompt * prompt_tokens + self.completion * completion_tokens + self.request
+
+
+def _price(value: object) -> float:
+    try:
+        return float(value)  # the catalog quotes prices as strings
+    except (TypeError, ValueError):
+        return 0.0
+
+
+@functools.lru_cache(maxsize=1)
+def _load_model_pricing_file() -> dict[str, ModelPricing]:
+    try:
+        parsed = json.loads(CAPS_PATH.read_text())["data"]
+    except Exception as exc:
+        logging.warning("Model pricing unavailable: %s", exc)
+        return {}
+
+    pricing: dict[str, ModelPricing] = {}
+    for m in parsed:
+        raw = m.get("pricing")
+        if isinstance(raw, dict):
+            pricing[m["id"]] = ModelPricing(
+                prompt=_price(raw.get("prompt")),
+                completion=_price(raw.get("completion")),
+                request=_price(raw.get("request")),
+            )
+    return pricing
+
+
 def _merge_with_overrides(base: dict[str, set[str]]) -> dict[str, set[str]]:
     merged: dict[str, set[str]] = {**base}  # shallow copy
     for mid, caps in MODEL_CAPABILITIES_OVERRIDES.items():
@@ -171,11 +236,36 @@ def get_model_capabilities() -> dict[str, set[str]]:
     return _get_capabilities_cached()
 
 
+def refresh_catalog() -> None:
+    """
+    Re-fetches the OpenRouter list if stale and drops the parsed caches.
+    Blocking (network + disk) – the proxy runs it in a background thread.
+    """
+    _ensure_fresh_local_copy()
+    _load_capabilities_file.cache_clear()
+    _load_model_limits_file.cache_clear()
+    _load_model_pricing_file.cache_clear()
+    _get_capabilities_cached.cache_clear()
+
+
 @functools.lru_cache(maxsize=1)
 def _get_capabilities_cached() -> dict[str, set[str]]:
     return _merge_with_overrides(_load_capabilities_file())
 
 
+def get_model_limits(model_name: str) -> Optional[ModelLimits]:
+    """
+    Context window / completion cap for *model_name* from the catalog.
+    Returns None for models the catalog doesn't know about.
+    """
+    return _load_model_limits_file().get(model_name)
+
+
+def get_model_pricing(model_name: str) -> Optional[ModelPricing]:
+    """Catalog pricing for *model_name*; None for models it doesn't list."""
+    return _load_model_pricing_file().get(model_name)
+
+
 # Providers that ARE tool-capable (prefix match, case-insensitive)
 TOOL_CAPABLE_PREFIXES = (
     "gpt-", "openai/",           # OpenAI
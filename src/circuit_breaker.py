@@ -0,0 +1,185 @@
+"""
+circuit_breaker.py – fail fast on upstream models that keep failing.
+
+One breaker per (upstream base URL, target model). Each one has three states:
+
+  closed     calls go through; `failure_threshold` consecutive failures
+             (429, 5xx, connection errors and timeouts, as classified by
+             the caller) open it
+  open       calls raise CircuitOpenError at once for `open_duration_s`,
+             so the caller can go to a fallback model or answer
+             overloaded_error instead of waiting out another timeout
+  half-open  after that, up to `half_open_max_calls` probe calls go
+             through; a success closes the breaker, a failure reopens it
+             for another `open_duration_s`
+
+Other errors (400s, cancellations) neither trip nor reset a breaker; they
+only hand a half-open probe slot back. A call that gets its failure as a
+response rather than an exception (a relayed 503) reports it with
+mark_failed(). State changes happen lazily on the next call, so there are
+no timers, and the clock is injectable for tests.
+"""
+from __future__ import annotations
+
+import time
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from metrics import Metric
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+_STATE_VALUES = {CLOSED: 0.0, HALF_OPEN: 1.0, OPEN: 2.0}
+
+BreakerKey = Tuple[str, str]  # (upstream, model)
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, key: BreakerKey, retry_after_s: float) -> None:
+        super().__init__(
+            f"Model '{key[1]}' is failing at {key[0]}; circuit open for another "
+            f"{retry_after_s:.0f}s."
+        )
+        self.key = key
+        self.retry_after_s = retry_after_s
+
+
+class _Breaker:
+    __slots__ = ("state", "failures", "opened_at", "probes", "rejected")
+
+    def __init__(self) -> None:
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probes = 0
+        self.rejected = 0
+
+
+class _Call:
+    """Context manager for one guarded call; classifies how it ended."""
+
+    __slots__ = ("_breakers", "_key", "_probe", "_failed")
+
+    def __init__(self, breakers: "CircuitBreakers", key: BreakerKey, probe: bool) -> None:
+        self._breakers = breakers
+        self._key = key
+        self._probe = probe
+        self._failed = False
+
+    def mark_failed(self) -> None:
+        """Counts the call as a failure even though it raises nothing."""
+        self._failed = True
+
+    def __enter__(self) -> "_Call":
+        return self
+
+    def __exit__(self, exc_type: object, exc: Optional[BaseException], tb: object) -> None:
+        if exc is None:
+            outcome: Optional[bool] = not self._failed
+        elif isinstance(exc, Exception) and self._breakers.is_failure(exc):
+            outcome = False
+        else:
+            outcome = None
+        self._breakers._finish(self._key, self._probe, outcome)
+
+
+class CircuitBreakers:
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        open_duration_s: float = 30.0,
+        half_open_max_calls: int = 1,
+        is_failure: Callable[[Exception], bool] = lambda exc: True,
+        on_state_change: Optional[Callable[[BreakerKey, str, str], None]] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.failure_threshold = failure_threshold
+        self.open_duration_s = open_duration_s
+        self.half_open_max_calls = max(1, half_open_max_calls)
+        self.is_failure = is_failure
+        self.on_state_change = on_state_change
+        self.clock = clock
+        self._breakers: Dict[BreakerKey, _Breaker] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.failure_threshold > 0
+
+    def _set_state(self, key: BreakerKey, breaker: _Breaker, state: str) -> None:
+        previous, breaker.state = breaker.state, state
+        if self.on_state_change is not None and previous != state:
+            self.on_state_change(key, previous, state)
+
+    def state(self, key: BreakerKey) -> str:
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            return CLOSED
+        if breaker.state == OPEN and self.clock() - breaker.opened_at >= self.open_duration_s:
+            return HALF_OPEN  # the next call will be a probe
+        return breaker.state
+
+    def guard(self, key: BreakerKey) -> _Call:
+        """
+        `with breakers.guard(key): ...` around one upstream call. Raises
+        CircuitOpenError instead of entering while the breaker is open or
+        all half-open probes are taken.
+        """
+        if not self.enabled:
+            return _Call(self, key, probe=False)
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            breaker = self._breakers[key] = _Breaker()
+        if breaker.state == CLOSED:
+            return _Call(self, key, probe=False)
+        if breaker.state == OPEN:
+            remaining = breaker.opened_at + self.open_duration_s - self.clock()
+            if remaining > 0:
+                breaker.rejected += 1
+                raise CircuitOpenError(key, remaining)
+            self._set_state(key, breaker, HALF_OPEN)
+        if breaker.probes >= self.half_open_max_calls:
+            breaker.rejected += 1
+            raise CircuitOpenError(key, 0.0)
+        breaker.probes += 1
+        return _Call(self, key, probe=True)
+
+    def _finish(self, key: BreakerKey, probe: bool, outcome: Optional[bool]) -> None:
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            return
+        if probe:
+            breaker.probes -= 1
+        if outcome is None:
+            return
+        if outcome:
+            breaker.failures = 0
+            if breaker.state == HALF_OPEN and probe:
+                self._set_state(key, breaker, CLOSED)
+            return
+        breaker.failures += 1
+        if breaker.state == HALF_OPEN and probe or (
+            breaker.state == CLOSED and breaker.failures >= self.failure_threshold
+        ):
+            breaker.opened_at = self.clock()
+            self._set_state(key, breaker, OPEN)
+
+    def collect(self) -> Iterable[Metric]:
+        items = list(self._breakers)
+        yield Metric(
+            "proxy_circuit_breaker_state",
+            "Circuit breaker per upstream and target model: 0 closed, 1 half-open, 2 open.",
+            "gauge",
+            [
+                ({"upstream": upstream, "model": model}, _STATE_VALUES[self.state((upstream, model))])
+                for upstream, model in items
+            ],
+        )
+        yield Metric(
+            "proxy_circuit_breaker_rejections_total",
+            "Upstream calls failed fast by an open circuit breaker.",
+            "counter",
+            [
+                ({"upstream": upstream, "model": model}, float(self._breakers[(upstream, model)].rejected))
+                for upstream, model in items
+            ],
+        )
@@ -0,0 +1,247 @@
+"""
+fair_share.py – per-user budgets and fair scheduling of upstream calls.
+
+Users are identified by the Anthropic request's `metadata.user_id` (Claude
+Code always sends one); requests without it share one "anonymous" user.
+
+UserBudgets enforces fixed-window request and token budgets. The counters
+live in the StateBackend, so with STATE_BACKEND=redis every worker draws
+from the same budget. admit() counts the request and raises BudgetExceeded,
+with the seconds until the window resets, once either budget is spent;
+charge() adds a finished request's tokens.
+
+FairQueue caps concurrent upstream calls and, when callers have to wait,
+hands out freed slots by deficit round robin over users: each turn tops a
+user's deficit up by quantum x weight tokens, and their oldest waiter goes
+when the deficit covers its cost (prompt + max_tokens). Under contention
+each user gets a share of tokens proportional to their weight, however many
+requests they queue; uncontended calls never wait. Passes over the ring that
+would serve nobody are added up in one step rather than looped through, so a
+200k-token request costs the same to schedule as a 1k-token one.
+"""
+from __future__ import annotations
+
+import asyncio
+import collections
+import math
+import time
+from typing import Deque, Dict, Iterable, Mapping, NamedTuple, Optional, Tuple
+
+from metrics import Metric
+from state_backend import StateBackend
+
+ANONYMOUS_USER = "anonymous"
+
+
+class BudgetExceeded(Exception):
+    def __init__(self, message: str, retry_after_s: float) -> None:
+        super().__init__(message)
+        self.retry_after_s = retry_after_s
+
+
+class UserBudgets:
+    def __init__(
+        self,
+        backend: StateBackend,
+        request_budget: int = 0,
+        token_budget: int = 0,
+        window_s: float = 60.0,
+    ) -> None:
+        self.backend = backend
+        self.request_budget = request_budget
+        self.token_budget = token_budget
+        self.window_s = window_s
+
+    @property
+    def enabled(self) -> bool:
+        return self.request_budget > 0 or self.token_budget > 0
+
+    def _window(self) -> Tuple[int, float]:
+        # wall clock, so every worker agrees on the window boundaries
+        now = time.time()
+        index = int(now // self.window_s)
+        return index, (index + 1) * self.window_s - now
+
+    async def admit(self, user_id: Optional[str]) -> None:
+        """Counts one request; raises BudgetExceeded when either budget is spent."""
+        if not self.enabled:
+            return
+        user = user_id or ANONYMOUS_USER
+        index, remaining_s = self._window()
+        if self.token_budget > 0:
+            used = float(await self.backend.get(f"budget:{user}:{index}:tokens") or 0)
+            if used >= self.token_budget:
+                raise BudgetExceeded(
+                    f"User '{user}' used {int(used)} of {self.token_budget} tokens "
+                    f"allowed per {self.window_s:g}s.",
+                    remaining_s,
+                )
+        if self.request_budget > 0:
+            count = await self.backend.incr(
+                f"budget:{user}:{index}:requests", 1, ttl_s=self.window_s + 1
+            )
+            if count > self.request_budget:
+                raise BudgetExceeded(
+                    f"User '{user}' exceeded {self.request_budget} requests "
+                    f"per {self.window_s:g}s.",
+                    remaining_s,
+                )
+
+    async def charge(self, user_id: Optional[str], tokens: int) -> None:
+        if self.token_budget <= 0 or tokens <= 0:
+            return
+        index, _ = self._window()
+        await self.backend.incr(
+            f"budget:{user_id or ANONYMOUS_USER}:{index}:tokens",
+            tokens,
+            ttl_s=self.window_s + 1,
+        )
+
+
+class _Waiter(NamedTuple):
+    future: "asyncio.Future[None]"
+    cost: int
+
+
+class FairQueueSlot:
+    """One granted upstream call; release() is idempotent."""
+
+    __slots__ = ("_queue", "user", "waited_s")
+
+    def __init__(self, queue: Optional["FairQueue"], user: str, waited_s: float) -> None:
+        self._queue = queue
+        self.user = user
+        self.waited_s = waited_s
+
+    def release(self) -> None:
+        queue, self._queue = self._queue, None
+        if queue is not None:
+            queue._release()
+
+
+class FairQueue:
+    def __init__(
+        self,
+        max_concurrency: int,
+        quantum: int = 1024,
+        weights: Optional[Mapping[str, float]] = None,
+    ) -> None:
+        self.max_concurrency = max_concurrency
+        self.quantum = quantum
+        self.weights = dict(weights or {})
+        self.active = 0
+        self._queues: Dict[str, Deque[_Waiter]] = {}
+        # users with waiters, in round-robin order; the head is on its turn
+        self._ring: Deque[str] = collections.deque()
+        self._deficit: Dict[str, float] = {}
+        self._turn_topped_up = False
+        self._immediate_total = 0
+        self._queued_total = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_concurrency > 0
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    async def acquire(self, user_id: Optional[str], cost: int) -> FairQueueSlot:
+        user = user_id or ANONYMOUS_USER
+        if not self.enabled:
+            return FairQueueSlot(None, user, 0.0)
+        if self.active < self.max_concurrency and not self._ring:
+            self.active += 1
+            self._immediate_total += 1
+            return FairQueueSlot(self, user, 0.0)
+
+        self._queued_total += 1
+        future: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+        queue = self._queues.get(user)
+        if queue is None:
+            queue = self._queues[user] = collections.deque()
+            self._ring.append(user)
+            self._deficit[user] = 0.0
+        queue.append(_Waiter(future, max(1, cost)))
+        started = time.monotonic()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release()  # granted in the same tick the caller went away
+            else:
+                future.cancel()
+                self._dispatch()
+            raise
+        return FairQueueSlot(self, user, time.monotonic() - started)
+
+    def _release(self) -> None:
+        self.active -= 1
+        self._dispatch()
+
+    def _top_up(self, user: str) -> float:
+        return self.quantum * max(self.weights.get(user, 1.0), 0.01)
+
+    def _skip_idle_passes(self) -> None:
+        # Every user was just topped up and none could send its head request:
+        # credit the passes that would serve nobody in one go, leaving the
+        # last one to the loop so grants keep the usual ring order.
+        passes = min(
+            math.ceil((self._queues[user][0].cost - self._deficit[user]) / self._top_up(user))
+            for user in self._ring
+        )
+        if passes > 1:
+            for user in self._ring:
+                self._deficit[user] += (passes - 1) * self._top_up(user)
+
+    def _dispatch(self) -> None:
+        ring = self._ring
+        idle_turns = 0  # turns in a row that granted nothing
+        while self.active < self.max_concurrency and ring:
+            user = ring[0]
+            queue = self._queues[user]
+            while queue and queue[0].future.done():  # cancelled while waiting
+                queue.popleft()
+            if not queue:
+                ring.popleft()
+                del self._queues[user]
+                del self._deficit[user]  # an idle user keeps no credit
+                self._turn_topped_up = False
+                idle_turns = 0
+                continue
+            if not self._turn_topped_up:
+                self._deficit[user] += self._top_up(user)
+                self._turn_topped_up = True
+            head = queue[0]
+            if self._deficit[user] >= head.cost:
+                self._deficit[user] -= head.cost
+                queue.popleft()
+                self.active += 1
+                head.future.set_result(None)
+                idle_turns = 0
+                continue
+            # the credit left doesn't cover the next request: next user's turn
+            ring.rotate(-1)
+            self._turn_topped_up = False
+            idle_turns += 1
+            if idle_turns >= len(ring):
+                self._skip_idle_passes()
+                idle_turns = 0
+
+    def collect(self) -> Iterable[Metric]:
+        yield Metric(
+            "proxy_fair_queue_slots",
+            "Upstream calls in flight (active) and waiting for a fair-queue slot.",
+            "gauge",
+            [({"state": "active"}, float(self.active)), ({"state": "waiting"}, float(self.waiting))],
+        )
+        yield Metric(
+            "proxy_fair_queue_requests_total",
+            "Upstream calls that got a slot at once (queued=false) or had to wait for one.",
+            "counter",
+            [({"queued": "false"}, float(self._immediate_total)), ({"queued": "true"}, float(self._queued_total))],
+        )
+
+
+def retry_after_header(seconds: float) -> str:
+    return str(max(1, math.ceil(seconds)))
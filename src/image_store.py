@@ -0,0 +1,228 @@
+"""
+image_store.py – content-addressed cache for base64 image blocks.
+
+Claude Code re-sends every screenshot on each turn. The store hashes the
+base64 payload once, keeps the ready-made data URL (optionally downscaled /
+recompressed when Pillow is installed) and a dimension-based token estimate,
+so repeated images cost a dict lookup instead of a multi-megabyte rebuild.
+The store is bounded by entry count and by the total size of the cached data
+URLs, whichever is hit first.
+"""
+from __future__ import annotations
+
+import base64
+import binascii
+import hashlib
+import io
+import struct
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Final, Optional, Tuple
+
+try:  # optional: only needed for downscaling / recompression
+    from PIL import Image  # type: ignore[import-not-found]
+except ImportError:  # pragma: no cover - depends on environment
+    Image = None
+
+# Flat estimate used when the image dimensions can't be determined
+DEFAULT_IMAGE_TOKENS: Final = 768
+
+# Anthropic resizes images whose long edge exceeds this before tokenizing,
+# then charges roughly (width * height) / 750 tokens.
+_MAX_BILLED_EDGE: Final = 1568
+_PIXELS_PER_TOKEN: Final = 750
+
+
+@dataclass(frozen=True)
+class ImageEntry:
+    data_url: str
+    media_type: str
+    width: Optional[int]
+    height: Optional[int]
+    tokens: int
+    original_bytes: int
+    stored_bytes: int
+
+
+# ---------------------------------------------------------------------------
+# INTERNALS
+# ---------------------------------------------------------------------------
+
+
+def _jpeg_size(raw: bytes) -> Optional[Tuple[int, int]]:
+    i = 2
+    n = len(raw)
+    while i + 9 < n:
+        if raw[i] != 0xFF:
+            i += 1
+            continue
+        marker = raw[i + 1]
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            i += 2
+            continue
+        (seg_len,) = struct.unpack(">H", raw[i + 2 : i + 4])
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack(">HH", raw[i + 5 : i + 9])
+            return width, height
+        i += 2 + seg_len
+    return None
+
+
+def image_dimensions(raw: bytes) -> Optional[Tuple[int, int]]:
+    """(width, height) parsed from PNG / GIF / WebP / JPEG headers, else None."""
+    try:
+        if raw.startswith(b"\x89PNG\r\n\x1a\n") and len(raw) >= 24:
+            return struct.unpack(">II", raw[16:24])
+        if raw[:6] in (b"GIF87a", b"GIF89a") and len(raw) >= 10:
+            return struct.unpack("<HH", raw[6:10])
+        if raw[:4] == b"RIFF" and raw[8:12] == b"WEBP" and len(raw) >= 30:
+            chunk = raw[12:16]
+            if chunk == b"VP8 ":
+                w, h = struct.unpack("<HH", raw[26:30])
+                return w & 0x3FFF, h & 0x3FFF
+            if chunk == b"VP8L":
+                bits = int.from_bytes(raw[21:25], "little")
+                return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+            if chunk == b"VP8X":
+                w = int.from_bytes(raw[24:27], "little") + 1
+                h = int.from_bytes(raw[27:30], "little") + 1
+                return w, h
+        if raw[:2] == b"\xff\xd8":
+            return _jpeg_size(raw)
+    except struct.error:
+        return None
+    return None
+
+
+def estimate_image_tokens(width: Optional[int], height: Optional[int]) -> int:
+    """Anthropic-style estimate: downscale to the billed edge, ~750 px per token."""
+    if not width or not height:
+        return DEFAULT_IMAGE_TOKENS
+    scale = min(1.0, _MAX_BILLED_EDGE / max(width, height))
+    return max(1, int((width * scale) * (height * scale) / _PIXELS_PER_TOKEN))
+
+
+def _recompress(
+    raw: bytes,
+    media_type: str,
+    max_dimension: Optional[int],
+    max_bytes: Optional[int],
+) -> Optional[Tuple[bytes, str, Tuple[int, int]]]:
+    """Downscale / recompress with Pillow; None when not needed or not possible."""
+    if Image is None:
+        return None
+    try:
+        img = Image.open(io.BytesIO(raw))
+        original_size = img.size
+        if max_dimension and max(img.size) > max_dimension:
+            img.thumbnail((max_dimension, max_dimension))
+
+        fmt = "PNG" if media_type == "image/png" else "JPEG"
+        out = io.BytesIO()
+        if fmt == "PNG":
+            img.save(out, format="PNG", optimize=True)
+        if fmt == "JPEG" or (max_bytes and out.tell() > max_bytes):
+            fmt = "JPEG"
+            if img.mode not in ("RGB", "L"):
+                img = img.convert("RGB")
+            for quality in (85, 70, 55, 40):
+                out = io.BytesIO()
+                img.save(out, format="JPEG", quality=quality, optimize=True)
+                if not max_bytes or out.tell() <= max_bytes:
+                    break
+        data = out.getvalue()
+        if len(data) >= len(raw) and img.size == original_size:
+            return None
+        return data, f"image/{fmt.lower()}", img.size
+    except Exception:
+        return None
+
+
+# ---------------------------------------------------------------------------
+# PUBLIC API
+# ---------------------------------------------------------------------------
+
+
+class ImageStore:
+    """LRU map of payload digest -> ImageEntry."""
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        max_dimension: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        max_cache_bytes: int = 64 * 1024 * 1024,
+    ) -> None:
+        self.max_entries = max_entries
+        self.max_dimension = max_dimension
+        self.max_bytes = max_bytes
+        self.max_cache_bytes = max_cache_bytes
+        self._entries: "OrderedDict[str, ImageEntry]" = OrderedDict()
+        self.cached_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def digest(media_type: str, data: str) -> str:
+        h = hashlib.blake2b(media_type.encode(), digest_size=16)
+        h.update(data.encode("ascii", errors="replace"))
+        return h.hexdigest()
+
+    def get(self, media_type: str, data: str) -> ImageEntry:
+        key = self.digest(media_type, data)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+        entry = self._build(media_type, data)
+        size = len(entry.data_url)
+        if size > self.max_cache_bytes:
+            return entry  # would evict everything else; not worth caching
+        self._entries[key] = entry
+        self.cached_bytes += size
+        while len(self._entries) > self.max_entries or self.cached_bytes > self.max_cache_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.cached_bytes -= len(evicted.data_url)
+        return entry
+
+    def _build(self, media_type: str, data: str) -> ImageEntry:
+        try:
+            raw = base64.b64decode(data, validate=False)
+        except (binascii.Error, ValueError):
+            raw = b""
+        size = image_dimensions(raw)
+        width, height = size if size else (None, None)
+        out_media_type, out_data = media_type, data
+
+        needs_resize = bool(
+            raw
+            and (
+                (self.max_dimension and size and max(size) > self.max_dimension)
+                or (self.max_bytes and len(raw) > self.max_bytes)
+            )
+        )
+        stored_bytes = len(raw)
+        if needs_resize:
+            recompressed = _recompress(
+                raw, media_type, self.max_dimension, self.max_bytes
+            )
+            if recompressed is not None:
+                new_raw, out_media_type, (width, height) = recompressed
+                out_data = base64.b64encode(new_raw).decode("ascii")
+                stored_bytes = len(new_raw)
+
+        return ImageEntry(
+            data_url=f"data:{out_media_type};base64,{out_data}",
+            media_type=out_media_type,
+            width=width,
+            height=height,
+            tokens=estimate_image_tokens(width, height),
+            original_bytes=len(raw),
+            stored_bytes=stored_bytes,
+        )
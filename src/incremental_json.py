@@ -0,0 +1,278 @@
+"""
+incremental_json.py – streaming JSON validator for tool-call arguments.
+
+IncrementalJSONValidator consumes a JSON document in arbitrary fragments
+(the `arguments` deltas of a streamed tool call) and keeps only a container
+stack, a lexer state and, at most, an unfinished number/literal/escape
+carried over to the next fragment. String bodies – the bulk of a file-write
+payload – are skipped with one regex call per fragment, so nothing is ever
+re-parsed and memory does not grow with the payload.
+
+After the last fragment, `complete` says whether a whole value arrived,
+`error` holds the first syntax error (with its character offset), and
+`closing_suffix()` returns the text that closes a truncated document, e.g.
+'{"path": "a.py", "content": "x = ' -> '"}'.
+"""
+from __future__ import annotations
+
+import re
+from typing import List, Optional
+
+# lexer states
+_VALUE = 0  # a value must follow (after ':', ',' in an array, or at the start)
+_VALUE_OR_CLOSE = 1  # just after '['
+_KEY = 2  # a key must follow (after ',' in an object)
+_KEY_OR_CLOSE = 3  # just after '{'
+_COLON = 4  # after an object key
+_AFTER_VALUE = 5  # ',' or a closing bracket (or the end, at top level)
+_STRING = 6  # inside a string value
+_KEY_STRING = 7  # inside an object key
+_ERROR = 8
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+# plain characters and simple escapes in one C-level match; unicode escapes and
+# escapes split across fragments fall back to the loop in _scan
+_STRING_BODY = re.compile(r'[^"\\\x00-\x1f]*(?:\\["\\/bfnrt][^"\\\x00-\x1f]*)*')
+_NUMBER_RUN = re.compile(r"[-+0-9.eE]+")
+_LITERAL_RUN = re.compile(r"[a-z]+")
+_NUMBER = re.compile(r"-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][-+]?[0-9]+)?")
+_NUMBER_PREFIX = re.compile(
+    r"-?(?:(?:0|[1-9][0-9]*)(?:\.(?:[0-9]+(?:[eE][-+]?[0-9]*)?)?|[eE][-+]?[0-9]*)?)?"
+)
+_HEX4 = re.compile(r"[0-9a-fA-F]{4}")
+_LITERALS = ("true", "false", "null")
+_SIMPLE_ESCAPES = frozenset('"\\/bfnrt')
+
+
+class IncrementalJSONValidator:
+    """Validates one JSON document fed in pieces; see the module docstring."""
+
+    __slots__ = ("_stack", "_state", "_carry", "_offset", "_started", "error", "error_offset")
+
+    def __init__(self) -> None:
+        self._stack: List[str] = []
+        self._state = _VALUE
+        # unfinished number, literal or escape sequence from the last fragment
+        self._carry = ""
+        self._offset = 0  # characters consumed before the current text
+        self._started = False
+        self.error: Optional[str] = None
+        self.error_offset: Optional[int] = None
+
+    # -- public --------------------------------------------------------------
+
+    @property
+    def empty(self) -> bool:
+        """Nothing but whitespace has been fed (upstreams send "" for no-arg calls)."""
+        return not self._started
+
+    @property
+    def complete(self) -> bool:
+        """A whole top-level value has been read and nothing is left open."""
+        if self.error is not None or not self._started:
+            return False
+        if self._carry:
+            return not self._stack and self._scalar_complete(self._carry)
+        return not self._stack and self._state == _AFTER_VALUE
+
+    def feed(self, fragment: str) -> bool:
+        """Consumes *fragment*; returns False once the document is invalid."""
+        if self._state == _ERROR:
+            return False
+        text = self._carry + fragment if self._carry else fragment
+        self._offset -= len(self._carry)
+        self._carry = ""
+        self._scan(text)
+        self._offset += len(text) - len(self._carry)
+        return self._state != _ERROR
+
+    def closing_suffix(self) -> Optional[str]:
+        """
+        Text that, appended to everything fed so far, makes valid JSON. ""
+        when already complete; None after a syntax error. Cut-off keys and
+        values are completed with null, and a dangling ',' in an object gets
+        an empty key, so the repaired document keeps every byte already sent.
+        """
+        if self.error is not None:
+            return None
+        if not self._started:
+            return "{}"
+        parts: List[str] = []
+        state = self._state
+        if self._carry:
+            parts.append(self._finish_carry(self._carry))
+            if state != _STRING and state != _KEY_STRING:
+                state = _AFTER_VALUE
+        if state == _STRING:
+            parts.append('"')
+            state = _AFTER_VALUE
+        elif state == _KEY_STRING:
+            parts.append('"')
+            state = _COLON
+        if state == _KEY:
+            parts.append('"":null')
+        elif state == _COLON:
+            parts.append(":null")
+        elif state == _VALUE:
+            parts.append("null")
+        for opener in reversed(self._stack):
+            parts.append("}" if opener == "{" else "]")
+        return "".join(parts)
+
+    # -- scanning ------------------------------------------------------------
+
+    def _fail(self, message: str, pos: int) -> None:
+        self._state = _ERROR
+        self.error = message
+        self.error_offset = self._offset + pos
+
+    def _scan(self, text: str) -> None:
+        pos = 0
+        end = len(text)
+        stack = self._stack
+        while pos < end:
+            state = self._state
+
+            if state == _STRING or state == _KEY_STRING:
+                pos = _STRING_BODY.match(text, pos).end()
+                if pos >= end:
+                    return
+                char = text[pos]
+                if char == '"':
+                    self._state = _COLON if state == _KEY_STRING else _AFTER_VALUE
+                    pos += 1
+                elif char == "\\":
+                    if pos + 1 >= end:
+                        self._carry = text[pos:]
+                        return
+                    escaped = text[pos + 1]
+                    if escaped == "u":
+                        if pos + 6 > end:
+                            if not re.fullmatch(r"[0-9a-fA-F]*", text[pos + 2 :]):
+                                return self._fail("Invalid \\u escape", pos)
+                            self._carry = text[pos:]
+                            return
+                        if not _HEX4.fullmatch(text, pos + 2, pos + 6):
+                            return self._fail("Invalid \\u escape", pos)
+                        pos += 6
+                    elif escaped in _SIMPLE_ESCAPES:
+                        pos += 2
+                    else:
+                        return self._fail("Invalid escape", pos)
+                else:
+                    return self._fail("Control character in string", pos)
+                continue
+
+            pos = _WHITESPACE.match(text, pos).end()
+            if pos >= end:
+                return
+            char = text[pos]
+
+            if state == _VALUE or state == _VALUE_OR_CLOSE:
+                if state == _VALUE_OR_CLOSE and char == "]":
+                    stack.pop()
+                    self._state = _AFTER_VALUE
+                    pos += 1
+                    continue
+                self._started = True
+                if char == "{":
+                    stack.append("{")
+                    self._state = _KEY_OR_CLOSE
+                    pos += 1
+                elif char == "[":
+                    stack.append("[")
+                    self._state = _VALUE_OR_CLOSE
+                    pos += 1
+                elif char == '"':
+                    self._state = _STRING
+                    pos += 1
+                elif char in "-0123456789":
+                    pos = self._scalar(text, pos, _NUMBER_RUN, self._number_ok)
+                    if pos < 0:
+                        return
+                elif char in "tfn":
+                    pos = self._scalar(text, pos, _LITERAL_RUN, self._literal_ok)
+                    if pos < 0:
+                        return
+                else:
+                    return self._fail(f"Unexpected {char!r} where a value was expected", pos)
+
+            elif state == _KEY or state == _KEY_OR_CLOSE:
+                if char == '"':
+                    self._state = _KEY_STRING
+                    pos += 1
+                elif char == "}" and state == _KEY_OR_CLOSE:
+                    stack.pop()
+                    self._state = _AFTER_VALUE
+                    pos += 1
+                else:
+                    return self._fail(f"Unexpected {char!r} where a key was expected", pos)
+
+            elif state == _COLON:
+                if char != ":":
+                    return self._fail(f"Expected ':' after key, got {char!r}", pos)
+                self._state = _VALUE
+                pos += 1
+
+            elif state == _AFTER_VALUE:
+                if not stack:
+                    return self._fail("Extra data after the top-level value", pos)
+                if char == ",":
+                    self._state = _KEY if stack[-1] == "{" else _VALUE
+                elif char == ("}" if stack[-1] == "{" else "]"):
+                    stack.pop()
+                    self._state = _AFTER_VALUE
+                else:
+                    return self._fail(f"Unexpected {char!r} after a value", pos)
+                pos += 1
+
+            else:
+                return
+
+    def _scalar(self, text: str, pos: int, run: "re.Pattern[str]", ok) -> int:
+        """Reads a number/literal; returns the new position, or -1 to stop."""
+        stop = run.match(text, pos).end()
+        token = text[pos:stop]
+        if stop >= len(text):  # may continue in the next fragment
+            if not ok(token, partial=True):
+                self._fail(f"Invalid token {token!r}", pos)
+                return -1
+            self._carry = token  # state stays _VALUE; rescanned with the next fragment
+            return -1
+        if not ok(token, partial=False):
+            self._fail(f"Invalid token {token!r}", pos)
+            return -1
+        self._state = _AFTER_VALUE
+        return stop
+
+    @staticmethod
+    def _number_ok(token: str, partial: bool) -> bool:
+        if partial:
+            return _NUMBER_PREFIX.fullmatch(token) is not None
+        return _NUMBER.fullmatch(token) is not None
+
+    @staticmethod
+    def _literal_ok(token: str, partial: bool) -> bool:
+        if partial:
+            return any(literal.startswith(token) for literal in _LITERALS)
+        return token in _LITERALS
+
+    # -- carry handling --------------------------------------------------------
+
+    def _scalar_complete(self, carry: str) -> bool:
+        if self._state in (_STRING, _KEY_STRING):
+            return False
+        return carry in _LITERALS or _NUMBER.fullmatch(carry) is not None
+
+    def _finish_carry(self, carry: str) -> str:
+        """Suffix completing a carried escape, literal or number."""
+        if carry[0] == "\\":
+            if len(carry) == 1:
+                return "\\"
+            return "0" * (6 - len(carry))  # pad a cut-off \\uXXXX
+        if carry[0] in "tfn":
+            literal = next(lit for lit in _LITERALS if lit.startswith(carry))
+            return literal[len(carry) :]
+        if _NUMBER.fullmatch(carry):
+            return ""
+        return "0"  # "-", "1.", "1e", "1e+" all become valid with one digit
@@ -0,0 +1,134 @@
+"""
+loop_watchdog.py – event-loop lag monitor and blocking-call detector.
+
+A heartbeat task sleeps for `interval_s` and records how late it wakes up;
+that lateness is the loop lag every other callback saw. A daemon thread
+watches the heartbeat: when it hasn't advanced for `threshold_s` past its
+due time, the loop is stuck inside a callback, so the thread grabs the
+loop thread's current stack (the blocking code itself) and hands it to
+`on_block` – once per blocking episode.
+"""
+from __future__ import annotations
+
+import asyncio
+import collections
+import sys
+import threading
+import time
+import traceback
+from typing import Callable, Deque, Dict, Iterable, List, Optional
+
+from metrics import Metric
+
+BlockHandler = Callable[[float, List[str]], None]
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class LoopWatchdog:
+    def __init__(
+        self,
+        interval_s: float = 0.05,
+        threshold_s: float = 0.1,
+        on_block: Optional[BlockHandler] = None,
+        window: int = 2048,
+    ) -> None:
+        self.interval_s = interval_s
+        self.threshold_s = threshold_s
+        self.on_block = on_block
+        self.blocked_count = 0
+        self._lags: Deque[float] = collections.deque(maxlen=window)
+        self._beat_due = 0.0
+        self._beat_seq = 0
+        self._reported_seq = -1
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    # -- loop side ---------------------------------------------------------
+
+    async def _heartbeat(self) -> None:
+        while True:
+            started = time.monotonic()
+            self._beat_due = started + self.interval_s
+            self._beat_seq += 1
+            await asyncio.sleep(self.interval_s)
+            self._lags.append(max(0.0, time.monotonic() - started - self.interval_s))
+
+    def start(self) -> None:
+        """Must be called from the event loop thread."""
+        if self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._beat_due = time.monotonic() + self.interval_s
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        self._thread = threading.Thread(
+            target=self._watch, name="loop-watchdog", daemon=True
+        )
+        self._thread.start()
+
+    async def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._thread is not None:
+            await asyncio.to_thread(self._thread.join, 1.0)
+            self._thread = None
+
+    # -- watcher thread ----------------------------------------------------
+
+    def _watch(self) -> None:
+        poll_s = max(0.005, self.threshold_s / 4)
+        while not self._stop.wait(poll_s):
+            seq = self._beat_seq
+            overdue = time.monotonic() - self._beat_due
+            if overdue < self.threshold_s or seq == self._reported_seq:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id or 0)
+            if frame is None:
+                continue
+            self._reported_seq = seq
+            self.blocked_count += 1
+            if self.on_block is not None:
+                stack = [line.rstrip() for line in traceback.format_stack(frame)]
+                self.on_block(overdue, stack)
+
+    # -- reporting ---------------------------------------------------------
+
+    def snapshot(self) -> Dict[str, float]:
+        lags = sorted(self._lags)
+        return {
+            "p50": _percentile(lags, 0.50),
+            "p90": _percentile(lags, 0.90),
+            "p99": _percentile(lags, 0.99),
+            "max": lags[-1] if lags else 0.0,
+            "samples": float(len(lags)),
+            "blocked": float(self.blocked_count),
+        }
+
+    def collect(self) -> Iterable[Metric]:
+        snap = self.snapshot()
+        yield Metric(
+            "proxy_event_loop_lag_seconds",
+            f"Event-loop lag over the last {self._lags.maxlen} heartbeats.",
+            "gauge",
+            [({"quantile": q}, snap[key]) for q, key in (("0.5", "p50"), ("0.9", "p90"), ("0.99", "p99"), ("1", "max"))],
+        )
+        yield Metric(
+            "proxy_event_loop_blocked_total",
+            "Times a single callback held the loop longer than the threshold.",
+            "counter",
+            [({}, snap["blocked"])],
+        )
@@ -3,50 +3,98 @@ Single-file FastAPI application to proxy Anthropic API requests to an OpenAI-com
 Handles request/response conversion, streaming, and dynamic model selection.
 """
 
+from __future__ import annotations
+
+import asyncio
+import collections
+import contextlib
 import dataclasses
 import enum
+import hashlib
+import importlib.util
 import json
 import logging
 import os
+import re
+import secrets
 import sys
 import time
 import traceback
+import types
 import uuid
 from datetime import datetime, timezone
 from logging.config import dictConfig
-from typing import (Any, AsyncGenerator, Awaitable, Callable, Dict, List,
-                    Literal, Optional, Tuple, Union, cast)
+from typing import (TYPE_CHECKING, Any, AsyncGenerator, AsyncIterator,
+                    Awaitable, Callable, Dict, List, Literal, Optional,
+                    Sequence, Tuple, Union, cast)
 
+import anyio
 import fastapi
-import openai
-import tiktoken
-import uvicorn
 from dotenv import load_dotenv
 from fastapi import Request
-from fastapi.responses import JSONResponse, Response, StreamingResponse
-from openai.types.chat import (ChatCompletionMessageParam,
-                               ChatCompletionToolParam)
+from starlette.background import BackgroundTask
+from fastapi.responses import (JSONResponse, PlainTextResponse, Response,
+                               StreamingResponse)
 from pydantic import (
     BaseModel,
     Field,
+    PrivateAttr,
     ValidationError,
     field_validator,
     ConfigDict,
 )
 from pydantic_settings import BaseSettings, SettingsConfigDict
-from rich.console import Console
-from rich.panel import Panel
-from rich.rule import Rule
-from rich.text import Text
 
 # Import the new capabilities module
-from capabilities import provider_supports_tools, get_model_capabilities
+from circuit_breaker import BreakerKey, CircuitBreakers, CircuitOpenError
+from capabilities import (
+    get_model_limits,
+    get_model_pricing,
+    provider_supports_tools,
+    refresh_catalog,
+)
+from image_store import DEFAULT_IMAGE_TOKENS, ImageEntry, ImageStore
+from incremental_json import IncrementalJSONValidator
+from fair_share import BudgetExceeded, FairQueue, UserBudgets, retry_after_header
+from request_timing import RequestTimer
+from loop_watchdog import LoopWatchdog
+from model_router import Route, RoutingTableLoader
+from model_telemetry import ModelTelemetry
+from state_backend import StateBackend, create_state_backend
+from stream_buffer import SlowConsumerError, StreamBuffer
+from stream_buffer import collect as collect_stream_buffers
+from usage_ledger import UsageLedger, UsageRecord, provider_usage
+import metrics
+import tracing
+
+if TYPE_CHECKING:
+    import tiktoken
+    from openai.types.chat import (ChatCompletionMessageParam,
+                                   ChatCompletionToolParam)
+
+
+def _lazy_import(name: str) -> types.ModuleType:
+    """Registers *name* in sys.modules but only executes it on first attribute access."""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None or spec.loader is None:
+        raise ImportError(f"No module named '{name}'")
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+# The SDK (and httpx under it) are by far the heaviest imports; they get loaded
+# when the lifespan builds the client (or on first use), not on module import.
+openai = _lazy_import("openai")
+httpx = _lazy_import("httpx")
 
 load_dotenv()
 
-# Initialize capabilities on startup to ensure fresh data
-get_model_capabilities()
-
 # ---------------------------------------------------------------------------
 # Settings and configuration
 # ---------------------------------------------------------------------------
@@ -70,13 +118,159 @@ class Settings(BaseSettings):
     host: str = "127.0.0.1"
     port: int = 8080
     reload: bool = True
+    # >1 switches to the production launch mode: N uvicorn worker processes,
+    # uvloop/httptools when installed, reload forced off.
+    workers: int = 1
+
+    # Where the per-user budget counters live: "memory" (per process) or
+    # "redis" (any Redis-compatible server). Everything else is per worker.
+    state_backend: Literal["memory", "redis"] = "memory"
+    state_backend_url: str = "redis://127.0.0.1:6379/0"
+
+    # Per-user (metadata.user_id) request and token budgets per fixed window,
+    # counted in the state backend; 0 disables. Over-budget requests get a
+    # 429 rate_limit_error with retry-after.
+    user_request_budget: int = 0
+    user_token_budget: int = 0
+    user_budget_window: float = 60.0
+    # Cap on concurrent upstream calls (0 = unlimited). Requests waiting for
+    # a slot are served by deficit round robin over users, costing prompt +
+    # max_tokens each, with per-user weights ({"user_id": 2.0}; default 1).
+    # The quantum (tokens of credit per turn) should not exceed a typical
+    # request's cost, or a user's turn covers several requests.
+    upstream_max_concurrency: int = 0
+    fair_queue_quantum: int = 1024
+    fair_queue_weights: Dict[str, float] = {}
+
+    # "sdk" streams through the OpenAI SDK; "raw" reads the upstream SSE with
+    # httpx and skips the per-chunk Pydantic models.
+    upstream_stream_mode: Literal["sdk", "raw"] = "sdk"
+    # While streaming, ask the server whether the client went away at most
+    # this often (seconds; 0 disables). Cancellation by the server itself is
+    # always handled; this catches servers that never cancel the response.
+    stream_disconnect_check_interval: float = 1.0
+    # Per-stream buffer between the upstream reader and the client, in bytes
+    # (0 reads upstream in lock-step with client writes, no reader task). At
+    # the mark "pause" stops reading upstream, "coalesce" reads on up to 4x
+    # the mark, and "drop" aborts the stream.
+    stream_buffer_high_water_bytes: int = 65536
+    stream_buffer_policy: Literal["pause", "coalesce", "drop"] = "pause"
+    # Send an Anthropic `ping` event after this many seconds without output
+    # (0 disables), so idle-timeout proxies keep the connection open while a
+    # reasoning model thinks. Needs the stream buffer (high-water mark > 0).
+    stream_keepalive_interval: float = 15.0
+    # Map upstream reasoning (OpenRouter `reasoning`, DeepSeek
+    # `reasoning_content`) to Anthropic thinking blocks for requests that
+    # enable `thinking`; otherwise, or when off, it is dropped.
+    forward_reasoning: bool = True
+    # Run each streamed tool call's arguments through an incremental JSON
+    # validator as they arrive, logging a warning on the first syntax error
+    # or when the stream ends mid-document. No argument buffer is kept.
+    stream_validate_tool_arguments: bool = False
+    # When the upstream stops on finish_reason=length, append the text that
+    # closes the truncated arguments so the client receives parseable JSON.
+    # Implies validation.
+    stream_repair_truncated_tool_arguments: bool = False
+
+    # Token and cost ledger behind GET /v1/usage: provider-reported usage
+    # (streams then request include_usage) priced from the catalog, totalled
+    # in memory and, with a db path, appended to SQLite every flush interval.
+    usage_ledger_enabled: bool = False
+    usage_db_path: Optional[str] = None
+    usage_flush_interval: float = 10.0
+
+    # OpenTelemetry tracing (src/tracing.py). Exporter is otlp, console, file,
+    # memory or "package.module:factory"; sample ratio is the head-sampling rate.
+    tracing_enabled: bool = False
+    tracing_exporter: str = "otlp"
+    tracing_sample_ratio: float = 1.0
+    tracing_file_path: str = "traces.jsonl"
+
+    # Event-loop lag watchdog: logs the loop thread's stack whenever one callback
+    # blocks for longer than the threshold; lag percentiles are on /metrics.
+    loop_watchdog_enabled: bool = True
+    loop_lag_threshold_ms: float = 100.0
+    loop_lag_interval_ms: float = 50.0
+
+    # Enables the /admin/* endpoints; send it as X-Admin-Token or a Bearer token.
+    admin_token: Optional[str] = None
+
+    # When set, requests whose target is an "anthropic/..." model are relayed
+    # as-is to {anthropic_passthrough_base_url}/messages (only "model" is
+    # rewritten) and the upstream SSE bytes are streamed straight back.
+    anthropic_passthrough_base_url: Optional[str] = None
+    anthropic_passthrough_api_key: Optional[str] = None
+    anthropic_passthrough_strip_prefix: bool = False
+
+    # Pre-flight against the catalog's context_length / max_completion_tokens:
+    # "reject" fails fast, "clamp" lowers max_tokens, "reroute" tries the
+    # route's fallbacks, then context_fallback_model_name, and clamps if none
+    # of them fits either. Off by default, so max_tokens is sent as requested.
+    context_overflow_policy: Literal["off", "reject", "clamp", "reroute"] = "off"
+    context_fallback_model_name: Optional[str] = None
+
+    # Ordered model-routing rules (see src/model_router.py) in a TOML or YAML
+    # file; unset keeps the built-in opus/sonnet -> BIG, haiku -> SMALL
+    # mapping. Edits apply without a restart: the file's mtime is checked at
+    # most every routing_reload_interval seconds.
+    routing_table_path: Optional[str] = None
+    routing_reload_interval: float = 5.0
+
+    # Rules with `candidates` pick one per request from live EWMA telemetry
+    # (src/model_telemetry.py): "cheapest" catalog price within the p95 TTFT
+    # SLO and error budget, "fastest" p95 TTFT, or "throughput" tokens/s. A
+    # model routed away from gets one probe every selection_probe_interval s.
+    selection_objective: Literal["cheapest", "fastest", "throughput"] = "cheapest"
+    selection_ttft_slo_ms: float = 3000.0
+    selection_max_error_rate: float = 0.2
+    selection_ewma_alpha: float = 0.2
+    selection_min_samples: int = 5
+    selection_probe_interval: float = 60.0
+
+    # Circuit breaker per (base_url, target model): after this many
+    # consecutive 429/5xx/connection failures calls fail fast, or go to the
+    # route's fallbacks, for circuit_open_seconds; then up to
+    # circuit_half_open_max_calls probes decide. 0 disables it.
+    circuit_failure_threshold: int = 5
+    circuit_open_seconds: float = 30.0
+    circuit_half_open_max_calls: int = 1
+
+    # Optional elision of old tool_result bodies once the prompt exceeds the
+    # compaction budget (explicit, or a ratio of the catalog context_length).
+    compaction_enabled: bool = False
+    compaction_max_input_tokens: Optional[int] = None
+    compaction_context_ratio: float = 0.75
+    compaction_keep_recent_messages: int = 6
+    compaction_tool_result_max_tokens: int = 200
+
+    # Content-addressed cache of converted base64 images, capped by entries
+    # and by total data-URL bytes; resizing and recompression only happen
+    # when Pillow is installed.
+    image_cache_size: int = 256
+    image_cache_max_bytes: int = 64 * 1024 * 1024
+    image_max_dimension: Optional[int] = None
+    image_max_bytes: Optional[int] = None
+
+    # Converted tool definitions + token counts, keyed by a hash of
+    # (name, description, input_schema).
+    tool_cache_size: int = 512
+    gemini_schema_sanitization: bool = True
 
 
 settings = Settings()
 
 
-_console = Console()
-_error_console = Console(stderr=True, style="bold red")
+_error_console = None
+
+
+def _get_error_console():
+    """rich is only imported once something actually needs to be printed."""
+    global _error_console
+    if _error_console is None:
+        from rich.console import Console
+
+        _error_console = Console(stderr=True, style="bold red")
+    return _error_console
 
 
 class JSONFormatter(logging.Formatter):
@@ -103,7 +297,7 @@ class JSONFormatter(logging.Formatter):
                     ),
                     "args": exc_value.args if hasattr(exc_value, "args") else [],
                 }
-        return json.dumps(header, ensure_ascii=False)
+        return json.dumps(header, ensure_ascii=False, default=str)
 
 
 class ConsoleJSONFormatter(JSONFormatter):
@@ -162,6 +356,9 @@ dictConfig(
 
 class LogEvent(enum.Enum):
     MODEL_SELECTION = "model_selection"
+    MODEL_FALLBACK = "model_fallback"
+    ROUTING_TABLE_RELOADED = "routing_table_reloaded"
+    CIRCUIT_BREAKER_STATE = "circuit_breaker_state"
     REQUEST_START = "request_start"
     REQUEST_COMPLETED = "request_completed"
     REQUEST_FAILURE = "request_failure"
@@ -171,6 +368,7 @@ class LogEvent(enum.Enum):
     ANTHROPIC_RESPONSE = "anthropic_response"
     STREAMING_REQUEST = "streaming_request"
     STREAM_INTERRUPTED = "stream_interrupted"
+    STREAM_CANCELLED = "stream_cancelled"
     TOKEN_COUNT = "token_count"
     TOKEN_ENCODER_LOAD_FAILED = "token_encoder_load_failed"
     SYSTEM_PROMPT_ADJUSTED = "system_prompt_adjusted"
@@ -183,6 +381,7 @@ class LogEvent(enum.Enum):
     TOOL_ARGS_TYPE_MISMATCH = "tool_args_type_mismatch"
     TOOL_ARGS_PARSE_FAILURE = "tool_args_parse_failure"
     TOOL_ARGS_UNEXPECTED = "tool_args_unexpected"
+    TOOL_ARGS_REPAIRED = "tool_args_repaired"
     TOOL_ID_PLACEHOLDER = "tool_id_placeholder"
     TOOL_ID_UPDATED = "tool_id_updated"
     PARAMETER_UNSUPPORTED = "parameter_unsupported"
@@ -190,6 +389,12 @@ class LogEvent(enum.Enum):
     PROVIDER_ERROR_DETAILS = "provider_error_details"
     TOOL_CAPABILITY_DOWNGRADE = "tool_capability_downgrade"
     TOOL_RETRY_ATTEMPT = "tool_retry_attempt"
+    CONTEXT_WINDOW_PREFLIGHT = "context_window_preflight"
+    CONVERSATION_COMPACTED = "conversation_compacted"
+    ANTHROPIC_PASSTHROUGH = "anthropic_passthrough"
+    PROFILE = "profile"
+    EVENT_LOOP_BLOCKED = "event_loop_blocked"
+    USAGE_FLUSH_FAILED = "usage_flush_failed"
 
 
 @dataclasses.dataclass
@@ -210,17 +415,23 @@ class LogRecord:
 
 
 _logger = logging.getLogger(settings.app_name)
+_file_handler: Optional[logging.FileHandler] = None
 
-if settings.log_file_path:
+
+def _configure_file_logging() -> None:
+    """Attaches the JSONL file handler once; called from the app lifespan."""
+    global _file_handler
+    if not settings.log_file_path or _file_handler is not None:
+        return
     try:
         log_dir = os.path.dirname(settings.log_file_path)
         if log_dir:
             os.makedirs(log_dir, exist_ok=True)
-        file_handler = logging.FileHandler(settings.log_file_path, mode="a")
-        file_handler.setFormatter(JSONFormatter())
-        _logger.addHandler(file_handler)
+        _file_handler = logging.FileHandler(settings.log_file_path, mode="a")
+        _file_handler.setFormatter(JSONFormatter())
+        _logger.addHandler(_file_handler)
     except Exception as e:
-        _error_console.print(
+        _get_error_console().print(
             f"Failed to configure file logging to {settings.log_file_path}: {e}"
         )
 
@@ -257,7 +468,7 @@ def warning(record: LogRecord, exc: Optional[Exception] = None):
 
 def error(record: LogRecord, exc: Optional[Exception] = None):
     if exc:
-        _error_console.print_exception(show_locals=False, width=120)
+        _get_error_console().print_exception(show_locals=False, width=120)
     _log(logging.ERROR, record, exc=exc)
 
 
@@ -275,6 +486,9 @@ class ContentBlockImageSource(BaseModel):
     media_type: str
     data: str
 
+    # Filled by _get_image_entry so the payload is hashed once per request
+    _entry: Optional[ImageEntry] = PrivateAttr(default=None)
+
 
 class ContentBlockImage(BaseModel):
     type: Literal["image"]
@@ -295,8 +509,24 @@ class ContentBlockToolResult(BaseModel):
     is_error: Optional[bool] = None
 
 
+class ContentBlockThinking(BaseModel):
+    type: Literal["thinking"]
+    thinking: str
+    signature: Optional[str] = None
+
+
+class ContentBlockRedactedThinking(BaseModel):
+    type: Literal["redacted_thinking"]
+    data: str
+
+
 ContentBlock = Union[
-    ContentBlockText, ContentBlockImage, ContentBlockToolUse, ContentBlockToolResult
+    ContentBlockText,
+    ContentBlockImage,
+    ContentBlockToolUse,
+    ContentBlockToolResult,
+    ContentBlockThinking,
+    ContentBlockRedactedThinking,
 ]
 
 
@@ -329,12 +559,20 @@ class Tool(BaseModel):
         description="JSON-Schema of the tool arguments; empty when provider omits it.",
     )
 
+    # Filled by _tool_cache_key so the definition is hashed once per request
+    _cache_key: Optional[str] = PrivateAttr(default=None)
+
 
 class ToolChoice(BaseModel):
     type: Literal["auto", "any", "tool"]
     name: Optional[str] = None
 
 
+class ThinkingConfig(BaseModel):
+    type: str  # "enabled" | "disabled"
+    budget_tokens: Optional[int] = None
+
+
 class MessagesRequest(BaseModel):
     model: str
     max_tokens: int
@@ -348,6 +586,7 @@ class MessagesRequest(BaseModel):
     metadata: Optional[Dict[str, Any]] = None
     tools: Optional[List[Tool]] = None
     tool_choice: Optional[ToolChoice] = None
+    thinking: Optional[ThinkingConfig] = None
 
     @field_validator("top_k")
     def check_top_k(cls, v: Optional[int], info) -> Optional[int]:
@@ -492,29 +731,51 @@ def extract_provider_error_details(
     )
 
 
-try:
-    openai_client = openai.AsyncClient(
-        api_key=settings.openai_api_key,
-        base_url=settings.base_url,
-        default_headers={
-            "HTTP-Referer": settings.referrer_url,
-            "X-Title": settings.app_name,
-        },
-        timeout=180.0,
-    )
-except Exception as e:
-    critical(
-        LogRecord(
-            event="openai_client_init_failed",
-            message="Failed to initialize OpenAI client",
-        ),
-        exc=e,
-    )
-    sys.exit(1)
+_openai_client: Optional[openai.AsyncClient] = None
+
+
+def get_openai_client() -> openai.AsyncClient:
+    """Builds the upstream client on first use (normally during app startup)."""
+    global _openai_client
+    if _openai_client is None:
+        try:
+            _openai_client = openai.AsyncClient(
+                api_key=settings.openai_api_key,
+                base_url=settings.base_url,
+                default_headers={
+                    "HTTP-Referer": settings.referrer_url,
+                    "X-Title": settings.app_name,
+                },
+                timeout=180.0,
+            )
+        except Exception as e:
+            critical(
+                LogRecord(
+                    event="openai_client_init_failed",
+                    message="Failed to initialize OpenAI client",
+                ),
+                exc=e,
+            )
+            raise
+    return _openai_client
 
 
 _token_encoder_cache: Dict[str, tiktoken.Encoding] = {}
 
+image_store = ImageStore(
+    max_entries=settings.image_cache_size,
+    max_cache_bytes=settings.image_cache_max_bytes,
+    max_dimension=settings.image_max_dimension,
+    max_bytes=settings.image_max_bytes,
+)
+
+
+def _get_image_entry(source: ContentBlockImageSource) -> ImageEntry:
+    """Looks up (or builds) the cached data URL and token estimate for a base64 image."""
+    if source._entry is None:
+        source._entry = image_store.get(source.media_type, source.data)
+    return source._entry
+
 
 def get_token_encoder(
     model_name: str = "gpt-4", request_id: Optional[str] = None
@@ -523,6 +784,8 @@ def get_token_encoder(
 
     cache_key = "gpt-4"
     if cache_key not in _token_encoder_cache:
+        import tiktoken
+
         try:
             _token_encoder_cache[cache_key] = tiktoken.encoding_for_model(cache_key)
         except Exception:
@@ -554,6 +817,167 @@ def get_token_encoder(
     return _token_encoder_cache[cache_key]
 
 
+def _tool_result_content_as_text(
+    content: Union[str, List[Dict[str, Any]], List[Any]],
+) -> str:
+    """Flattens tool_result content into the text used for token counting."""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        content_str = ""
+        for item in content:
+            if isinstance(item, dict) and item.get("type") == "text":
+                content_str += item.get("text", "")
+            else:
+                content_str += json.dumps(item)
+        return content_str
+    return json.dumps(content)
+
+
+@dataclasses.dataclass
+class ToolCacheEntry:
+    token_count: int
+    # schema dialect ("openai" / "gemini") -> converted OpenAI tool; shared
+    # across requests, so treat as read-only.
+    openai_tools: Dict[str, Dict[str, Any]] = dataclasses.field(default_factory=dict)
+
+
+_tool_definition_cache: "collections.OrderedDict[str, ToolCacheEntry]" = (
+    collections.OrderedDict()
+)
+
+# JSON-Schema keywords Gemini's function-declaration subset rejects
+GEMINI_UNSUPPORTED_SCHEMA_KEYS = frozenset(
+    {
+        "$schema",
+        "$id",
+        "$comment",
+        "additionalProperties",
+        "default",
+        "examples",
+        "exclusiveMinimum",
+        "exclusiveMaximum",
+        "patternProperties",
+        "propertyNames",
+    }
+)
+GEMINI_STRING_FORMATS = frozenset({"enum", "date-time"})
+
+
+def _sanitize_schema_for_gemini(schema: Any) -> Any:
+    """Recursively drops schema keywords Gemini does not accept."""
+    if isinstance(schema, list):
+        return [_sanitize_schema_for_gemini(item) for item in schema]
+    if not isinstance(schema, dict):
+        return schema
+
+    sanitized: Dict[str, Any] = {}
+    for key, value in schema.items():
+        if key in GEMINI_UNSUPPORTED_SCHEMA_KEYS:
+            continue
+        if (
+            key == "format"
+            and schema.get("type") == "string"
+            and value not in GEMINI_STRING_FORMATS
+        ):
+            continue
+        if key in ("properties", "$defs", "definitions") and isinstance(value, dict):
+            # keys here are property names, not keywords
+            sanitized[key] = {
+                name: _sanitize_schema_for_gemini(sub) for name, sub in value.items()
+            }
+        else:
+            sanitized[key] = _sanitize_schema_for_gemini(value)
+    return sanitized
+
+
+def _tool_schema_dialect(target_model_name: Optional[str]) -> str:
+    if (
+        target_model_name
+        and settings.gemini_schema_sanitization
+        and target_model_name.lower().startswith(("google/gemini", "gemini"))
+    ):
+        return "gemini"
+    return "openai"
+
+
+def _tool_cache_key(tool: Tool) -> str:
+    if tool._cache_key is None:
+        payload = json.dumps(
+            [tool.name, tool.description, tool.input_schema],
+            sort_keys=True,
+            separators=(",", ":"),
+            default=str,
+        )
+        tool._cache_key = hashlib.blake2b(
+            payload.encode("utf-8"), digest_size=16
+        ).hexdigest()
+    return tool._cache_key
+
+
+def _count_tool_definition_tokens(
+    tool: Tool, enc: tiktoken.Encoding, request_id: Optional[str]
+) -> int:
+    tokens = len(enc.encode(tool.name))
+    if tool.description:
+        tokens += len(enc.encode(tool.description))
+    # Count schema tokens **only** when a schema is present
+    if tool.input_schema:
+        try:
+            schema_str = json.dumps(tool.input_schema)
+            tokens += len(enc.encode(schema_str))
+        except Exception:
+            warning(
+                LogRecord(
+                    event=LogEvent.TOOL_INPUT_SERIALIZATION_FAILURE.value,
+                    message="Failed to serialize tool schema for token counting.",
+                    data={"tool_name": tool.name},
+                    request_id=request_id,
+                )
+            )
+    return tokens
+
+
+def _get_tool_cache_entry(
+    tool: Tool, request_id: Optional[str] = None
+) -> ToolCacheEntry:
+    """Returns the cached token count / conversions for a tool definition."""
+    key = _tool_cache_key(tool)
+    entry = _tool_definition_cache.get(key)
+    if entry is not None:
+        _tool_definition_cache.move_to_end(key)
+        return entry
+
+    entry = ToolCacheEntry(
+        token_count=_count_tool_definition_tokens(
+            tool, get_token_encoder(request_id=request_id), request_id
+        )
+    )
+    _tool_definition_cache[key] = entry
+    if len(_tool_definition_cache) > settings.tool_cache_size:
+        _tool_definition_cache.popitem(last=False)
+    return entry
+
+
+def _get_openai_tool(tool: Tool, dialect: str) -> Dict[str, Any]:
+    entry = _get_tool_cache_entry(tool)
+    converted = entry.openai_tools.get(dialect)
+    if converted is None:
+        parameters = tool.input_schema
+        if dialect == "gemini":
+            parameters = _sanitize_schema_for_gemini(parameters)
+        converted = {
+            "type": "function",
+            "function": {
+                "name": tool.name,
+                "description": tool.description or "",
+                "parameters": parameters,
+            },
+        }
+        entry.openai_tools[dialect] = converted
+    return converted
+
+
 def count_tokens_for_anthropic_request(
     messages: List[Message],
     system: Optional[Union[str, List[SystemContent]]],
@@ -583,7 +1007,10 @@ def count_tokens_for_anthropic_request(
                 if isinstance(block, ContentBlockText):
                     total_tokens += len(enc.encode(block.text))
                 elif isinstance(block, ContentBlockImage):
-                    total_tokens += 768
+                    if block.source.type == "base64":
+                        total_tokens += _get_image_entry(block.source).tokens
+                    else:
+                        total_tokens += DEFAULT_IMAGE_TOKENS
                 elif isinstance(block, ContentBlockToolUse):
                     total_tokens += len(enc.encode(block.name))
                     try:
@@ -600,20 +1027,7 @@ def count_tokens_for_anthropic_request(
                         )
                 elif isinstance(block, ContentBlockToolResult):
                     try:
-                        content_str = ""
-                        if isinstance(block.content, str):
-                            content_str = block.content
-                        elif isinstance(block.content, list):
-                            for item in block.content:
-                                if (
-                                    isinstance(item, dict)
-                                    and item.get("type") == "text"
-                                ):
-                                    content_str += item.get("text", "")
-                                else:
-                                    content_str += json.dumps(item)
-                        else:
-                            content_str = json.dumps(block.content)
+                        content_str = _tool_result_content_as_text(block.content)
                         total_tokens += len(enc.encode(content_str))
                     except Exception:
                         warning(
@@ -627,23 +1041,7 @@ def count_tokens_for_anthropic_request(
     if tools:
         total_tokens += 2
         for tool in tools:
-            total_tokens += len(enc.encode(tool.name))
-            if tool.description:
-                total_tokens += len(enc.encode(tool.description))
-            # Count schema tokens **only** when a schema is present
-            if tool.input_schema:
-                try:
-                    schema_str = json.dumps(tool.input_schema)
-                    total_tokens += len(enc.encode(schema_str))
-                except Exception:
-                    warning(
-                        LogRecord(
-                            event=LogEvent.TOOL_INPUT_SERIALIZATION_FAILURE.value,
-                            message="Failed to serialize tool schema for token counting.",
-                            data={"tool_name": tool.name},
-                            request_id=request_id,
-                        )
-                    )
+            total_tokens += _get_tool_cache_entry(tool, request_id).token_count
     debug(
         LogRecord(
             event=LogEvent.TOKEN_COUNT.value,
@@ -655,6 +1053,110 @@ def count_tokens_for_anthropic_request(
     return total_tokens
 
 
+def _elide_tool_result(
+    content: Union[str, List[Dict[str, Any]], List[Any]],
+    enc: Any,
+    max_tokens: int,
+) -> Optional[Tuple[Union[str, List[Any]], int]]:
+    """
+    Cuts a tool_result's text to *max_tokens*. In list content only the text
+    items are cut (joined into one, where the first one was); images and other
+    items are kept as they are. Returns the new content and the tokens saved,
+    or None when the text already fits.
+    """
+    if isinstance(content, str):
+        text, items = content, None
+    elif isinstance(content, list):
+        is_text = [isinstance(item, dict) and item.get("type") == "text" for item in content]
+        text = "".join(item.get("text", "") for item, t in zip(content, is_text) if t)
+        items = content
+    else:
+        return None
+    tokens = enc.encode(text)
+    if len(tokens) <= max_tokens:
+        return None
+
+    head = enc.decode(tokens[:max_tokens]) if hasattr(enc, "decode") else text[:max_tokens]
+    note = f"\n[... {len(tokens) - max_tokens} tokens of tool output elided by proxy ...]"
+    replacement = head + note
+    saved = len(tokens) - len(enc.encode(replacement))
+    if items is None:
+        return replacement, saved
+    kept = [item for item, t in zip(items, is_text) if not t]
+    kept.insert(is_text.index(True), {"type": "text", "text": replacement})
+    return kept, saved
+
+
+def compact_anthropic_messages(
+    messages: List[Message],
+    estimated_input_tokens: int,
+    token_budget: int,
+    keep_recent_messages: int,
+    tool_result_max_tokens: int,
+    model_name: str,
+    request_id: Optional[str] = None,
+) -> Tuple[List[Message], int]:
+    """
+    Shrinks old tool_result bodies (oldest first) until the estimate fits
+    `token_budget`. The last `keep_recent_messages` messages are left verbatim
+    and no block is ever removed, so tool_use/tool_result pairing stays valid;
+    images inside tool results are kept whole.
+    Returns the (possibly new) message list and the updated token estimate.
+    """
+    if estimated_input_tokens <= token_budget:
+        return messages, estimated_input_tokens
+
+    enc = get_token_encoder(model_name, request_id)
+    total_tokens = estimated_input_tokens
+    compactable = max(len(messages) - keep_recent_messages, 0)
+    compacted: List[Message] = list(messages)
+    elided_results = 0
+
+    for i in range(compactable):
+        if total_tokens <= token_budget:
+            break
+        msg = compacted[i]
+        if not isinstance(msg.content, list):
+            continue
+
+        new_blocks: Optional[List[ContentBlock]] = None
+        for block_idx, block in enumerate(msg.content):
+            if total_tokens <= token_budget:
+                break
+            if not isinstance(block, ContentBlockToolResult):
+                continue
+            elided = _elide_tool_result(block.content, enc, tool_result_max_tokens)
+            if elided is None:
+                continue
+            replacement, saved = elided
+            total_tokens -= saved
+
+            if new_blocks is None:
+                new_blocks = list(msg.content)
+            new_blocks[block_idx] = block.model_copy(update={"content": replacement})
+            elided_results += 1
+
+        if new_blocks is not None:
+            compacted[i] = msg.model_copy(update={"content": new_blocks})
+
+    if elided_results:
+        info(
+            LogRecord(
+                event=LogEvent.CONVERSATION_COMPACTED.value,
+                message=f"Compacted {elided_results} tool results: ~{estimated_input_tokens} -> ~{total_tokens} input tokens.",
+                request_id=request_id,
+                data={
+                    "tokens_before": estimated_input_tokens,
+                    "tokens_after": total_tokens,
+                    "token_budget": token_budget,
+                    "elided_tool_results": elided_results,
+                },
+            )
+        )
+        return compacted, total_tokens
+    return messages, estimated_input_tokens
+
+
 StopReasonType = Optional[
     Literal["end_turn", "max_tokens", "stop_sequence", "tool_use", "error"]
 ]
@@ -789,7 +1291,7 @@ def convert_anthropic_to_openai_messages(
                             {
                                 "type": "image_url",
                                 "image_url": {
-                                    "url": f"data:{block.source.media_type};base64,{block.source.data}"
+                                    "url": _get_image_entry(block.source).data_url
                                 },
                             }
                         )
@@ -830,6 +1332,12 @@ def convert_anthropic_to_openai_messages(
                         }
                     )
 
+                elif isinstance(
+                    block, (ContentBlockThinking, ContentBlockRedactedThinking)
+                ):
+                    # earlier turns' reasoning is not replayed upstream
+                    continue
+
                 elif isinstance(block, ContentBlockToolResult) and role == "user":
                     serialized_content = _serialize_tool_result_content_for_openai(
                         block.content, request_id, block_log_ctx
@@ -924,20 +1432,12 @@ def convert_anthropic_to_openai_messages(
 
 def convert_anthropic_tools_to_openai(
     anthropic_tools: Optional[List[Tool]],
+    target_model_name: Optional[str] = None,
 ) -> Optional[List[Dict[str, Any]]]:
     if not anthropic_tools:
         return None
-    return [
-        {
-            "type": "function",
-            "function": {
-                "name": t.name,
-                "description": t.description or "",
-                "parameters": t.input_schema,
-            },
-        }
-        for t in anthropic_tools
-    ]
+    dialect = _tool_schema_dialect(target_model_name)
+    return [_get_openai_tool(t, dialect) for t in anthropic_tools]
 
 
 def convert_anthropic_tool_choice_to_openai(
@@ -972,10 +1472,18 @@ def convert_anthropic_tool_choice_to_openai(
     return "auto"
 
 
+def _reasoning_text(delta_or_message: Any) -> Optional[str]:
+    """OpenRouter `reasoning` or DeepSeek-style `reasoning_content`, if any."""
+    return getattr(delta_or_message, "reasoning", None) or getattr(
+        delta_or_message, "reasoning_content", None
+    )
+
+
 def convert_openai_to_anthropic_response(
     openai_response: openai.types.chat.ChatCompletion,
     original_anthropic_model_name: str,
     request_id: Optional[str] = None,
+    forward_reasoning: bool = False,
 ) -> MessagesResponse:
     anthropic_content: List[ContentBlock] = []
     anthropic_stop_reason: StopReasonType = None
@@ -996,6 +1504,14 @@ def convert_openai_to_anthropic_response(
 
         anthropic_stop_reason = stop_reason_map.get(finish_reason, "end_turn")
 
+        reasoning = _reasoning_text(message)
+        if reasoning and forward_reasoning:
+            # upstream reasoning carries no Anthropic signature; an empty one
+            # keeps the block's shape (it is never sent back upstream)
+            anthropic_content.append(
+                ContentBlockThinking(type="thinking", thinking=reasoning, signature="")
+            )
+
         if message.content:
             anthropic_content.append(
                 ContentBlockText(type="text", text=message.content)
@@ -1088,7 +1604,7 @@ def _get_anthropic_error_details_from_exc(
 
     if isinstance(exc, openai.APIError):
         error_message = exc.message or str(exc)
-        status_code = exc.status_code or 500
+        status_code = getattr(exc, "status_code", None) or 500
         error_type = STATUS_CODE_ERROR_MAP.get(
             status_code, AnthropicErrorType.API_ERROR
         )
@@ -1138,221 +1654,525 @@ def _format_anthropic_error_sse_event(
     return f"event: error\ndata: {error_response.model_dump_json()}\n\n"
 
 
-async def handle_anthropic_streaming_response_from_openai_stream(
-    openai_stream: openai.AsyncStream[openai.types.chat.ChatCompletionChunk],
-    original_anthropic_model_name: str,
-    estimated_input_tokens: int,
-    request_id: str,
-    start_time_mono: float,
-) -> AsyncGenerator[str, None]:
-    """
-    Consumes an OpenAI stream and yields Anthropic-compatible SSE events.
-    BUGFIX: Correctly handles content block indexing for mixed text/tool_use.
-    """
+OPENAI_TO_ANTHROPIC_STOP_REASON: Dict[Optional[str], StopReasonType] = {
+    "stop": "end_turn",
+    "length": "max_tokens",
+    "tool_calls": "tool_use",
+    "function_call": "tool_use",
+    "content_filter": "stop_sequence",
+    None: None,
+}
 
-    anthropic_message_id = f"msg_stream_{request_id}_{uuid.uuid4().hex[:8]}"
 
-    next_anthropic_block_idx = 0
-    text_block_anthropic_idx: Optional[int] = None
+def _sse_event(event_type: str, data: Dict[str, Any]) -> str:
+    return f"event: {event_type}\ndata: {json.dumps(data)}\n\n"
 
-    openai_tool_idx_to_anthropic_block_idx: Dict[int, int] = {}
 
-    tool_states: Dict[int, Dict[str, Any]] = {}
+_SSE_PING = _sse_event("ping", {"type": "ping"})
 
-    sent_tool_block_starts: set[int] = set()
 
-    output_token_count = 0
-    final_anthropic_stop_reason: StopReasonType = None
+class _ToolBlockState:
+    """One streamed tool call; arguments are validated, never accumulated."""
 
-    enc = get_token_encoder(original_anthropic_model_name, request_id)
+    __slots__ = ("index", "id", "name", "started", "pending", "validator")
 
-    openai_to_anthropic_stop_reason_map: Dict[Optional[str], StopReasonType] = {
-        "stop": "end_turn",
-        "length": "max_tokens",
-        "tool_calls": "tool_use",
-        "function_call": "tool_use",
-        "content_filter": "stop_sequence",
-        None: None,
-    }
+    def __init__(self, index: int, tool_id: Optional[str], validate: bool) -> None:
+        self.index = index
+        self.id = tool_id
+        self.name = ""
+        self.started = False
+        # fragments that arrived before id + name were known
+        self.pending: List[str] = []
+        self.validator: Optional[IncrementalJSONValidator] = (
+            IncrementalJSONValidator() if validate else None
+        )
 
-    stream_status_code = 200
-    stream_final_message = "Streaming request completed successfully."
-    stream_log_event = LogEvent.REQUEST_COMPLETED.value
 
-    try:
-        message_start_event_data = {
-            "type": "message_start",
-            "message": {
-                "id": anthropic_message_id,
-                "type": "message",
-                "role": "assistant",
-                "model": original_anthropic_model_name,
-                "content": [],
-                "stop_reason": None,
-                "stop_sequence": None,
-                "usage": {"input_tokens": estimated_input_tokens, "output_tokens": 0},
-            },
+class AnthropicStreamTranslator:
+    """
+    State machine turning OpenAI chat.completion chunks into Anthropic SSE
+    events. Feed chunks one at a time; each call returns the (possibly empty)
+    list of SSE strings to send. Per-stream state is a handful of slotted
+    objects, and tool arguments are forwarded as they arrive rather than
+    accumulated. validate_tool_arguments checks them incrementally;
+    repair_truncated_arguments also closes arguments cut off by
+    finish_reason=length.
+    """
+
+    __slots__ = (
+        "model",
+        "estimated_input_tokens",
+        "request_id",
+        "message_id",
+        "validate_tool_arguments",
+        "repair_truncated_arguments",
+        "output_tokens",
+        "stop_reason",
+        "chunk_count",
+        "first_chunk_at",
+        "finished",
+        "await_usage",
+        "usage",
+        "_enc",
+        "_next_block_index",
+        "_text_block_index",
+        "_thinking_block_index",
+        "_forward_reasoning",
+        "_tools",
+    )
+
+    def __init__(
+        self,
+        model: str,
+        estimated_input_tokens: int,
+        request_id: str,
+        enc: Any,
+        validate_tool_arguments: bool = False,
+        repair_truncated_arguments: bool = False,
+        forward_reasoning: bool = True,
+        await_usage: bool = False,
+    ) -> None:
+        self.model = model
+        self.estimated_input_tokens = estimated_input_tokens
+        self.request_id = request_id
+        self.message_id = f"msg_stream_{request_id}_{uuid.uuid4().hex[:8]}"
+        self.validate_tool_arguments = validate_tool_arguments or repair_truncated_arguments
+        self.repair_truncated_arguments = repair_truncated_arguments
+        self.output_tokens = 0
+        self.stop_reason: StopReasonType = None
+        self.chunk_count = 0
+        self.first_chunk_at: Optional[float] = None
+        self.finished = False
+        # stream_options.include_usage was sent: the usage chunk follows the
+        # finish_reason, so the reader keeps going until it arrives
+        self.await_usage = await_usage
+        self.usage: Any = None
+        self._enc = enc
+        self._next_block_index = 0
+        self._text_block_index: Optional[int] = None
+        # open thinking block; closed as soon as text or a tool call starts
+        self._thinking_block_index: Optional[int] = None
+        self._forward_reasoning = forward_reasoning
+        # OpenAI tool_call index -> block state; insertion order == block order
+        self._tools: Dict[int, _ToolBlockState] = {}
+
+    def start(self) -> List[str]:
+        message = {
+            "id": self.message_id,
+            "type": "message",
+            "role": "assistant",
+            "model": self.model,
+            "content": [],
+            "stop_reason": None,
+            "stop_sequence": None,
+            "usage": {"input_tokens": self.estimated_input_tokens, "output_tokens": 0},
         }
-        yield f"event: message_start\ndata: {json.dumps(message_start_event_data)}\n\n"
-        yield f"event: ping\ndata: {json.dumps({'type': 'ping'})}\n\n"
+        return [
+            _sse_event("message_start", {"type": "message_start", "message": message}),
+            _SSE_PING,
+        ]
 
-        async for chunk in openai_stream:
-            if not chunk.choices:
+    def feed(self, chunk: Any) -> List[str]:
+        """Events for one upstream chunk; sets `finished` on a finish_reason."""
+        self.chunk_count += 1
+        usage = getattr(chunk, "usage", None)
+        if usage is not None:
+            self.usage = usage
+        if not chunk.choices:
+            return []
+        choice = chunk.choices[0]
+        delta = choice.delta
+        events: List[str] = []
+
+        if self._forward_reasoning:
+            reasoning = _reasoning_text(delta)
+            if reasoning:
+                self._on_reasoning(reasoning, events)
+        if self._thinking_block_index is not None and (delta.content or delta.tool_calls):
+            events.append(self._close_thinking())
+
+        if delta.content:
+            self._on_text(delta.content, events)
+        if delta.tool_calls:
+            for tool_delta in delta.tool_calls:
+                self._on_tool_delta(tool_delta, events)
+
+        if choice.finish_reason:
+            self.stop_reason = OPENAI_TO_ANTHROPIC_STOP_REASON.get(
+                choice.finish_reason, "end_turn"
+            )
+            self.finished = True
+        return events
+
+    def finish(self) -> List[str]:
+        """Closing events: block stops, message_delta and message_stop."""
+        events: List[str] = []
+        if self._thinking_block_index is not None:
+            events.append(self._close_thinking())
+        if self._text_block_index is not None:
+            events.append(
+                _sse_event(
+                    "content_block_stop",
+                    {"type": "content_block_stop", "index": self._text_block_index},
+                )
+            )
+        for tool in self._tools.values():
+            if not tool.started:
                 continue
+            if tool.validator is not None:
+                events.extend(self._close_arguments(tool))
+            events.append(
+                _sse_event(
+                    "content_block_stop",
+                    {"type": "content_block_stop", "index": tool.index},
+                )
+            )
 
-            delta = chunk.choices[0].delta
-            openai_finish_reason = chunk.choices[0].finish_reason
+        if self.stop_reason is None:
+            self.stop_reason = "end_turn"
+        reported = provider_usage(self.usage)
+        if reported is not None:
+            self.output_tokens = reported[1]
+        events.append(
+            _sse_event(
+                "message_delta",
+                {
+                    "type": "message_delta",
+                    "delta": {"stop_reason": self.stop_reason, "stop_sequence": None},
+                    "usage": {"output_tokens": self.output_tokens},
+                },
+            )
+        )
+        events.append(_sse_event("message_stop", {"type": "message_stop"}))
+        return events
+
+    # -- internals -----------------------------------------------------------
+
+    def _on_reasoning(self, text: str, events: List[str]) -> None:
+        self.output_tokens += len(self._enc.encode(text))
+        if self._thinking_block_index is None:
+            self._thinking_block_index = self._next_block_index
+            self._next_block_index += 1
+            events.append(
+                _sse_event(
+                    "content_block_start",
+                    {
+                        "type": "content_block_start",
+                        "index": self._thinking_block_index,
+                        "content_block": {"type": "thinking", "thinking": ""},
+                    },
+                )
+            )
+        events.append(
+            _sse_event(
+                "content_block_delta",
+                {
+                    "type": "content_block_delta",
+                    "index": self._thinking_block_index,
+                    "delta": {"type": "thinking_delta", "thinking": text},
+                },
+            )
+        )
 
-            if delta.content:
-                output_token_count += len(enc.encode(delta.content))
-                if text_block_anthropic_idx is None:
-                    text_block_anthropic_idx = next_anthropic_block_idx
-                    next_anthropic_block_idx += 1
-                    start_text_event = {
+    def _close_thinking(self) -> str:
+        index = self._thinking_block_index
+        self._thinking_block_index = None
+        # same empty signature as the non-streaming thinking block
+        signature = _sse_event(
+            "content_block_delta",
+            {
+                "type": "content_block_delta",
+                "index": index,
+                "delta": {"type": "signature_delta", "signature": ""},
+            },
+        )
+        return signature + _sse_event("content_block_stop", {"type": "content_block_stop", "index": index})
+
+    def _on_text(self, text: str, events: List[str]) -> None:
+        self.output_tokens += len(self._enc.encode(text))
+        if self._text_block_index is None:
+            self._text_block_index = self._next_block_index
+            self._next_block_index += 1
+            events.append(
+                _sse_event(
+                    "content_block_start",
+                    {
                         "type": "content_block_start",
-                        "index": text_block_anthropic_idx,
+                        "index": self._text_block_index,
                         "content_block": {"type": "text", "text": ""},
-                    }
-                    yield f"event: content_block_start\ndata: {json.dumps(start_text_event)}\n\n"
-
-                text_delta_event = {
+                    },
+                )
+            )
+        events.append(
+            _sse_event(
+                "content_block_delta",
+                {
                     "type": "content_block_delta",
-                    "index": text_block_anthropic_idx,
-                    "delta": {"type": "text_delta", "text": delta.content},
-                }
-                yield f"event: content_block_delta\ndata: {json.dumps(text_delta_event)}\n\n"
+                    "index": self._text_block_index,
+                    "delta": {"type": "text_delta", "text": text},
+                },
+            )
+        )
 
-            if delta.tool_calls:
-                for tool_delta in delta.tool_calls:
-                    openai_tc_idx = tool_delta.index
+    def _on_tool_delta(self, tool_delta: Any, events: List[str]) -> None:
+        tool = self._tools.get(tool_delta.index)
+        if tool is None:
+            tool = _ToolBlockState(
+                self._next_block_index, tool_delta.id, self.validate_tool_arguments
+            )
+            self._next_block_index += 1
+            self._tools[tool_delta.index] = tool
+            if not tool_delta.id:
+                warning(
+                    LogRecord(
+                        LogEvent.TOOL_ID_PLACEHOLDER.value,
+                        f"Tool call for OpenAI tool index {tool_delta.index} -> Anthropic block {tool.index} arrived without an id; waiting for it",
+                        self.request_id,
+                    )
+                )
+        elif tool_delta.id and not tool.id:
+            debug(
+                LogRecord(
+                    LogEvent.TOOL_ID_UPDATED.value,
+                    f"Received Tool ID for Anthropic block {tool.index}: {tool_delta.id}",
+                    self.request_id,
+                )
+            )
+            tool.id = tool_delta.id
+
+        function = tool_delta.function
+        arguments = None
+        if function:
+            if function.name:
+                tool.name = function.name
+            arguments = function.arguments
+            if arguments:
+                self.output_tokens += len(self._enc.encode(arguments))
+                validator = tool.validator
+                if (
+                    validator is not None
+                    and validator.error is None
+                    and not validator.feed(arguments)
+                ):
+                    self._warn_invalid_arguments(tool, arguments)
+
+        if not tool.started:
+            if arguments:
+                tool.pending.append(arguments)
+            if not (tool.id and tool.name):
+                return
+            tool.started = True
+            events.append(
+                _sse_event(
+                    "content_block_start",
+                    {
+                        "type": "content_block_start",
+                        "index": tool.index,
+                        "content_block": {
+                            "type": "tool_use",
+                            "id": tool.id,
+                            "name": tool.name,
+                            "input": {},
+                        },
+                    },
+                )
+            )
+            if tool.pending:
+                arguments = "".join(tool.pending)
+                tool.pending = []
+
+        if arguments:
+            events.append(
+                _sse_event(
+                    "content_block_delta",
+                    {
+                        "type": "content_block_delta",
+                        "index": tool.index,
+                        "delta": {"type": "input_json_delta", "partial_json": arguments},
+                    },
+                )
+            )
 
-                    if openai_tc_idx not in openai_tool_idx_to_anthropic_block_idx:
-                        current_anthropic_tool_block_idx = next_anthropic_block_idx
-                        next_anthropic_block_idx += 1
-                        openai_tool_idx_to_anthropic_block_idx[openai_tc_idx] = (
-                            current_anthropic_tool_block_idx
-                        )
+    def _warn_invalid_arguments(self, tool: _ToolBlockState, fragment: str) -> None:
+        validator = tool.validator
+        warning(
+            LogRecord(
+                event=LogEvent.TOOL_ARGS_PARSE_FAILURE.value,
+                message=f"Streamed arguments for tool '{tool.name}' (Anthropic block {tool.index}) are not valid JSON: {validator.error} at offset {validator.error_offset}.",
+                request_id=self.request_id,
+                data={"fragment": fragment[:100]},
+            )
+        )
 
-                        tool_states[current_anthropic_tool_block_idx] = {
-                            "id": tool_delta.id
-                            or f"tool_ph_{request_id}_{current_anthropic_tool_block_idx}",
-                            "name": "",
-                            "arguments_buffer": "",
-                        }
-                        if not tool_delta.id:
-                            warning(
-                                LogRecord(
-                                    LogEvent.TOOL_ID_PLACEHOLDER.value,
-                                    f"Generated placeholder Tool ID for OpenAI tool index {openai_tc_idx} -> Anthropic block {current_anthropic_tool_block_idx}",
-                                    request_id,
-                                )
-                            )
-                    else:
-                        current_anthropic_tool_block_idx = (
-                            openai_tool_idx_to_anthropic_block_idx[openai_tc_idx]
-                        )
+    def _close_arguments(self, tool: _ToolBlockState) -> List[str]:
+        """Checks for truncation at block end; may append a closing delta."""
+        validator = tool.validator
+        if validator.error is not None or validator.empty or validator.complete:
+            return []
+        suffix = validator.closing_suffix()
+        if self.repair_truncated_arguments and self.stop_reason == "max_tokens":
+            warning(
+                LogRecord(
+                    event=LogEvent.TOOL_ARGS_REPAIRED.value,
+                    message=f"Arguments for tool '{tool.name}' (Anthropic block {tool.index}) were cut off by max_tokens; closed them with {suffix!r}.",
+                    request_id=self.request_id,
+                )
+            )
+            return [
+                _sse_event(
+                    "content_block_delta",
+                    {
+                        "type": "content_block_delta",
+                        "index": tool.index,
+                        "delta": {"type": "input_json_delta", "partial_json": suffix},
+                    },
+                )
+            ]
+        warning(
+            LogRecord(
+                event=LogEvent.TOOL_ARGS_PARSE_FAILURE.value,
+                message=f"Arguments for tool '{tool.name}' (Anthropic block {tool.index}) ended mid-document (stop_reason={self.stop_reason}).",
+                request_id=self.request_id,
+                data={"missing_suffix": suffix},
+            )
+        )
+        return []
 
-                    tool_state = tool_states[current_anthropic_tool_block_idx]
 
-                    if tool_delta.id and tool_state["id"].startswith("tool_ph_"):
-                        debug(
-                            LogRecord(
-                                LogEvent.TOOL_ID_UPDATED.value,
-                                f"Updated placeholder Tool ID for Anthropic block {current_anthropic_tool_block_idx} to {tool_delta.id}",
-                                request_id,
-                            )
-                        )
-                        tool_state["id"] = tool_delta.id
-
-                    if tool_delta.function:
-                        if tool_delta.function.name:
-                            tool_state["name"] = tool_delta.function.name
-                        if tool_delta.function.arguments:
-                            tool_state["arguments_buffer"] += (
-                                tool_delta.function.arguments
-                            )
-                            output_token_count += len(
-                                enc.encode(tool_delta.function.arguments)
-                            )
+class _ClientDisconnected(Exception):
+    """The upstream reader saw is_disconnected() report the client gone."""
 
-                    if (
-                        current_anthropic_tool_block_idx not in sent_tool_block_starts
-                        and tool_state["id"]
-                        and not tool_state["id"].startswith("tool_ph_")
-                        and tool_state["name"]
-                    ):
-                        start_tool_event = {
-                            "type": "content_block_start",
-                            "index": current_anthropic_tool_block_idx,
-                            "content_block": {
-                                "type": "tool_use",
-                                "id": tool_state["id"],
-                                "name": tool_state["name"],
-                                "input": {},
-                            },
-                        }
-                        yield f"event: content_block_start\ndata: {json.dumps(start_tool_event)}\n\n"
-                        sent_tool_block_starts.add(current_anthropic_tool_block_idx)
 
-                    if (
-                        tool_delta.function
-                        and tool_delta.function.arguments
-                        and current_anthropic_tool_block_idx in sent_tool_block_starts
-                    ):
-                        args_delta_event = {
-                            "type": "content_block_delta",
-                            "index": current_anthropic_tool_block_idx,
-                            "delta": {
-                                "type": "input_json_delta",
-                                "partial_json": tool_delta.function.arguments,
-                            },
-                        }
-                        yield f"event: content_block_delta\ndata: {json.dumps(args_delta_event)}\n\n"
+async def _translate_openai_stream(
+    openai_stream: Any,
+    translator: AnthropicStreamTranslator,
+    timer: Optional[RequestTimer],
+    is_disconnected: Optional[Callable[[], Awaitable[bool]]],
+) -> AsyncGenerator[str, None]:
+    """Upstream reader: iterates the stream and yields translated SSE events."""
+    check_interval = settings.stream_disconnect_check_interval
+    next_disconnect_check = (
+        time.monotonic() + check_interval
+        if is_disconnected is not None and check_interval > 0
+        else float("inf")
+    )
+    for event in translator.start():
+        yield event
+
+    async for chunk in openai_stream:
+        if not translator.chunk_count:
+            translator.first_chunk_at = time.monotonic()
+            if timer is not None:
+                timer.mark("first_byte")
+        for event in translator.feed(chunk):
+            yield event
+        if translator.finished and (translator.usage is not None or not translator.await_usage):
+            break
+        if time.monotonic() >= next_disconnect_check:
+            next_disconnect_check = time.monotonic() + check_interval
+            if await is_disconnected():
+                raise _ClientDisconnected()
+
+    for event in translator.finish():
+        yield event
+
+
+async def _pump_stream(events: AsyncGenerator[str, None], buffer: StreamBuffer) -> None:
+    """Reader task: moves events into *buffer*; the writer sees any failure."""
+    try:
+        async for event in events:
+            await buffer.put(event)
+    except asyncio.CancelledError:
+        buffer.close()
+        raise
+    except Exception as exc:
+        buffer.close(exc)
+    else:
+        buffer.close()
+    finally:
+        await events.aclose()
 
-            if openai_finish_reason:
-                final_anthropic_stop_reason = openai_to_anthropic_stop_reason_map.get(
-                    openai_finish_reason, "end_turn"
-                )
-                if openai_finish_reason == "tool_calls":
-                    final_anthropic_stop_reason = "tool_use"
-                break
 
-        if text_block_anthropic_idx is not None:
-            yield f"event: content_block_stop\ndata: {json.dumps({'type': 'content_block_stop', 'index': text_block_anthropic_idx})}\n\n"
+async def handle_anthropic_streaming_response_from_openai_stream(
+    openai_stream: Union[
+        openai.AsyncStream[openai.types.chat.ChatCompletionChunk],
+        RawChatCompletionStream,
+    ],
+    original_anthropic_model_name: str,
+    estimated_input_tokens: int,
+    request_id: str,
+    start_time_mono: float,
+    timer: Optional[RequestTimer] = None,
+    max_tokens: Optional[int] = None,
+    is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+    target_model: Optional[str] = None,
+    user_id: Optional[str] = None,
+    on_close: Optional[Callable[[], None]] = None,
+    upstream_started_at: Optional[float] = None,
+    forward_reasoning: bool = False,
+) -> AsyncGenerator[str, None]:
+    """
+    Consumes an OpenAI stream and yields Anthropic-compatible SSE events.
+    The translation itself lives in AnthropicStreamTranslator; this wrapper
+    owns the upstream iteration, error reporting, timings and logging.
+
+    If the client goes away – the server cancels or closes this generator,
+    or *is_disconnected* reports it – the upstream stream is closed at once
+    so the provider stops generating, and a stream_cancelled event is logged.
+    Given *target_model*, the finished stream is recorded in the usage ledger
+    and charged to the user's token budget; *on_close* runs once it is over.
+    Upstream reasoning becomes thinking blocks only with *forward_reasoning*.
+    """
+    translator = AnthropicStreamTranslator(
+        original_anthropic_model_name,
+        estimated_input_tokens,
+        request_id,
+        get_token_encoder(original_anthropic_model_name, request_id),
+        validate_tool_arguments=settings.stream_validate_tool_arguments,
+        repair_truncated_arguments=settings.stream_repair_truncated_tool_arguments,
+        forward_reasoning=forward_reasoning,
+        await_usage=settings.usage_ledger_enabled,
+    )
 
-        for anthropic_tool_idx in sent_tool_block_starts:
-            tool_state_to_finalize = tool_states.get(anthropic_tool_idx)
-            if tool_state_to_finalize:
-                try:
-                    json.loads(tool_state_to_finalize["arguments_buffer"])
-                except json.JSONDecodeError:
-                    warning(
-                        LogRecord(
-                            event=LogEvent.TOOL_ARGS_PARSE_FAILURE.value,
-                            message=f"Buffered arguments for tool '{tool_state_to_finalize.get('name')}' (Anthropic block {anthropic_tool_idx}) did not form valid JSON.",
-                            request_id=request_id,
-                            data={
-                                "buffered_args": tool_state_to_finalize[
-                                    "arguments_buffer"
-                                ][:100]
-                            },
-                        )
-                    )
-            yield f"event: content_block_stop\ndata: {json.dumps({'type': 'content_block_stop', 'index': anthropic_tool_idx})}\n\n"
+    stream_status_code = 200
+    stream_final_message = "Streaming request completed successfully."
+    stream_log_event = LogEvent.REQUEST_COMPLETED.value
+    stream_span = tracing.start_span("stream_translation")
+    cancel_reason: Optional[str] = None
+    translated = _translate_openai_stream(openai_stream, translator, timer, is_disconnected)
+    pump: Optional[asyncio.Task] = None
+    buffer: Optional[StreamBuffer] = None
 
-        if final_anthropic_stop_reason is None:
-            final_anthropic_stop_reason = "end_turn"
+    try:
+        if settings.stream_buffer_high_water_bytes > 0:
+            buffer = StreamBuffer(
+                settings.stream_buffer_high_water_bytes, settings.stream_buffer_policy
+            )
+            if settings.stream_keepalive_interval > 0:
+                buffer.start_keepalive(settings.stream_keepalive_interval, _SSE_PING)
+            pump = asyncio.create_task(_pump_stream(translated, buffer))
+            async for data in buffer:
+                yield data
+        else:
+            async for event in translated:
+                yield event
 
-        message_delta_event = {
-            "type": "message_delta",
-            "delta": {
-                "stop_reason": final_anthropic_stop_reason,
-                "stop_sequence": None,
-            },
-            "usage": {"output_tokens": output_token_count},
-        }
-        yield f"event: message_delta\ndata: {json.dumps(message_delta_event)}\n\n"
-        yield f"event: message_stop\ndata: {json.dumps({'type': 'message_stop'})}\n\n"
+    except (asyncio.CancelledError, GeneratorExit):
+        cancel_reason = "client_disconnected"
+        raise
+
+    except _ClientDisconnected:
+        cancel_reason = "client_disconnected"
+
+    except SlowConsumerError as e:
+        cancel_reason = "slow_consumer"
+        warning(
+            LogRecord(
+                event=LogEvent.STREAM_CANCELLED.value,
+                message=f"Dropping slow client: {e}",
+                request_id=request_id,
+            )
+        )
 
     except Exception as e:
         stream_status_code = 500
@@ -1361,7 +2181,7 @@ async def handle_anthropic_streaming_response_from_openai_stream(
             _get_anthropic_error_details_from_exc(e)
         )
         stream_final_message = f"Error during OpenAI stream conversion: {error_msg_str}"
-        final_anthropic_stop_reason = "error"
+        translator.stop_reason = "error"
 
         error(
             LogRecord(
@@ -1382,15 +2202,80 @@ async def handle_anthropic_streaming_response_from_openai_stream(
         )
 
     finally:
+        cancelled = cancel_reason is not None
+        # shielded: the surrounding task may be being cancelled
+        with anyio.CancelScope(shield=True):
+            if pump is not None:
+                pump.cancel()
+                await asyncio.gather(pump, return_exceptions=True)
+                buffer.close()
+            else:
+                await translated.aclose()
+            if cancelled:
+                await _close_upstream_stream(openai_stream, request_id)
+        if on_close is not None:
+            on_close()
+        if cancelled:
+            stream_status_code = 499
+            stream_log_event = LogEvent.STREAM_CANCELLED.value
+            stream_final_message = (
+                "Client disconnected; upstream stream closed."
+                if cancel_reason == "client_disconnected"
+                else "Client fell behind the stream buffer; stream dropped."
+            )
         duration_ms = (time.monotonic() - start_time_mono) * 1000
+        if target_model is not None and not cancelled:
+            _record_stream_telemetry(
+                target_model, stream_status_code == 200, translator, upstream_started_at
+            )
+        if target_model is not None:
+            with anyio.CancelScope(shield=True):
+                await _record_usage(
+                    request_id,
+                    user_id,
+                    original_anthropic_model_name,
+                    target_model,
+                    stream=True,
+                    status="cancelled" if cancelled else "error" if stream_status_code != 200 else "completed",
+                    usage=translator.usage,
+                    estimated_input_tokens=estimated_input_tokens,
+                    estimated_output_tokens=translator.output_tokens,
+                    duration_ms=duration_ms,
+                )
         log_data = {
             "status_code": stream_status_code,
             "duration_ms": duration_ms,
             "input_tokens": estimated_input_tokens,
-            "output_tokens": output_token_count,
-            "stop_reason": final_anthropic_stop_reason,
+            "output_tokens": translator.output_tokens,
+            "stop_reason": translator.stop_reason,
         }
-        if stream_log_event == LogEvent.REQUEST_COMPLETED.value:
+        if buffer is not None:
+            log_data["buffer_peak_bytes"] = buffer.peak_bytes
+        if cancelled:
+            log_data["reason"] = cancel_reason
+            log_data["chunk_count"] = translator.chunk_count
+            log_data["max_tokens"] = max_tokens
+            # upper bound: the model could have stopped earlier on its own
+            log_data["tokens_saved"] = (
+                max(0, max_tokens - translator.output_tokens) if max_tokens else None
+            )
+        if timer is not None:
+            timer.mark("stream_complete")
+            log_data["timings_ms"] = timer.summary()
+        if stream_span.is_recording():
+            stream_span.set_attributes(
+                {
+                    "gen_ai.response.finish_reasons": [str(translator.stop_reason)],
+                    "gen_ai.usage.output_tokens": translator.output_tokens,
+                    "proxy.chunk_count": translator.chunk_count,
+                }
+            )
+            if cancelled:
+                stream_span.set_attribute("proxy.cancelled", True)
+            elif stream_status_code != 200:
+                stream_span.set_status_error(stream_final_message)
+        stream_span.end()
+        if stream_log_event != LogEvent.REQUEST_FAILURE.value:
             info(
                 LogRecord(
                     event=stream_log_event,
@@ -1410,6 +2295,131 @@ async def handle_anthropic_streaming_response_from_openai_stream(
             )
 
 
+def _record_stream_telemetry(
+    model: str,
+    ok: bool,
+    translator: AnthropicStreamTranslator,
+    upstream_started_at: Optional[float],
+) -> None:
+    """TTFT (from the upstream call) and generation speed after the first chunk."""
+    ttft_s = tokens_per_s = None
+    first = translator.first_chunk_at
+    if ok and first is not None:
+        if upstream_started_at is not None:
+            ttft_s = first - upstream_started_at
+        generating_s = time.monotonic() - first
+        if translator.output_tokens > 1 and generating_s > 0:
+            tokens_per_s = translator.output_tokens / generating_s
+    model_telemetry.record(model, ok, ttft_s=ttft_s, tokens_per_s=tokens_per_s)
+
+
+async def _record_usage(
+    request_id: str,
+    user_id: Optional[str],
+    client_model: str,
+    target_model: str,
+    stream: bool,
+    status: str,
+    usage: Any,
+    estimated_input_tokens: int,
+    estimated_output_tokens: int,
+    duration_ms: float,
+) -> None:
+    """
+    Adds one request to the usage ledger and the user's token budget: the
+    provider's usage when it sent any (and its `cost`, as OpenRouter does),
+    else the proxy's estimates, priced from the catalog.
+    """
+    reported = provider_usage(usage)
+    if reported is not None:
+        input_tokens, output_tokens, reasoning_tokens, cost = reported
+        source = "provider"
+    else:
+        input_tokens, output_tokens, reasoning_tokens, cost = (
+            estimated_input_tokens,
+            estimated_output_tokens,
+            0,
+            None,
+        )
+        source = "estimated"
+    await user_budgets.charge(user_id, input_tokens + output_tokens)
+    if not settings.usage_ledger_enabled:
+        return
+    if cost is None:
+        pricing = get_model_pricing(target_model)
+        if pricing is not None:
+            cost = pricing.cost(input_tokens, output_tokens)
+    usage_ledger.record(
+        UsageRecord(
+            ts=time.time(),
+            request_id=request_id,
+            user_id=user_id,
+            client_model=client_model,
+            target_model=target_model,
+            stream=stream,
+            status=status,
+            usage_source=source,
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            reasoning_tokens=reasoning_tokens,
+            cost_usd=cost,
+            duration_ms=duration_ms,
+        )
+    )
+
+
+async def _close_upstream_stream(stream: Any, request_id: str) -> None:
+    """Closes an SDK or raw upstream stream, releasing its connection."""
+    try:
+        await stream.close()
+    except Exception as exc:
+        warning(
+            LogRecord(
+                LogEvent.STREAM_CANCELLED.value,
+                "Closing the upstream stream failed",
+                request_id,
+            ),
+            exc=exc,
+        )
+
+
+def _strip_tool_payload(params: Dict[str, Any]) -> Dict[str, Any]:
+    """Copy of *params* without tools, tool_choice and assistant tool_calls."""
+    # Create a copy of params without tool-related keys
+    retry_params = {k: v for k, v in params.items() if k not in ("tools", "tool_choice")}
+
+    # Remove assistant.tool_calls from messages to satisfy OpenAI spec
+    if "messages" in retry_params:
+        messages_copy = []
+        for msg in retry_params["messages"]:
+            if isinstance(msg, dict):
+                msg_copy = msg.copy()
+                if msg_copy.get("role") == "assistant" and "tool_calls" in msg_copy:
+                    msg_copy.pop("tool_calls")
+                    if not msg_copy.get("content"):
+                        msg_copy["content"] = ""
+                messages_copy.append(msg_copy)
+            else:
+                messages_copy.append(msg)
+        retry_params["messages"] = messages_copy
+    return retry_params
+
+
+def _upstream_span(params: Dict[str, Any], allow_retry: bool) -> Any:
+    span = tracing.span("upstream.chat_completions", "client")
+    if span.is_recording():
+        span.set_attributes(
+            {
+                "gen_ai.request.model": params.get("model"),
+                "gen_ai.request.max_tokens": params.get("max_tokens"),
+                "proxy.stream": bool(params.get("stream")),
+                "proxy.tool_count": len(params.get("tools") or ()),
+                "proxy.retry_count": 0 if allow_retry else 1,
+            }
+        )
+    return span
+
+
 async def _safe_create_completion(
     params: Dict[str, Any], 
     request_id: str,
@@ -1419,7 +2429,10 @@ async def _safe_create_completion(
     Safely create a chat completion with automatic tool stripping retry on 404.
     """
     try:
-        return await openai_client.chat.completions.create(**params)
+        with _upstream_span(params, allow_retry):
+            return await get_openai_client().chat.completions.create(
+                **params, extra_headers=tracing.propagation_headers() or None
+            )
     except openai.NotFoundError as e:
         if (
             allow_retry
@@ -1437,24 +2450,8 @@ async def _safe_create_completion(
                 )
             )
             
-            # Create a copy of params without tool-related keys
-            retry_params = {k: v for k, v in params.items() if k not in ("tools", "tool_choice")}
-            
-            # Remove assistant.tool_calls from messages to satisfy OpenAI spec
-            if "messages" in retry_params:
-                messages_copy = []
-                for msg in retry_params["messages"]:
-                    if isinstance(msg, dict):
-                        msg_copy = msg.copy()
-                        if msg_copy.get("role") == "assistant" and "tool_calls" in msg_copy:
-                            msg_copy.pop("tool_calls")
-                            if not msg_copy.get("content"):
-                                msg_copy["content"] = ""
-                        messages_copy.append(msg_copy)
-                    else:
-                        messages_copy.append(msg)
-                retry_params["messages"] = messages_copy
-            
+            retry_params = _strip_tool_payload(params)
+
             # Retry without tools (no further retries allowed)
             return await _safe_create_completion(retry_params, request_id, allow_retry=False)
         raise
@@ -1469,7 +2466,10 @@ async def _safe_create_completion_stream(
     Safely create a streaming chat completion with automatic tool stripping retry on 404.
     """
     try:
-        return await openai_client.chat.completions.create(**params)
+        with _upstream_span(params, allow_retry):
+            return await get_openai_client().chat.completions.create(
+                **params, extra_headers=tracing.propagation_headers() or None
+            )
     except openai.NotFoundError as e:
         if (
             allow_retry
@@ -1487,53 +2487,881 @@ async def _safe_create_completion_stream(
                 )
             )
             
-            # Create a copy of params without tool-related keys
-            retry_params = {k: v for k, v in params.items() if k not in ("tools", "tool_choice")}
-            
-            # Remove assistant.tool_calls from messages to satisfy OpenAI spec
-            if "messages" in retry_params:
-                messages_copy = []
-                for msg in retry_params["messages"]:
-                    if isinstance(msg, dict):
-                        msg_copy = msg.copy()
-                        if msg_copy.get("role") == "assistant" and "tool_calls" in msg_copy:
-                            msg_copy.pop("tool_calls")
-                            if not msg_copy.get("content"):
-                                msg_copy["content"] = ""
-                        messages_copy.append(msg_copy)
-                    else:
-                        messages_copy.append(msg)
-                retry_params["messages"] = messages_copy
-            
+            retry_params = _strip_tool_payload(params)
+
             # Retry without tools (no further retries allowed)
             return await _safe_create_completion_stream(retry_params, request_id, allow_retry=False)
         raise
 
 
-app = fastapi.FastAPI(
-    title=settings.app_name,
-    description="Routes Anthropic API requests to an OpenAI-compatible API, selecting models dynamically.",
-    version=settings.app_version,
-    docs_url=None,
-    redoc_url=None,
+def _is_failover_error(exc: Exception) -> bool:
+    """Upstream failures another model may not have: overload, 5xx, transport."""
+    return isinstance(
+        exc,
+        (
+            openai.RateLimitError,
+            openai.InternalServerError,
+            openai.APIConnectionError,
+            httpx.TransportError,
+        ),
+    )
+
+
+async def _open_completion(params: Dict[str, Any], request_id: str) -> Any:
+    """
+    A completion, or a stream when params["stream"] (SDK or raw, per settings),
+    through the circuit breaker for (base_url, model): raises CircuitOpenError
+    without calling upstream while it is open.
+    """
+    with circuit_breakers.guard((settings.base_url, params["model"])):
+        if not params.get("stream"):
+            return await _safe_create_completion(params, request_id)
+        if settings.upstream_stream_mode == "raw":
+            return await _safe_create_raw_stream(params, request_id)
+        return await _safe_create_completion_stream(params, request_id)
+
+
+def _params_for_model(
+    params: Dict[str, Any],
+    anthropic_tools: Optional[List[Tool]],
+    openai_tool_choice: Optional[Union[str, Dict[str, Any]]],
+    model: str,
+    request_id: str,
+) -> Dict[str, Any]:
+    """
+    *params* retargeted to *model*: tools converted for its schema dialect,
+    or stripped when it doesn't support tools.
+    """
+    if not anthropic_tools:
+        return {**params, "model": model}
+    if provider_supports_tools(model):
+        retargeted = {
+            **params,
+            "model": model,
+            "tools": convert_anthropic_tools_to_openai(anthropic_tools, model),
+        }
+        retargeted.pop("tool_choice", None)
+        if openai_tool_choice:
+            retargeted["tool_choice"] = openai_tool_choice
+        return retargeted
+    debug(
+        LogRecord(
+            event=LogEvent.TOOL_CAPABILITY_DOWNGRADE.value,
+            message=f"Stripping tool payload for fallback model '{model}' - model does not support tools",
+            request_id=request_id,
+            data={"target_model": model, "supports_tools": False, "tool_count": len(anthropic_tools)},
+        )
+    )
+    return _strip_tool_payload({**params, "model": model})
+
+
+async def _create_with_fallbacks(
+    params: Dict[str, Any],
+    request_id: str,
+    fallbacks: Sequence[str] = (),
+    params_for: Optional[Callable[[str], Dict[str, Any]]] = None,
+) -> Tuple[str, Any, float]:
+    """
+    Opens the completion with params["model"] and, while that fails with a
+    failover error or its circuit is open, with each of the route's
+    *fallbacks* in turn; *params_for* builds a fallback's params (e.g. its
+    own tool dialect). Returns the model that answered, its response and
+    when that attempt started (monotonic), so TTFT excludes failed attempts.
+    """
+    models = [params["model"], *(m for m in fallbacks if m != params["model"])]
+
+    def attempt_params(model: str) -> Dict[str, Any]:
+        if model == params["model"]:
+            return params
+        return params_for(model) if params_for is not None else {**params, "model": model}
+
+    for model, next_model in zip(models, models[1:]):
+        started_at = time.monotonic()
+        try:
+            return model, await _open_completion(attempt_params(model), request_id), started_at
+        except CircuitOpenError:
+            info(
+                LogRecord(
+                    event=LogEvent.MODEL_FALLBACK.value,
+                    message=f"Circuit for model '{model}' is open, falling back to '{next_model}'.",
+                    request_id=request_id,
+                    data={"failed_model": model, "fallback_model": next_model, "circuit_open": True},
+                )
+            )
+        except Exception as e:
+            if not _is_failover_error(e):
+                raise
+            model_telemetry.record(model, ok=False)
+            warning(
+                LogRecord(
+                    event=LogEvent.MODEL_FALLBACK.value,
+                    message=f"Model '{model}' failed, falling back to '{next_model}'.",
+                    request_id=request_id,
+                    data={"failed_model": model, "fallback_model": next_model},
+                ),
+                exc=e,
+            )
+    started_at = time.monotonic()
+    try:
+        return (
+            models[-1],
+            await _open_completion(attempt_params(models[-1]), request_id),
+            started_at,
+        )
+    except CircuitOpenError:
+        raise
+    except Exception as e:
+        if _is_failover_error(e):
+            model_telemetry.record(models[-1], ok=False)
+        raise
+
+
+# ---------------------------------------------------------------------------
+# Raw SSE upstream path (UPSTREAM_STREAM_MODE=raw)
+# ---------------------------------------------------------------------------
+# The SDK builds a ChatCompletionChunk model per SSE event; the translator only
+# reads delta.content, delta.tool_calls and finish_reason. These slotted views
+# expose exactly those attributes over the decoded JSON.
+
+
+class _RawFunctionDelta:
+    __slots__ = ("name", "arguments")
+
+    def __init__(self, data: Dict[str, Any]) -> None:
+        self.name = data.get("name")
+        self.arguments = data.get("arguments")
+
+
+class _RawToolCallDelta:
+    __slots__ = ("index", "id", "function")
+
+    def __init__(self, data: Dict[str, Any]) -> None:
+        self.index = data.get("index", 0)
+        self.id = data.get("id")
+        function = data.get("function")
+        self.function = _RawFunctionDelta(function) if function else None
+
+
+class _RawDelta:
+    __slots__ = ("content", "reasoning", "tool_calls")
+
+    def __init__(self, data: Dict[str, Any]) -> None:
+        self.content = data.get("content")
+        self.reasoning = data.get("reasoning") or data.get("reasoning_content")
+        tool_calls = data.get("tool_calls")
+        self.tool_calls = (
+            [_RawToolCallDelta(tc) for tc in tool_calls] if tool_calls else None
+        )
+
+
+class _RawChoice:
+    __slots__ = ("delta", "finish_reason")
+
+    def __init__(self, data: Dict[str, Any]) -> None:
+        self.delta = _RawDelta(data.get("delta") or {})
+        self.finish_reason = data.get("finish_reason")
+
+
+class _RawChunk:
+    __slots__ = ("choices", "usage")
+
+    def __init__(self, data: Dict[str, Any]) -> None:
+        self.choices = [_RawChoice(c) for c in data.get("choices") or ()]
+        self.usage = data.get("usage")
+
+
+_STATUS_ERROR_CLASSES: Dict[int, str] = {
+    400: "BadRequestError",
+    401: "AuthenticationError",
+    403: "PermissionDeniedError",
+    404: "NotFoundError",
+    409: "ConflictError",
+    422: "UnprocessableEntityError",
+    429: "RateLimitError",
+}
+
+
+def _status_error_from_response(response: httpx.Response, body: bytes) -> Exception:
+    """Maps an upstream error response to the SDK exception the proxy already handles."""
+    try:
+        parsed: Any = json.loads(body)
+    except ValueError:
+        parsed = body.decode("utf-8", errors="replace")
+    err = parsed.get("error", parsed) if isinstance(parsed, dict) else parsed
+    message = (
+        err.get("message") if isinstance(err, dict) and err.get("message") else str(parsed)
+    )
+    class_name = _STATUS_ERROR_CLASSES.get(response.status_code)
+    if class_name is None:
+        class_name = (
+            "InternalServerError" if response.status_code >= 500 else "APIStatusError"
+        )
+    error_cls = getattr(openai, class_name)
+    return error_cls(
+        f"Error code: {response.status_code} - {parsed}",
+        response=response,
+        body=err if message else parsed,
+    )
+
+
+class RawChatCompletionStream:
+    """Async iterator of chunk views parsed straight from the upstream SSE body."""
+
+    def __init__(self, response: httpx.Response) -> None:
+        self.response = response
+
+    def __aiter__(self) -> AsyncIterator[_RawChunk]:
+        return self._iter_chunks()
+
+    async def _iter_chunks(self) -> AsyncIterator[_RawChunk]:
+        try:
+            async for line in self.response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                payload = json.loads(data)
+                if "error" in payload and not payload.get("choices"):
+                    err = payload["error"]
+                    raise openai.APIError(
+                        err.get("message", str(err)) if isinstance(err, dict) else str(err),
+                        self.response.request,
+                        body=err,
+                    )
+                yield _RawChunk(payload)
+        except httpx.TransportError as e:
+            raise _sdk_transport_error(e, self.response.request) from e
+        finally:
+            await self.response.aclose()
+
+    async def close(self) -> None:
+        await self.response.aclose()
+
+
+_upstream_http_client: Optional[httpx.AsyncClient] = None
+
+
+def _sdk_transport_error(exc: httpx.TransportError, request: httpx.Request) -> openai.APIConnectionError:
+    """What the SDK raises for the same transport failure, so both paths map errors alike."""
+    if isinstance(exc, httpx.TimeoutException):
+        return openai.APITimeoutError(request=request)
+    return openai.APIConnectionError(message=f"Connection error: {exc}", request=request)
+
+
+def _raw_request_body(params: Dict[str, Any]) -> Dict[str, Any]:
+    """SDK-style params as a JSON body: extra_body is merged in, as the SDK does."""
+    extra = params.get("extra_body")
+    if not extra:
+        return params
+    body = {k: v for k, v in params.items() if k != "extra_body"}
+    body.update(extra)
+    return body
+
+
+def get_upstream_http_client() -> httpx.AsyncClient:
+    """Plain httpx client for the raw streaming path, built on first use."""
+    global _upstream_http_client
+    if _upstream_http_client is None:
+        _upstream_http_client = httpx.AsyncClient(
+            base_url=settings.base_url.rstrip("/") + "/",
+            headers={
+                "Authorization": f"Bearer {settings.openai_api_key}",
+                "HTTP-Referer": settings.referrer_url,
+                "X-Title": settings.app_name,
+            },
+            timeout=180.0,
+        )
+    return _upstream_http_client
+
+
+async def _safe_create_raw_stream(
+    params: Dict[str, Any],
+    request_id: str,
+    allow_retry: bool = True,
+) -> RawChatCompletionStream:
+    """
+    Raw-SSE counterpart of _safe_create_completion_stream: same error mapping
+    (transport failures included) and the same tool-stripping retry on 404,
+    without the SDK's chunk models.
+    """
+    client = get_upstream_http_client()
+    with _upstream_span(params, allow_retry):
+        upstream_request = client.build_request(
+            "POST",
+            "chat/completions",
+            json=_raw_request_body(params),
+            headers=tracing.propagation_headers() or None,
+        )
+        try:
+            response = await client.send(upstream_request, stream=True)
+        except httpx.TransportError as e:
+            raise _sdk_transport_error(e, upstream_request) from e
+    if response.status_code < 400:
+        return RawChatCompletionStream(response)
+
+    try:
+        body = await response.aread()
+    finally:
+        await response.aclose()
+    exc = _status_error_from_response(response, body)
+    if (
+        allow_retry
+        and isinstance(exc, openai.NotFoundError)
+        and "support tool use" in str(exc).lower()
+    ):
+        warning(
+            LogRecord(
+                event=LogEvent.TOOL_RETRY_ATTEMPT.value,
+                message="Retrying raw streaming request without tool payload after 404 'support tool use' error.",
+                request_id=request_id,
+                data={
+                    "original_model": params.get("model"),
+                    "original_error": str(exc),
+                },
+            )
+        )
+        return await _safe_create_raw_stream(
+            _strip_tool_payload(params), request_id, allow_retry=False
+        )
+    raise exc
+
+
+# ---------------------------------------------------------------------------
+# Anthropic-native passthrough
+# ---------------------------------------------------------------------------
+
+_MODEL_FIELD_RE = re.compile(rb'"model"\s*:\s*"(?:[^"\\]|\\.)*"')
+
+_anthropic_http_client: Optional[httpx.AsyncClient] = None
+
+
+def get_anthropic_http_client() -> httpx.AsyncClient:
+    """httpx client for the Anthropic-compatible upstream, built on first use."""
+    global _anthropic_http_client
+    if _anthropic_http_client is None:
+        api_key = settings.anthropic_passthrough_api_key or settings.openai_api_key
+        _anthropic_http_client = httpx.AsyncClient(
+            base_url=(settings.anthropic_passthrough_base_url or "").rstrip("/") + "/",
+            headers={
+                "x-api-key": api_key,
+                "Authorization": f"Bearer {api_key}",
+                "HTTP-Referer": settings.referrer_url,
+                "X-Title": settings.app_name,
+            },
+            timeout=180.0,
+        )
+    return _anthropic_http_client
+
+
+def is_anthropic_passthrough_target(target_model_name: str) -> bool:
+    return bool(settings.anthropic_passthrough_base_url) and (
+        target_model_name.lower().startswith("anthropic/")
+    )
+
+
+def _rewrite_model_field(
+    raw_bytes: bytes, raw_body: Dict[str, Any], model: str
+) -> bytes:
+    """
+    Swaps the top-level "model" value without re-serializing the body. Falls
+    back to json.dumps when the key isn't unique (e.g. nested "model" keys).
+    """
+    matches = _MODEL_FIELD_RE.findall(raw_bytes)
+    if len(matches) == 1:
+        return _MODEL_FIELD_RE.sub(
+            b'"model": ' + json.dumps(model).encode("utf-8"), raw_bytes, count=1
+        )
+    return json.dumps({**raw_body, "model": model}).encode("utf-8")
+
+
+class _AnthropicStreamUsage:
+    """
+    Usage from relayed Anthropic SSE bytes: message_start carries the input
+    side, message_delta the cumulative output. Only those two events are
+    parsed; everything else is skipped by its `event:` line.
+    """
+
+    __slots__ = ("usage", "_pending")
+
+    def __init__(self) -> None:
+        self.usage: Optional[Dict[str, Any]] = None
+        self._pending = b""
+
+    def feed(self, data: bytes) -> None:
+        buf = self._pending + data if self._pending else data
+        start = 0
+        while True:
+            end = buf.find(b"\n\n", start)
+            if end < 0:
+                break
+            block = buf[start:end]
+            if block.startswith((b"event: message_start", b"event: message_delta")):
+                self._parse(block)
+            start = end + 2
+        self._pending = buf[start:]
+
+    def _parse(self, block: bytes) -> None:
+        for line in block.split(b"\n"):
+            if not line.startswith(b"data:"):
+                continue
+            try:
+                event = json.loads(line[5:])
+            except ValueError:
+                return
+            usage = (
+                (event.get("message") or {}).get("usage")
+                if event.get("type") == "message_start"
+                else event.get("usage")
+            )
+            if isinstance(usage, dict):
+                self.usage = {**(self.usage or {}), **usage}
+            return
+
+
+async def _relay_anthropic_stream(
+    response: httpx.Response,
+    request_id: str,
+    timer: RequestTimer,
+    on_close: Optional[Callable[[], None]] = None,
+    on_complete: Optional[Callable[[Any, str], Awaitable[None]]] = None,
+) -> AsyncGenerator[bytes, None]:
+    relayed_bytes = 0
+    usage = _AnthropicStreamUsage()
+    status = "cancelled"
+    status_code = response.status_code
+    try:
+        async for data in response.aiter_bytes():
+            if not relayed_bytes:
+                timer.mark("first_byte")
+            relayed_bytes += len(data)
+            usage.feed(data)
+            yield data
+        status = "completed"
+    except httpx.HTTPError as e:
+        status = "error"
+        status_code = 502
+        error(
+            LogRecord(
+                event=LogEvent.STREAM_INTERRUPTED.value,
+                message=f"Anthropic passthrough stream broke off: {e}",
+                request_id=request_id,
+                data={"relayed_bytes": relayed_bytes},
+            ),
+            exc=e,
+        )
+        yield _format_anthropic_error_sse_event(
+            AnthropicErrorType.API_ERROR, f"Anthropic passthrough upstream failed: {e}"
+        ).encode("utf-8")
+    finally:
+        await response.aclose()
+        if on_close is not None:
+            on_close()
+        if on_complete is not None:
+            with anyio.CancelScope(shield=True):
+                await on_complete(usage.usage, status)
+        timer.mark("stream_complete")
+        info(
+            LogRecord(
+                event=LogEvent.REQUEST_COMPLETED.value,
+                message=f"Passthrough stream {status}",
+                request_id=request_id,
+                data={
+                    "status_code": status_code,
+                    "duration_ms": timer.elapsed_ms(),
+                    "passthrough": True,
+                    "relayed_bytes": relayed_bytes,
+                    "timings_ms": timer.summary(),
+                },
+            )
+        )
+
+
+async def anthropic_passthrough(
+    request: Request,
+    raw_bytes: bytes,
+    raw_body: Dict[str, Any],
+    target_model_name: str,
+    request_id: str,
+    user_id: Optional[str] = None,
+    estimated_input_tokens: int = 0,
+) -> Response:
+    """
+    Relays an Anthropic request body to an Anthropic-compatible upstream,
+    through the same fair-queue slot and circuit breakers (keyed by the
+    passthrough base URL) as translated calls. The caller has already
+    admitted the user against their budget.
+    """
+    upstream_model = target_model_name
+    if settings.anthropic_passthrough_strip_prefix:
+        upstream_model = target_model_name.split("/", 1)[-1]
+    body = _rewrite_model_field(raw_bytes, raw_body, upstream_model)
+    is_stream = bool(raw_body.get("stream"))
+
+    headers = {
+        "content-type": "application/json",
+        "anthropic-version": request.headers.get("anthropic-version", "2023-06-01"),
+    }
+    if "anthropic-beta" in request.headers:
+        headers["anthropic-beta"] = request.headers["anthropic-beta"]
+    headers.update(tracing.propagation_headers())
+
+    info(
+        LogRecord(
+            event=LogEvent.ANTHROPIC_PASSTHROUGH.value,
+            message="Relaying request to Anthropic-compatible upstream",
+            request_id=request_id,
+            data={
+                "client_model": raw_body.get("model"),
+                "target_model": upstream_model,
+                "stream": is_stream,
+                "body_bytes": len(body),
+            },
+        )
+    )
+
+    async def record_usage(usage: Any, status: str) -> None:
+        await _record_usage(
+            request_id,
+            user_id,
+            str(raw_body.get("model")),
+            target_model_name,
+            stream=is_stream,
+            status=status,
+            usage=usage,
+            estimated_input_tokens=estimated_input_tokens if status != "error" else 0,
+            estimated_output_tokens=0,
+            duration_ms=(time.monotonic() - request.state.start_time_monotonic) * 1000,
+        )
+
+    max_tokens = raw_body.get("max_tokens")
+    slot = await fair_queue.acquire(
+        user_id, estimated_input_tokens + (max_tokens if isinstance(max_tokens, int) else 0)
+    )
+    if fair_queue.enabled:
+        _request_timer(request).mark("fair_queue")
+    slot_handed_to_stream = False
+    try:
+        client = get_anthropic_http_client()
+        breaker_key = (settings.anthropic_passthrough_base_url or "", target_model_name)
+        try:
+            with circuit_breakers.guard(breaker_key) as call:
+                upstream_request = client.build_request(
+                    "POST", "messages", content=body, headers=headers
+                )
+                response = await client.send(upstream_request, stream=True)
+                if response.status_code == 429 or response.status_code >= 500:
+                    call.mark_failed()
+            _request_timer(request).mark("upstream_connect")
+        except CircuitOpenError as e:
+            await record_usage(None, "error")
+            error_response = await _log_and_return_error_response(
+                request, 503, AnthropicErrorType.OVERLOADED, str(e)
+            )
+            error_response.headers["retry-after"] = retry_after_header(e.retry_after_s)
+            return error_response
+        except httpx.HTTPError as e:
+            await record_usage(None, "error")
+            return await _log_and_return_error_response(
+                request,
+                502,
+                AnthropicErrorType.API_ERROR,
+                f"Anthropic passthrough upstream unreachable: {e}",
+                caught_exception=e,
+            )
+
+        media_type = response.headers.get("content-type", "application/json")
+        if is_stream and response.status_code < 400:
+            slot_handed_to_stream = True
+            return StreamingResponse(
+                _relay_anthropic_stream(
+                    response,
+                    request_id,
+                    _request_timer(request),
+                    on_close=slot.release,
+                    on_complete=record_usage,
+                ),
+                status_code=response.status_code,
+                media_type=media_type,
+                # releases the slot if the body never starts (release is idempotent)
+                background=BackgroundTask(slot.release),
+            )
+
+        try:
+            content = await response.aread()
+        finally:
+            await response.aclose()
+    finally:
+        if not slot_handed_to_stream:
+            slot.release()
+    usage = None
+    if response.status_code < 400:
+        try:
+            usage = json.loads(content).get("usage")
+        except (ValueError, AttributeError):
+            pass
+    await record_usage(usage, "completed" if response.status_code < 400 else "error")
+    info(
+        LogRecord(
+            event=LogEvent.REQUEST_COMPLETED.value,
+            message="Passthrough request completed",
+            request_id=request_id,
+            data={
+                "status_code": response.status_code,
+                "duration_ms": (time.monotonic() - request.state.start_time_monotonic)
+                * 1000,
+                "passthrough": True,
+                "relayed_bytes": len(content),
+            },
+        )
+    )
+    return Response(
+        content=content, status_code=response.status_code, media_type=media_type
+    )
+
+
+state_backend: StateBackend = create_state_backend(
+    settings.state_backend, settings.state_backend_url
 )
 
+usage_ledger = UsageLedger(settings.usage_db_path, settings.usage_flush_interval)
 
-def select_target_model(client_model_name: str, request_id: str) -> str:
-    """Selects the target OpenRouter model based on the client's request."""
-    client_model_lower = client_model_name.lower()
-    target_model: str
-
-    if "opus" in client_model_lower or "sonnet" in client_model_lower:
-        target_model = settings.big_model_name
-    elif "haiku" in client_model_lower:
-        target_model = settings.small_model_name
+user_budgets = UserBudgets(
+    state_backend,
+    request_budget=settings.user_request_budget,
+    token_budget=settings.user_token_budget,
+    window_s=settings.user_budget_window,
+)
+fair_queue = FairQueue(
+    settings.upstream_max_concurrency,
+    quantum=settings.fair_queue_quantum,
+    weights=settings.fair_queue_weights,
+)
+
+
+def _log_circuit_state_change(key: BreakerKey, previous: str, state: str) -> None:
+    upstream, model = key
+    (warning if state == "open" else info)(
+        LogRecord(
+            event=LogEvent.CIRCUIT_BREAKER_STATE.value,
+            message=f"Circuit for model '{model}' went from {previous} to {state}.",
+            data={"upstream": upstream, "model": model, "from": previous, "to": state},
+        )
+    )
+
+
+circuit_breakers = CircuitBreakers(
+    failure_threshold=settings.circuit_failure_threshold,
+    open_duration_s=settings.circuit_open_seconds,
+    half_open_max_calls=settings.circuit_half_open_max_calls,
+    is_failure=_is_failover_error,
+    on_state_change=_log_circuit_state_change,
+)
+
+
+def _log_blocked_loop(blocked_s: float, stack: List[str]) -> None:
+    """Called from the watchdog thread while the loop is still blocked."""
+    warning(
+        LogRecord(
+            event=LogEvent.EVENT_LOOP_BLOCKED.value,
+            message=f"Event loop blocked for {blocked_s * 1000:.0f} ms",
+            data={"blocked_ms": round(blocked_s * 1000, 1), "stack": stack[-20:]},
+        )
+    )
+
+
+def _log_usage_flush_failure(exc: Exception) -> None:
+    warning(
+        LogRecord(
+            event=LogEvent.USAGE_FLUSH_FAILED.value,
+            message="Writing usage records to SQLite failed; retrying next interval",
+            data={"db_path": settings.usage_db_path},
+        ),
+        exc=exc,
+    )
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app: fastapi.FastAPI) -> AsyncGenerator[None, None]:
+    """
+    Startup: file logging and the upstream client are set up before serving;
+    the catalog refresh and tiktoken prewarm run in background threads.
+    """
+    global _openai_client, _upstream_http_client, _anthropic_http_client
+    _configure_file_logging()
+    tracing.configure_tracing(
+        settings.tracing_enabled,
+        exporter=settings.tracing_exporter,
+        sample_ratio=settings.tracing_sample_ratio,
+        service_name=settings.app_name,
+        service_version=settings.app_version,
+        file_path=settings.tracing_file_path,
+    )
+    watchdog: Optional[LoopWatchdog] = None
+    if settings.loop_watchdog_enabled:
+        watchdog = LoopWatchdog(
+            interval_s=settings.loop_lag_interval_ms / 1000,
+            threshold_s=settings.loop_lag_threshold_ms / 1000,
+            on_block=_log_blocked_loop,
+        )
+        watchdog.start()
+        metrics.register_collector(watchdog.collect)
+    app.state.loop_watchdog = watchdog
+    metrics.register_collector(collect_stream_buffers)
+    if settings.usage_ledger_enabled:
+        usage_ledger.start(on_error=_log_usage_flush_failure)
+        metrics.register_collector(usage_ledger.collect)
+    if fair_queue.enabled:
+        metrics.register_collector(fair_queue.collect)
+    metrics.register_collector(model_telemetry.collect)
+    if circuit_breakers.enabled:
+        metrics.register_collector(circuit_breakers.collect)
+    get_openai_client()
+    app.state.background_startup_tasks = [
+        asyncio.create_task(asyncio.to_thread(refresh_catalog)),
+        asyncio.create_task(asyncio.to_thread(get_token_encoder)),
+    ]
+    try:
+        yield
+    finally:
+        if _openai_client is not None:
+            await _openai_client.close()
+            _openai_client = None
+        if _upstream_http_client is not None:
+            await _upstream_http_client.aclose()
+            _upstream_http_client = None
+        if _anthropic_http_client is not None:
+            await _anthropic_http_client.aclose()
+            _anthropic_http_client = None
+        await state_backend.close()
+        if settings.usage_ledger_enabled:
+            metrics.unregister_collector(usage_ledger.collect)
+            try:
+                await usage_ledger.stop()
+            except Exception as e:
+                _log_usage_flush_failure(e)
+        tracing.shutdown_tracing()
+        metrics.unregister_collector(fair_queue.collect)
+        metrics.unregister_collector(model_telemetry.collect)
+        metrics.unregister_collector(circuit_breakers.collect)
+        metrics.unregister_collector(collect_stream_buffers)
+        if watchdog is not None:
+            metrics.unregister_collector(watchdog.collect)
+            await watchdog.stop()
+
+
+router = fastapi.APIRouter()
+
+
+def _log_routing_reload(path: str, exc: Optional[Exception]) -> None:
+    if exc is None:
+        info(
+            LogRecord(
+                event=LogEvent.ROUTING_TABLE_RELOADED.value,
+                message=f"Reloaded routing table from {path}",
+                data={"path": path},
+            )
+        )
     else:
-        target_model = settings.small_model_name
+        error(
+            LogRecord(
+                event=LogEvent.ROUTING_TABLE_RELOADED.value,
+                message=f"Routing table {path} could not be reloaded; keeping the previous rules",
+                data={"path": path},
+            ),
+            exc=exc,
+        )
+
+
+model_routing = RoutingTableLoader(
+    settings.routing_table_path,
+    reload_interval_s=settings.routing_reload_interval,
+    on_reload=_log_routing_reload,
+)
+model_telemetry = ModelTelemetry(
+    alpha=settings.selection_ewma_alpha,
+    min_samples=settings.selection_min_samples,
+    ttft_slo_s=settings.selection_ttft_slo_ms / 1000,
+    max_error_rate=settings.selection_max_error_rate,
+    probe_interval_s=settings.selection_probe_interval,
+)
+# candidates are priced for the request's prompt plus this many output tokens
+_SELECTION_PRICE_OUTPUT_TOKENS = 1000
+
+
+def _resolve_model_alias(model: str) -> str:
+    if model == "@big":
+        return settings.big_model_name
+    if model == "@small":
+        return settings.small_model_name
+    return model
+
+
+def _has_images(messages: List[Message]) -> bool:
+    for message in messages:
+        if isinstance(message.content, str):
+            continue
+        for block in message.content:
+            if isinstance(block, ContentBlockImage):
+                return True
+            if isinstance(block, ContentBlockToolResult) and isinstance(block.content, list):
+                if any(
+                    isinstance(item, dict) and item.get("type") == "image"
+                    for item in block.content
+                ):
+                    return True
+    return False
+
+
+def _selection_price(model: str, input_tokens: Optional[int]) -> Optional[float]:
+    pricing = get_model_pricing(model)
+    if pricing is None:
+        return None
+    return pricing.cost(input_tokens or 0, _SELECTION_PRICE_OUTPUT_TOKENS)
+
+
+def select_route(
+    client_model_name: str,
+    request_id: str,
+    input_tokens: Optional[int] = None,
+    has_tools: Optional[bool] = None,
+    has_images: Optional[bool] = None,
+    user_id: Optional[str] = None,
+) -> Route:
+    """
+    Target model and fallbacks for a request, from the routing table. A
+    rule's candidates are ranked by live telemetry: the best is the target
+    and the others are tried, in rank order, before the rule's fallbacks.
+    """
+    route = model_routing.table.match(
+        client_model_name, input_tokens, has_tools, has_images, user_id
+    )
+    candidates: Tuple[str, ...] = ()
+    if route.candidates:
+        candidates = tuple(
+            model_telemetry.rank(
+                list(dict.fromkeys(_resolve_model_alias(c) for c in route.candidates)),
+                settings.selection_objective,
+                lambda model: _selection_price(model, input_tokens),
+            )
+        )
+        target_model = candidates[0]
+    else:
+        target_model = _resolve_model_alias(route.target)
+    fallbacks = tuple(
+        m
+        for m in dict.fromkeys(
+            [*candidates[1:], *(_resolve_model_alias(f) for f in route.fallbacks)]
+        )
+        if m != target_model
+    )
+    route = Route(target_model, fallbacks, route.rule, candidates)
+
+    if route.rule is None:
         warning(
             LogRecord(
                 event=LogEvent.MODEL_SELECTION.value,
-                message=f"Unknown client model '{client_model_name}', defaulting to SMALL model '{target_model}'.",
+                message=f"No routing rule matched client model '{client_model_name}', using default model '{target_model}'.",
                 request_id=request_id,
                 data={
                     "client_model": client_model_name,
@@ -1547,10 +3375,159 @@ def select_target_model(client_model_name: str, request_id: str) -> str:
             event=LogEvent.MODEL_SELECTION.value,
             message=f"Client model '{client_model_name}' mapped to target model '{target_model}'.",
             request_id=request_id,
-            data={"client_model": client_model_name, "target_model": target_model},
+            data={
+                "client_model": client_model_name,
+                "target_model": target_model,
+                "fallbacks": list(fallbacks),
+                "rule": route.rule,
+                "objective": settings.selection_objective if candidates else None,
+                "input_tokens": input_tokens,
+                "has_tools": has_tools,
+                "has_images": has_images,
+            },
+        )
+    )
+    return route
+
+
+def select_target_model(client_model_name: str, request_id: str) -> str:
+    """Target for *client_model_name* alone; rules on request shape don't match."""
+    return select_route(client_model_name, request_id).target
+
+
+class ContextWindowExceededError(Exception):
+    """Request cannot fit the target model's context window."""
+
+
+def _allowed_max_tokens(
+    target_model_name: str, estimated_input_tokens: int
+) -> Optional[int]:
+    """Largest max_tokens the catalog allows for this prompt; None when unknown."""
+    limits = get_model_limits(target_model_name)
+    if limits is None:
+        return None
+    allowed: Optional[int] = None
+    if limits.context_length:
+        allowed = limits.context_length - estimated_input_tokens
+    if limits.max_completion_tokens:
+        allowed = (
+            limits.max_completion_tokens
+            if allowed is None
+            else min(allowed, limits.max_completion_tokens)
+        )
+    return allowed
+
+
+def preflight_context_window(
+    target_model_name: str,
+    estimated_input_tokens: int,
+    max_tokens: int,
+    request_id: str,
+    fallbacks: Sequence[str] = (),
+) -> Tuple[str, int]:
+    """
+    Compares `estimated_input_tokens + max_tokens` with the target model's
+    catalog limits and applies `settings.context_overflow_policy`. "reroute"
+    tries the route's *fallbacks*, then context_fallback_model_name.
+    Returns the (possibly rerouted) target model and (possibly clamped) max_tokens;
+    raises ContextWindowExceededError when the request cannot be made to fit.
+    """
+    policy = settings.context_overflow_policy
+    if policy == "off":
+        return target_model_name, max_tokens
+
+    allowed = _allowed_max_tokens(target_model_name, estimated_input_tokens)
+    if allowed is None or max_tokens <= allowed:
+        return target_model_name, max_tokens
+
+    log_data = {
+        "policy": policy,
+        "target_model": target_model_name,
+        "estimated_input_tokens": estimated_input_tokens,
+        "requested_max_tokens": max_tokens,
+        "allowed_max_tokens": allowed,
+    }
+
+    if policy == "reroute":
+        for fallback_model in (*fallbacks, settings.context_fallback_model_name):
+            if not fallback_model or fallback_model == target_model_name:
+                continue
+            fallback_allowed = _allowed_max_tokens(fallback_model, estimated_input_tokens)
+            if fallback_allowed is None or max_tokens <= fallback_allowed:
+                warning(
+                    LogRecord(
+                        event=LogEvent.CONTEXT_WINDOW_PREFLIGHT.value,
+                        message=f"Request exceeds limits of '{target_model_name}', rerouting to '{fallback_model}'.",
+                        request_id=request_id,
+                        data={**log_data, "fallback_model": fallback_model},
+                    )
+                )
+                return fallback_model, max_tokens
+
+    if policy in ("clamp", "reroute") and allowed > 0:
+        warning(
+            LogRecord(
+                event=LogEvent.CONTEXT_WINDOW_PREFLIGHT.value,
+                message=f"Clamped max_tokens from {max_tokens} to {allowed} for model '{target_model_name}'.",
+                request_id=request_id,
+                data=log_data,
+            )
         )
+        return target_model_name, allowed
+
+    raise ContextWindowExceededError(
+        f"Request needs ~{estimated_input_tokens} input tokens + {max_tokens} max_tokens, "
+        f"which exceeds the limits of model '{target_model_name}'."
     )
-    return target_model
+
+
+def preflight_fallbacks(
+    fallbacks: Sequence[str],
+    estimated_input_tokens: int,
+    max_tokens: int,
+    request_id: str,
+) -> Tuple[str, ...]:
+    """
+    The route's *fallbacks* whose catalog limits fit the prompt plus the
+    (preflighted) max_tokens, so a failover can't overflow a smaller model.
+    Unknown models are kept; with policy "off" nothing is filtered.
+    """
+    if settings.context_overflow_policy == "off":
+        return tuple(fallbacks)
+    kept: List[str] = []
+    for model in fallbacks:
+        allowed = _allowed_max_tokens(model, estimated_input_tokens)
+        if allowed is None or max_tokens <= allowed:
+            kept.append(model)
+            continue
+        warning(
+            LogRecord(
+                event=LogEvent.CONTEXT_WINDOW_PREFLIGHT.value,
+                message=f"Dropping fallback '{model}': request exceeds its limits.",
+                request_id=request_id,
+                data={
+                    "fallback_model": model,
+                    "estimated_input_tokens": estimated_input_tokens,
+                    "max_tokens": max_tokens,
+                    "allowed_max_tokens": allowed,
+                },
+            )
+        )
+    return tuple(kept)
+
+
+def _compaction_budget(target_model_name: str, max_tokens: int) -> Optional[int]:
+    """
+    Input-token budget for compaction; None when no budget can be derived or
+    max_tokens leaves none, since compacting everything wouldn't fit either.
+    """
+    if settings.compaction_max_input_tokens is not None:
+        return settings.compaction_max_input_tokens
+    limits = get_model_limits(target_model_name)
+    if limits is None or not limits.context_length:
+        return None
+    budget = int(limits.context_length * settings.compaction_context_ratio) - max_tokens
+    return budget if budget > 0 else None
 
 
 def _build_anthropic_error_response(
@@ -1617,10 +3594,30 @@ async def _log_and_return_error_response(
     )
 
 
-@app.post("/v1/messages", response_model=None, tags=["API"], status_code=200)
+async def _admit_user(request: Request, user_id: Optional[str]) -> Optional[JSONResponse]:
+    """None when the user is within budget, else the 429 to send back."""
+    try:
+        await user_budgets.admit(user_id)
+    except BudgetExceeded as e:
+        response = await _log_and_return_error_response(
+            request, 429, AnthropicErrorType.RATE_LIMIT, str(e)
+        )
+        response.headers["retry-after"] = retry_after_header(e.retry_after_s)
+        return response
+    return None
+
+
+def _request_timer(request: Request) -> RequestTimer:
+    timer = getattr(request.state, "timer", None)
+    if timer is None:
+        timer = request.state.timer = RequestTimer()
+    return timer
+
+
+@router.post("/v1/messages", response_model=None, tags=["API"], status_code=200)
 async def create_message_proxy(
     request: Request,
-) -> Union[JSONResponse, StreamingResponse]:
+) -> Union[JSONResponse, StreamingResponse, Response]:
     """
     Main endpoint for Anthropic message completions, proxied to an OpenAI-compatible API.
     Handles request/response conversions, streaming, and dynamic model selection.
@@ -1628,9 +3625,12 @@ async def create_message_proxy(
     request_id = str(uuid.uuid4())
     request.state.request_id = request_id
     request.state.start_time_monotonic = time.monotonic()
+    timer = _request_timer(request)
 
     try:
-        raw_body = await request.json()
+        raw_bytes = await request.body()
+        raw_body = json.loads(raw_bytes)
+        timer.mark("parse")
         debug(
             LogRecord(
                 LogEvent.ANTHROPIC_REQUEST.value,
@@ -1643,6 +3643,7 @@ async def create_message_proxy(
         anthropic_request = MessagesRequest.model_validate(
             raw_body, context={"request_id": request_id}
         )
+        timer.mark("validate")
     except json.JSONDecodeError as e:
         return await _log_and_return_error_response(
             request,
@@ -1661,7 +3662,12 @@ async def create_message_proxy(
         )
 
     is_stream = anthropic_request.stream or False
-    target_model_name = select_target_model(anthropic_request.model, request_id)
+    user_id: Optional[str] = None
+    if anthropic_request.metadata and anthropic_request.metadata.get("user_id"):
+        user_id = str(anthropic_request.metadata.get("user_id"))
+    denied = await _admit_user(request, user_id)
+    if denied is not None:
+        return denied
 
     estimated_input_tokens = count_tokens_for_anthropic_request(
         messages=anthropic_request.messages,
@@ -1670,6 +3676,63 @@ async def create_message_proxy(
         tools=anthropic_request.tools,
         request_id=request_id,
     )
+    timer.mark("token_count")
+
+    route = select_route(
+        anthropic_request.model,
+        request_id,
+        input_tokens=estimated_input_tokens,
+        has_tools=bool(anthropic_request.tools),
+        has_images=_has_images(anthropic_request.messages),
+        user_id=user_id,
+    )
+    target_model_name = route.target
+    if is_anthropic_passthrough_target(target_model_name):
+        return await anthropic_passthrough(
+            request,
+            raw_bytes,
+            raw_body,
+            target_model_name,
+            request_id,
+            user_id=user_id,
+            estimated_input_tokens=estimated_input_tokens,
+        )
+
+    messages = anthropic_request.messages
+    if settings.compaction_enabled:
+        compaction_budget = _compaction_budget(
+            target_model_name, anthropic_request.max_tokens
+        )
+        if compaction_budget is not None:
+            messages, estimated_input_tokens = compact_anthropic_messages(
+                messages,
+                estimated_input_tokens,
+                compaction_budget,
+                settings.compaction_keep_recent_messages,
+                settings.compaction_tool_result_max_tokens,
+                anthropic_request.model,
+                request_id,
+            )
+            timer.mark("compaction")
+
+    try:
+        target_model_name, max_tokens = preflight_context_window(
+            target_model_name,
+            estimated_input_tokens,
+            anthropic_request.max_tokens,
+            request_id,
+            fallbacks=route.fallbacks,
+        )
+    except ContextWindowExceededError as e:
+        return await _log_and_return_error_response(
+            request,
+            413,
+            AnthropicErrorType.REQUEST_TOO_LARGE,
+            str(e),
+        )
+    fallbacks = preflight_fallbacks(
+        route.fallbacks, estimated_input_tokens, max_tokens, request_id
+    )
 
     info(
         LogRecord(
@@ -1679,22 +3742,40 @@ async def create_message_proxy(
             data={
                 "client_model": anthropic_request.model,
                 "target_model": target_model_name,
+                "route_rule": route.rule,
                 "stream": is_stream,
                 "estimated_input_tokens": estimated_input_tokens,
+                "max_tokens": max_tokens,
                 "client_ip": request.client.host if request.client else "unknown",
                 "user_agent": request.headers.get("user-agent", "unknown"),
             },
         )
     )
 
-    try:
-        openai_messages = convert_anthropic_to_openai_messages(
-            anthropic_request.messages, anthropic_request.system, request_id=request_id
-        )
-        openai_tools = convert_anthropic_tools_to_openai(anthropic_request.tools)
-        openai_tool_choice = convert_anthropic_tool_choice_to_openai(
-            anthropic_request.tool_choice, request_id
+    request_span = tracing.current_span()
+    if request_span.is_recording():
+        request_span.set_attributes(
+            {
+                "gen_ai.request.model": anthropic_request.model,
+                "proxy.target_model": target_model_name,
+                "proxy.stream": is_stream,
+                "proxy.estimated_input_tokens": estimated_input_tokens,
+                "gen_ai.request.max_tokens": max_tokens,
+            }
         )
+
+    try:
+        with tracing.span("convert_request"):
+            openai_messages = convert_anthropic_to_openai_messages(
+                messages, anthropic_request.system, request_id=request_id
+            )
+            openai_tools = convert_anthropic_tools_to_openai(
+                anthropic_request.tools, target_model_name
+            )
+            openai_tool_choice = convert_anthropic_tool_choice_to_openai(
+                anthropic_request.tool_choice, request_id
+            )
+        timer.mark("convert")
     except Exception as e:
         return await _log_and_return_error_response(
             request,
@@ -1706,8 +3787,8 @@ async def create_message_proxy(
 
     openai_params: Dict[str, Any] = {
         "model": target_model_name,
-        "messages": cast(List[ChatCompletionMessageParam], openai_messages),
-        "max_tokens": anthropic_request.max_tokens,
+        "messages": cast("List[ChatCompletionMessageParam]", openai_messages),
+        "max_tokens": max_tokens,
         "stream": is_stream,
     }
     if anthropic_request.temperature is not None:
@@ -1716,13 +3797,23 @@ async def create_message_proxy(
         openai_params["top_p"] = anthropic_request.top_p
     if anthropic_request.stop_sequences:
         openai_params["stop"] = anthropic_request.stop_sequences
+    thinking = anthropic_request.thinking
+    thinking_enabled = thinking is not None and thinking.type == "enabled"
+    forward_reasoning = settings.forward_reasoning and thinking_enabled
+    if thinking_enabled:
+        # OpenRouter's unified reasoning parameter; the SDK has no such kwarg
+        openai_params["extra_body"] = {
+            "reasoning": {"max_tokens": thinking.budget_tokens}
+            if thinking.budget_tokens
+            else {"enabled": True}
+        }
     
     # -------------------------------------------------------------------
     # C. Inject tools ONLY if the chosen provider supports them
     # -------------------------------------------------------------------
     if openai_tools and provider_supports_tools(target_model_name):
         openai_params["tools"] = cast(
-            Optional[List[ChatCompletionToolParam]], openai_tools
+            "Optional[List[ChatCompletionToolParam]]", openai_tools
         )
         if openai_tool_choice:
             openai_params["tool_choice"] = openai_tool_choice
@@ -1742,8 +3833,10 @@ async def create_message_proxy(
                 )
             )
     
-    if anthropic_request.metadata and anthropic_request.metadata.get("user_id"):
-        openai_params["user"] = str(anthropic_request.metadata.get("user_id"))
+    if user_id is not None:
+        openai_params["user"] = user_id
+    if is_stream and settings.usage_ledger_enabled:
+        openai_params["stream_options"] = {"include_usage": True}
 
     debug(
         LogRecord(
@@ -1754,6 +3847,15 @@ async def create_message_proxy(
         )
     )
 
+    def params_for(model: str) -> Dict[str, Any]:
+        return _params_for_model(
+            openai_params, anthropic_request.tools, openai_tool_choice, model, request_id
+        )
+
+    slot = await fair_queue.acquire(user_id, estimated_input_tokens + max_tokens)
+    if fair_queue.enabled:
+        timer.mark("fair_queue")
+    slot_handed_to_stream = False
     try:
         if is_stream:
             debug(
@@ -1763,9 +3865,15 @@ async def create_message_proxy(
                     request_id,
                 )
             )
-            openai_stream_response = await _safe_create_completion_stream(
-                openai_params, request_id
+            (
+                target_model_name,
+                openai_stream_response,
+                upstream_started_at,
+            ) = await _create_with_fallbacks(
+                openai_params, request_id, fallbacks, params_for
             )
+            timer.mark("upstream_connect")
+            slot_handed_to_stream = True
             return StreamingResponse(
                 handle_anthropic_streaming_response_from_openai_stream(
                     openai_stream_response,
@@ -1773,8 +3881,18 @@ async def create_message_proxy(
                     estimated_input_tokens,
                     request_id,
                     request.state.start_time_monotonic,
+                    timer,
+                    max_tokens=max_tokens,
+                    is_disconnected=request.is_disconnected,
+                    target_model=target_model_name,
+                    user_id=user_id,
+                    on_close=slot.release,
+                    upstream_started_at=upstream_started_at,
+                    forward_reasoning=forward_reasoning,
                 ),
                 media_type="text/event-stream",
+                # releases the slot if the body never starts (release is idempotent)
+                background=BackgroundTask(slot.release),
             )
         else:
             debug(
@@ -1784,9 +3902,13 @@ async def create_message_proxy(
                     request_id,
                 )
             )
-            openai_response_obj = await _safe_create_completion(
-                openai_params, request_id
+            target_model_name, openai_response_obj, _ = await _create_with_fallbacks(
+                openai_params, request_id, fallbacks, params_for
             )
+            # no TTFT without a stream; a whole completion isn't comparable
+            model_telemetry.record(target_model_name, ok=True)
+            slot.release()
+            timer.mark("upstream")
 
             debug(
                 LogRecord(
@@ -1797,10 +3919,27 @@ async def create_message_proxy(
                 )
             )
 
-            anthropic_response_obj = convert_openai_to_anthropic_response(
-                openai_response_obj, anthropic_request.model, request_id=request_id
-            )
+            with tracing.span("convert_response"):
+                anthropic_response_obj = convert_openai_to_anthropic_response(
+                    openai_response_obj,
+                    anthropic_request.model,
+                    request_id=request_id,
+                    forward_reasoning=forward_reasoning,
+                )
+            timer.mark("convert_response")
             duration_ms = (time.monotonic() - request.state.start_time_monotonic) * 1000
+            await _record_usage(
+                request_id,
+                user_id,
+                anthropic_request.model,
+                target_model_name,
+                stream=False,
+                status="completed",
+                usage=openai_response_obj.usage,
+                estimated_input_tokens=estimated_input_tokens,
+                estimated_output_tokens=anthropic_response_obj.usage.output_tokens,
+                duration_ms=duration_ms,
+            )
             info(
                 LogRecord(
                     event=LogEvent.REQUEST_COMPLETED.value,
@@ -1812,6 +3951,7 @@ async def create_message_proxy(
                         "input_tokens": anthropic_response_obj.usage.input_tokens,
                         "output_tokens": anthropic_response_obj.usage.output_tokens,
                         "stop_reason": anthropic_response_obj.stop_reason,
+                        "timings_ms": timer.summary(),
                     },
                 )
             )
@@ -1827,10 +3967,40 @@ async def create_message_proxy(
                 content=anthropic_response_obj.model_dump(exclude_unset=True)
             )
 
+    except CircuitOpenError as e:
+        await _record_usage(
+            request_id,
+            user_id,
+            anthropic_request.model,
+            target_model_name,
+            stream=is_stream,
+            status="error",
+            usage=None,
+            estimated_input_tokens=0,
+            estimated_output_tokens=0,
+            duration_ms=(time.monotonic() - request.state.start_time_monotonic) * 1000,
+        )
+        response = await _log_and_return_error_response(
+            request, 503, AnthropicErrorType.OVERLOADED, str(e)
+        )
+        response.headers["retry-after"] = retry_after_header(e.retry_after_s)
+        return response
     except openai.APIError as e:
         err_type, err_msg, err_status, prov_details = (
             _get_anthropic_error_details_from_exc(e)
         )
+        await _record_usage(
+            request_id,
+            user_id,
+            anthropic_request.model,
+            target_model_name,
+            stream=is_stream,
+            status="error",
+            usage=None,
+            estimated_input_tokens=0,
+            estimated_output_tokens=0,
+            duration_ms=(time.monotonic() - request.state.start_time_monotonic) * 1000,
+        )
         return await _log_and_return_error_response(
             request, err_status, err_type, err_msg, prov_details, e
         )
@@ -1842,9 +4012,12 @@ async def create_message_proxy(
             "An unexpected error occurred while processing the request.",
             caught_exception=e,
         )
+    finally:
+        if not slot_handed_to_stream:
+            slot.release()
 
 
-@app.post(
+@router.post(
     "/v1/messages/count_tokens", response_model=TokenCountResponse, tags=["Utility"]
 )
 async def count_tokens_endpoint(request: Request) -> TokenCountResponse:
@@ -1852,10 +4025,13 @@ async def count_tokens_endpoint(request: Request) -> TokenCountResponse:
     request_id = str(uuid.uuid4())
     request.state.request_id = request_id
     start_time_mono = time.monotonic()
+    timer = _request_timer(request)
 
     try:
         body = await request.json()
+        timer.mark("parse")
         count_request = TokenCountRequest.model_validate(body)
+        timer.mark("validate")
     except json.JSONDecodeError as e:
         raise fastapi.HTTPException(status_code=400, detail="Invalid JSON body.") from e
     except ValidationError as e:
@@ -1870,6 +4046,7 @@ async def count_tokens_endpoint(request: Request) -> TokenCountResponse:
         tools=count_request.tools,
         request_id=request_id,
     )
+    timer.mark("token_count")
     duration_ms = (time.monotonic() - start_time_mono) * 1000
     info(
         LogRecord(
@@ -1886,7 +4063,113 @@ async def count_tokens_endpoint(request: Request) -> TokenCountResponse:
     return TokenCountResponse(input_tokens=token_count)
 
 
-@app.get("/", include_in_schema=False, tags=["Health"])
+async def _require_admin(request: Request) -> Optional[JSONResponse]:
+    """Error response unless the request carries ADMIN_TOKEN; None when allowed."""
+    if not settings.admin_token:
+        return await _log_and_return_error_response(
+            request, 404, AnthropicErrorType.NOT_FOUND, "Not Found"
+        )
+    supplied = request.headers.get("x-admin-token") or ""
+    authorization = request.headers.get("authorization", "")
+    if not supplied and authorization.lower().startswith("bearer "):
+        supplied = authorization[len("bearer ") :]
+    if not secrets.compare_digest(supplied.encode(), settings.admin_token.encode()):
+        return await _log_and_return_error_response(
+            request, 403, AnthropicErrorType.PERMISSION, "Invalid admin token."
+        )
+    return None
+
+
+@router.get("/admin/profile", include_in_schema=False, tags=["Admin"])
+async def admin_profile(
+    request: Request,
+    seconds: float = 10.0,
+    mode: Literal["sample", "cprofile", "yappi"] = "sample",
+    interval_ms: float = 5.0,
+    limit: int = 60,
+) -> Response:
+    """
+    Profiles the live process for *seconds*. `sample` returns collapsed stacks
+    (feed to flamegraph.pl or speedscope); `cprofile` / `yappi` return text
+    reports of the event-loop thread.
+    """
+    denied = await _require_admin(request)
+    if denied is not None:
+        return denied
+
+    import profiler
+
+    request_id = getattr(request.state, "request_id", "unknown")
+    info(
+        LogRecord(
+            event=LogEvent.PROFILE.value,
+            message=f"Starting {mode} profile",
+            request_id=request_id,
+            data={"seconds": seconds, "interval_ms": interval_ms},
+        )
+    )
+    try:
+        if mode == "sample":
+            report = await profiler.sample(seconds, interval_ms / 1000)
+            return PlainTextResponse(
+                report,
+                headers={
+                    "Content-Disposition": 'attachment; filename="profile.collapsed"'
+                },
+            )
+        if mode == "cprofile":
+            report = await profiler.cprofile(seconds, limit)
+        else:
+            report = await profiler.yappi_profile(seconds, limit)
+    except profiler.ProfilerBusyError as e:
+        return await _log_and_return_error_response(
+            request, 409, AnthropicErrorType.INVALID_REQUEST, str(e)
+        )
+    except RuntimeError as e:
+        return await _log_and_return_error_response(
+            request, 400, AnthropicErrorType.INVALID_REQUEST, str(e)
+        )
+    return PlainTextResponse(report)
+
+
+@router.get("/v1/usage", tags=["Utility"])
+async def usage_endpoint(
+    request: Request,
+    group_by: str = "user_id,target_model",
+    since: Optional[float] = None,
+) -> JSONResponse:
+    """
+    Token and cost totals from the usage ledger, grouped by any of user_id,
+    target_model and client_model. Without *since* (Unix seconds) they cover
+    this process since startup; with it they come from the SQLite ledger.
+    Admin-only, like /admin/*.
+    """
+    denied = await _require_admin(request)
+    if denied is not None:
+        return denied
+    if not settings.usage_ledger_enabled:
+        return await _log_and_return_error_response(
+            request, 404, AnthropicErrorType.NOT_FOUND, "Usage ledger is disabled."
+        )
+    fields = [field.strip() for field in group_by.split(",") if field.strip()]
+    try:
+        summary = await usage_ledger.summary(fields, since)
+    except (ValueError, RuntimeError) as e:
+        return await _log_and_return_error_response(
+            request, 400, AnthropicErrorType.INVALID_REQUEST, str(e)
+        )
+    return JSONResponse(summary)
+
+
+@router.get("/metrics", include_in_schema=False, tags=["Health"])
+async def metrics_endpoint() -> PlainTextResponse:
+    """Prometheus text exposition of the registered collectors (per process)."""
+    return PlainTextResponse(
+        metrics.render(), media_type="text/plain; version=0.0.4"
+    )
+
+
+@router.get("/", include_in_schema=False, tags=["Health"])
 async def root_health_check() -> JSONResponse:
     """Basic health check and information endpoint."""
     debug(
@@ -1904,7 +4187,6 @@ async def root_health_check() -> JSONResponse:
     )
 
 
-@app.exception_handler(openai.APIError)
 async def openai_api_error_handler(request: Request, exc: openai.APIError):
     err_type, err_msg, err_status, prov_details = _get_anthropic_error_details_from_exc(
         exc
@@ -1914,7 +4196,6 @@ async def openai_api_error_handler(request: Request, exc: openai.APIError):
     )
 
 
-@app.exception_handler(ValidationError)
 async def pydantic_validation_error_handler(request: Request, exc: ValidationError):
     return await _log_and_return_error_response(
         request,
@@ -1925,7 +4206,6 @@ async def pydantic_validation_error_handler(request: Request, exc: ValidationErr
     )
 
 
-@app.exception_handler(json.JSONDecodeError)
 async def json_decode_error_handler(request: Request, exc: json.JSONDecodeError):
     return await _log_and_return_error_response(
         request,
@@ -1936,7 +4216,6 @@ async def json_decode_error_handler(request: Request, exc: json.JSONDecodeError)
     )
 
 
-@app.exception_handler(Exception)
 async def generic_exception_handler(request: Request, exc: Exception):
     return await _log_and_return_error_response(
         request,
@@ -1947,7 +4226,6 @@ async def generic_exception_handler(request: Request, exc: Exception):
     )
 
 
-@app.middleware("http")
 async def logging_middleware(
     request: Request, call_next: Callable[[Request], Awaitable[Response]]
 ) -> Response:
@@ -1955,18 +4233,48 @@ async def logging_middleware(
         request.state.request_id = str(uuid.uuid4())
     if not hasattr(request.state, "start_time_monotonic"):
         request.state.start_time_monotonic = time.monotonic()
+    timer = _request_timer(request)
 
-    response = await call_next(request)
+    root_span = tracing.span("proxy.request", "server")
+    with root_span:
+        if root_span.is_recording():
+            root_span.set_attributes(
+                {"http.request.method": request.method, "url.path": request.url.path}
+            )
+        response = await call_next(request)
+        if root_span.is_recording():
+            root_span.set_attribute("http.response.status_code", response.status_code)
 
     response.headers["X-Request-ID"] = request.state.request_id
     duration_ms = (time.monotonic() - request.state.start_time_monotonic) * 1000
     response.headers["X-Response-Time-ms"] = str(duration_ms)
+    # Streams are still running here; their timings go to request_completed.
+    if not response.headers.get("content-type", "").startswith("text/event-stream"):
+        response.headers["Server-Timing"] = timer.server_timing()
 
     return response
 
 
-if __name__ == "__main__":
-    _console.print(
+def _production_server_options() -> Dict[str, Any]:
+    """uvloop / httptools when installed; uvicorn's pure-Python fallbacks otherwise."""
+    options: Dict[str, Any] = {}
+    for option, module in (("loop", "uvloop"), ("http", "httptools")):
+        try:
+            __import__(module)
+            options[option] = module
+        except ImportError:
+            options[option] = "auto"
+    return options
+
+
+def _print_startup_banner(reload_enabled: bool) -> None:
+    from rich.console import Console
+    from rich.panel import Panel
+    from rich.rule import Rule
+    from rich.text import Text
+
+    console = Console()
+    console.print(
         r"""[bold blue]
            /$$                           /$$
           | $$                          | $$
@@ -1996,9 +4304,13 @@ if __name__ == "__main__":
         ("\n   Listening on  : ", "default"),
         (f"http://{settings.host}:{settings.port}", "bold white"),
         ("\n   Reload        : ", "default"),
-        ("Enabled", "bold orange1") if settings.reload else ("Disabled", "dim"),
+        ("Enabled", "bold orange1") if reload_enabled else ("Disabled", "dim"),
+        ("\n   Workers       : ", "default"),
+        (str(settings.workers), "bold cyan"),
+        ("\n   State Backend : ", "default"),
+        (settings.state_backend, "dim"),
     )
-    _console.print(
+    console.print(
         Panel(
             config_details_text,
             title="Anthropic Proxy Configuration",
@@ -2006,13 +4318,67 @@ if __name__ == "__main__":
             expand=False,
         )
     )
-    _console.print(Rule("Starting Uvicorn server...", style="dim blue"))
-
-    uvicorn.run(
-        "__main__:app",
-        host=settings.host,
-        port=settings.port,
-        reload=settings.reload,
-        log_config=None,
-        access_log=False,
+    console.print(Rule("Starting Uvicorn server...", style="dim blue"))
+
+
+def create_app() -> fastapi.FastAPI:
+    """
+    Builds the FastAPI app; resources are created in `lifespan`, not here.
+    Registering the openai.APIError handler loads the SDK.
+    """
+    application = fastapi.FastAPI(
+        title=settings.app_name,
+        description="Routes Anthropic API requests to an OpenAI-compatible API, selecting models dynamically.",
+        version=settings.app_version,
+        docs_url=None,
+        redoc_url=None,
+        lifespan=lifespan,
     )
+    application.include_router(router)
+    application.add_exception_handler(openai.APIError, openai_api_error_handler)
+    application.add_exception_handler(ValidationError, pydantic_validation_error_handler)
+    application.add_exception_handler(json.JSONDecodeError, json_decode_error_handler)
+    application.add_exception_handler(Exception, generic_exception_handler)
+    application.middleware("http")(logging_middleware)
+    return application
+
+
+def __getattr__(name: str) -> Any:
+    # main:app is built on first access, so importing main alone (tests,
+    # benchmarks/startup.py) doesn't load the SDK for create_app().
+    if name == "app":
+        application = globals()["app"] = create_app()
+        return application
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+if __name__ == "__main__":
+    production_mode = settings.workers > 1
+    reload_enabled = settings.reload and not production_mode
+
+    _print_startup_banner(reload_enabled)
+
+    import uvicorn
+
+    if production_mode:
+        # Workers are separate processes that import the app by module path.
+        uvicorn.run(
+            "main:app",
+            app_dir=os.path.dirname(os.path.abspath(__file__)),
+            host=settings.host,
+            port=settings.port,
+            workers=settings.workers,
+            reload=False,
+            log_config=None,
+            access_log=False,
+            **_production_server_options(),
+        )
+    else:
+        uvicorn.run(
+            "__main__:app",
+            host=settings.host,
+            port=settings.port,
+            reload=reload_enabled,
+            log_config=None,
+            access_log=False,
+        )
@@ -0,0 +1,57 @@
+"""
+metrics.py – minimal Prometheus text exposition.
+
+Components register a collector – a callable returning Metric tuples – and
+GET /metrics renders whatever the collectors report at scrape time. Values
+are per process; with WORKERS > 1 each worker reports its own.
+"""
+from __future__ import annotations
+
+from typing import Callable, Dict, Iterable, List, NamedTuple, Sequence, Tuple
+
+Sample = Tuple[Dict[str, str], float]
+
+
+class Metric(NamedTuple):
+    name: str
+    help: str
+    type: str  # "gauge" | "counter"
+    samples: Sequence[Sample]
+
+
+Collector = Callable[[], Iterable[Metric]]
+
+_collectors: List[Collector] = []
+
+
+def register_collector(collector: Collector) -> Collector:
+    if collector not in _collectors:
+        _collectors.append(collector)
+    return collector
+
+
+def unregister_collector(collector: Collector) -> None:
+    if collector in _collectors:
+        _collectors.remove(collector)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(f'{key}="{_escape(str(value))}"' for key, value in sorted(labels.items()))
+    return "{" + pairs + "}"
+
+
+def render() -> str:
+    lines: List[str] = []
+    for collector in list(_collectors):
+        for metric in collector():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for labels, value in metric.samples:
+                lines.append(f"{metric.name}{_format_labels(labels)} {value!r}")
+    return "\n".join(lines) + "\n"
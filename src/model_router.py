@@ -0,0 +1,301 @@
+"""
+model_router.py – declarative routing of client models to target models.
+
+A routing table is an ordered list of rules; the first rule whose conditions
+all hold picks the target model and its fallbacks. Conditions are optional:
+
+    default = "@small"
+
+    [[rules]]
+    name = "long-context"
+    client_model = ["*sonnet*", "*opus*"]   # globs, case-insensitive
+    min_input_tokens = 100000               # estimated prompt size
+    target = "google/gemini-2.5-pro"
+    fallbacks = ["@big"]
+
+    [[rules]]
+    name = "cheap-coder"
+    client_model = "*haiku*"
+    candidates = ["deepseek/deepseek-chat", "qwen/qwen-2.5-coder-32b-instruct"]
+
+    [[rules]]
+    name = "tool-heavy"
+    tools = true                            # request has tools (false: has none)
+    images = false                          # request has images
+    users = ["ci-*"]                        # metadata.user_id globs
+    max_input_tokens = 100000
+    target = "@big"
+
+"@big" and "@small" stand for BIG_MODEL_NAME and SMALL_MODEL_NAME; routes
+keep the alias and the caller resolves it per request. The file is TOML
+(.toml) or YAML (.yaml/.yml, needs PyYAML) with the same keys. Without a
+file the built-in table is the classic mapping: opus/sonnet -> big,
+haiku -> small, anything else -> small.
+
+A rule may list equivalent `candidates` instead of (or besides) a target;
+the caller orders them per request from live telemetry (model_telemetry),
+the first becomes the target and the rest are tried before `fallbacks`.
+
+Rules are compiled once: each glob list becomes one regex, and the rules
+that can match a given client model are cached per model name, so a lookup
+only checks the numeric and boolean conditions of those. RoutingTableLoader
+re-reads the file when its mtime changes (checked at most every interval)
+and keeps serving the previous table if the new one does not compile.
+"""
+from __future__ import annotations
+
+import fnmatch
+import os
+import re
+import time
+from typing import (Any, Callable, Collection, Dict, List, Mapping, NamedTuple,
+                    Optional, Pattern, Sequence, Tuple)
+
+_RULE_KEYS = frozenset(
+    {
+        "name",
+        "client_model",
+        "min_input_tokens",
+        "max_input_tokens",
+        "tools",
+        "images",
+        "users",
+        "target",
+        "candidates",
+        "fallbacks",
+    }
+)
+_MODEL_CACHE_LIMIT = 1024
+
+
+class RoutingTableError(ValueError):
+    """The routing file could not be read or a rule is malformed."""
+
+
+class Route(NamedTuple):
+    target: str
+    fallbacks: Tuple[str, ...]
+    rule: Optional[str]  # None when the table's default was used
+    candidates: Tuple[str, ...] = ()  # to be ranked by telemetry; target is the first
+
+
+class _Rule(NamedTuple):
+    name: str
+    client_model: Optional[Pattern[str]]
+    min_input_tokens: Optional[int]
+    max_input_tokens: Optional[int]
+    tools: Optional[bool]
+    images: Optional[bool]
+    users: Optional[Pattern[str]]
+    route: Route
+
+
+def _glob_regex(value: Any, field: str, rule_name: str) -> Optional[Pattern[str]]:
+    if value is None:
+        return None
+    globs = [value] if isinstance(value, str) else value
+    if not isinstance(globs, list) or not globs or not all(isinstance(g, str) for g in globs):
+        raise RoutingTableError(f"Rule '{rule_name}': '{field}' must be a glob or a list of globs.")
+    return re.compile("|".join(fnmatch.translate(g.lower()) for g in globs))
+
+
+def _optional(raw: Mapping[str, Any], key: str, kind: type, rule_name: str) -> Any:
+    value = raw.get(key)
+    if value is not None and (not isinstance(value, kind) or isinstance(value, bool) != (kind is bool)):
+        raise RoutingTableError(f"Rule '{rule_name}': '{key}' must be {kind.__name__}.")
+    return value
+
+
+class RoutingTable:
+    def __init__(
+        self,
+        rules: Sequence[Mapping[str, Any]],
+        default: str = "@small",
+        aliases: Collection[str] = ("big", "small"),
+    ) -> None:
+        self.aliases = frozenset(aliases)
+        self.rules: List[_Rule] = [self._compile(i, raw) for i, raw in enumerate(rules)]
+        self.default = Route(self._resolve(default, "default"), (), None)
+        self._by_model: Dict[str, Tuple[_Rule, ...]] = {}
+
+    def _resolve(self, model: Any, where: str) -> str:
+        """Validates a model name or alias; aliases are kept as written."""
+        if not isinstance(model, str) or not model:
+            raise RoutingTableError(f"{where}: model names must be non-empty strings.")
+        if model.startswith("@") and model[1:] not in self.aliases:
+            raise RoutingTableError(
+                f"{where}: unknown alias '{model}' (expected one of "
+                f"{sorted('@' + a for a in self.aliases)})."
+            )
+        return model
+
+    def _compile(self, index: int, raw: Mapping[str, Any]) -> _Rule:
+        if not isinstance(raw, Mapping):
+            raise RoutingTableError(f"Rule #{index + 1} is not a table.")
+        name = str(raw.get("name") or f"rule-{index + 1}")
+        unknown = set(raw) - _RULE_KEYS
+        if unknown:
+            raise RoutingTableError(f"Rule '{name}': unknown keys {sorted(unknown)}.")
+        candidates = raw.get("candidates") or []
+        if not isinstance(candidates, list):
+            raise RoutingTableError(f"Rule '{name}': 'candidates' must be a list.")
+        if "target" not in raw and not candidates:
+            raise RoutingTableError(f"Rule '{name}' has no target or candidates.")
+        fallbacks = raw.get("fallbacks") or []
+        if not isinstance(fallbacks, list):
+            raise RoutingTableError(f"Rule '{name}': 'fallbacks' must be a list.")
+        resolved_candidates = tuple(
+            dict.fromkeys(self._resolve(c, f"Rule '{name}'") for c in candidates)
+        )
+        if "target" in raw:
+            target = self._resolve(raw["target"], f"Rule '{name}'")
+            if resolved_candidates and target not in resolved_candidates:
+                resolved_candidates = (target,) + resolved_candidates
+        else:
+            target = resolved_candidates[0]
+        if len(resolved_candidates) < 2:
+            resolved_candidates = ()  # a single model leaves nothing to choose
+        resolved_fallbacks = tuple(
+            dict.fromkeys(
+                m
+                for m in (self._resolve(f, f"Rule '{name}'") for f in fallbacks)
+                if m != target and m not in resolved_candidates
+            )
+        )
+        return _Rule(
+            name=name,
+            client_model=_glob_regex(raw.get("client_model"), "client_model", name),
+            min_input_tokens=_optional(raw, "min_input_tokens", int, name),
+            max_input_tokens=_optional(raw, "max_input_tokens", int, name),
+            tools=_optional(raw, "tools", bool, name),
+            images=_optional(raw, "images", bool, name),
+            users=_glob_regex(raw.get("users"), "users", name),
+            route=Route(target, resolved_fallbacks, name, resolved_candidates),
+        )
+
+    def _rules_for_model(self, client_model: str) -> Tuple[_Rule, ...]:
+        rules = self._by_model.get(client_model)
+        if rules is None:
+            lowered = client_model.lower()
+            rules = tuple(
+                r for r in self.rules if r.client_model is None or r.client_model.match(lowered)
+            )
+            if len(self._by_model) >= _MODEL_CACHE_LIMIT:
+                self._by_model.clear()
+            self._by_model[client_model] = rules
+        return rules
+
+    def match(
+        self,
+        client_model: str,
+        input_tokens: Optional[int] = None,
+        has_tools: Optional[bool] = None,
+        has_images: Optional[bool] = None,
+        user_id: Optional[str] = None,
+    ) -> Route:
+        """
+        First matching rule's route, else the default. A condition on a value
+        the caller doesn't know (None) does not match.
+        """
+        for rule in self._rules_for_model(client_model):
+            if rule.min_input_tokens is not None and (
+                input_tokens is None or input_tokens < rule.min_input_tokens
+            ):
+                continue
+            if rule.max_input_tokens is not None and (
+                input_tokens is None or input_tokens > rule.max_input_tokens
+            ):
+                continue
+            if rule.tools is not None and has_tools is not rule.tools:
+                continue
+            if rule.images is not None and has_images is not rule.images:
+                continue
+            if rule.users is not None and (user_id is None or not rule.users.match(user_id.lower())):
+                continue
+            return rule.route
+        return self.default
+
+
+def builtin_routing_table() -> RoutingTable:
+    return RoutingTable(
+        [
+            {"name": "opus-sonnet", "client_model": ["*opus*", "*sonnet*"], "target": "@big"},
+            {"name": "haiku", "client_model": "*haiku*", "target": "@small"},
+        ],
+        default="@small",
+    )
+
+
+def _parse_file(path: str) -> Dict[str, Any]:
+    with open(path, "rb") as f:
+        data = f.read()
+    if path.endswith((".yaml", ".yml")):
+        try:
+            import yaml  # type: ignore[import-untyped]
+        except ImportError as exc:
+            raise RoutingTableError("YAML routing tables need PyYAML (pip install pyyaml).") from exc
+        try:
+            parsed = yaml.safe_load(data) or {}
+        except yaml.YAMLError as exc:
+            raise RoutingTableError(f"{path}: {exc}") from exc
+    else:
+        try:
+            import tomllib
+        except ImportError:  # Python 3.10
+            import tomli as tomllib  # type: ignore[no-redef]
+        try:
+            parsed = tomllib.loads(data.decode())
+        except tomllib.TOMLDecodeError as exc:
+            raise RoutingTableError(f"{path}: {exc}") from exc
+    if not isinstance(parsed, dict):
+        raise RoutingTableError(f"{path}: expected a table with 'rules' and 'default'.")
+    return parsed
+
+
+def load_routing_table(path: str) -> RoutingTable:
+    parsed = _parse_file(path)
+    rules = parsed.get("rules") or []
+    if not isinstance(rules, list):
+        raise RoutingTableError(f"{path}: 'rules' must be a list of tables.")
+    return RoutingTable(rules, default=parsed.get("default", "@small"))
+
+
+class RoutingTableLoader:
+    """The current table for *path*, re-read whenever the file changes."""
+
+    def __init__(
+        self,
+        path: Optional[str],
+        reload_interval_s: float = 5.0,
+        on_reload: Optional[Callable[[str, Optional[Exception]], None]] = None,
+    ) -> None:
+        self.path = path or None
+        self.reload_interval_s = reload_interval_s
+        self.on_reload = on_reload
+        self._mtime: Optional[float] = None
+        self._next_check = 0.0
+        # a broken file at startup fails loudly; later edits fall back to the old table
+        self._table = load_routing_table(self.path) if self.path else builtin_routing_table()
+        if self.path:
+            self._mtime = os.stat(self.path).st_mtime
+
+    @property
+    def table(self) -> RoutingTable:
+        if self.path is not None and time.monotonic() >= self._next_check:
+            self._next_check = time.monotonic() + self.reload_interval_s
+            self._maybe_reload()
+        return self._table
+
+    def _maybe_reload(self) -> None:
+        try:
+            mtime = os.stat(self.path).st_mtime
+            if mtime == self._mtime:
+                return
+            self._mtime = mtime
+            self._table = load_routing_table(self.path)
+        except (OSError, RoutingTableError) as exc:
+            if self.on_reload is not None:
+                self.on_reload(self.path, exc)
+            return
+        if self.on_reload is not None:
+            self.on_reload(self.path, None)
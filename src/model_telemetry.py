@@ -0,0 +1,238 @@
+"""
+model_telemetry.py – live per-model latency/error telemetry and the ranking
+of equivalent candidate models built on it.
+
+Every upstream call reports its outcome per target model: errors (429, 5xx,
+transport failures, streams that broke) and, for streams, time to first
+token and output tokens per second. ModelTelemetry keeps exponentially
+weighted moving averages (weight `alpha` per sample) of
+
+  * ln(TTFT) and its variance, so p95 TTFT = exp(mean + 1.645 sd) under a
+    log-normal fit – latency is right-skewed, and this needs two floats;
+  * tokens per second;
+  * the error rate (each request is a 0/1 sample).
+
+rank() orders a routing rule's `candidates` for one objective:
+
+  cheapest   – cheapest catalog price among models within the p95 TTFT SLO
+               and the error budget; then the fastest over-SLO model
+  fastest    – lowest p95 TTFT among models within the error budget
+  throughput – highest tokens per second among models within the budget
+
+Models over the error budget come last, least-failing first. A model with
+fewer than `min_samples` samples of a statistic is assumed to meet it, so it
+gets traffic and is measured. A model nobody sent traffic to for
+`probe_interval_s` is put first once per interval, so a provider that was
+routed away from can show it has recovered. Ties keep the configured order.
+
+Nothing is random and time comes from the injected clock, so FakeClock plus
+recorded samples replays a scenario deterministically.
+"""
+from __future__ import annotations
+
+import math
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from metrics import Metric
+
+OBJECTIVES = ("cheapest", "fastest", "throughput")
+_Z95 = 1.6448536269514722
+
+
+class FakeClock:
+    """Manually advanced clock for tests and simulations."""
+
+    def __init__(self, start: float = 0.0) -> None:
+        self.now = start
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+class _ModelStats:
+    __slots__ = (
+        "requests",
+        "error_rate",
+        "ttft_samples",
+        "log_ttft_mean",
+        "log_ttft_var",
+        "tps_samples",
+        "tokens_per_s",
+        "last_seen",
+        "last_probe",
+    )
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.error_rate = 0.0
+        self.ttft_samples = 0
+        self.log_ttft_mean = 0.0
+        self.log_ttft_var = 0.0
+        self.tps_samples = 0
+        self.tokens_per_s = 0.0
+        self.last_seen = 0.0
+        self.last_probe = -math.inf
+
+    @property
+    def p95_ttft_s(self) -> float:
+        return math.exp(self.log_ttft_mean + _Z95 * math.sqrt(self.log_ttft_var))
+
+
+class ModelTelemetry:
+    def __init__(
+        self,
+        alpha: float = 0.2,
+        min_samples: int = 5,
+        ttft_slo_s: float = 3.0,
+        max_error_rate: float = 0.2,
+        probe_interval_s: float = 60.0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.alpha = alpha
+        self.min_samples = min_samples
+        self.ttft_slo_s = ttft_slo_s
+        self.max_error_rate = max_error_rate
+        self.probe_interval_s = probe_interval_s
+        self.clock = clock
+        self._stats: Dict[str, _ModelStats] = {}
+
+    def _get(self, model: str) -> _ModelStats:
+        stats = self._stats.get(model)
+        if stats is None:
+            stats = self._stats[model] = _ModelStats()
+        return stats
+
+    def _ewma(self, current: float, sample: float, count: int) -> float:
+        # the first sample seeds the average instead of being damped toward 0
+        return sample if count == 1 else current + self.alpha * (sample - current)
+
+    # -- recording -------------------------------------------------------------
+
+    def record(
+        self,
+        model: str,
+        ok: bool,
+        ttft_s: Optional[float] = None,
+        tokens_per_s: Optional[float] = None,
+    ) -> None:
+        stats = self._get(model)
+        stats.last_seen = self.clock()
+        stats.requests += 1
+        stats.error_rate = self._ewma(stats.error_rate, 0.0 if ok else 1.0, stats.requests)
+        if ttft_s is not None and ttft_s > 0:
+            stats.ttft_samples += 1
+            x = math.log(ttft_s)
+            if stats.ttft_samples == 1:
+                stats.log_ttft_mean, stats.log_ttft_var = x, 0.0
+            else:
+                diff = x - stats.log_ttft_mean
+                increment = self.alpha * diff
+                stats.log_ttft_mean += increment
+                stats.log_ttft_var = (1 - self.alpha) * (stats.log_ttft_var + diff * increment)
+        if tokens_per_s is not None and tokens_per_s > 0:
+            stats.tps_samples += 1
+            stats.tokens_per_s = self._ewma(stats.tokens_per_s, tokens_per_s, stats.tps_samples)
+
+    # -- ranking ---------------------------------------------------------------
+
+    def _healthy(self, stats: Optional[_ModelStats]) -> bool:
+        return (
+            stats is None
+            or stats.requests < self.min_samples
+            or stats.error_rate <= self.max_error_rate
+        )
+
+    def _p95(self, stats: Optional[_ModelStats]) -> Optional[float]:
+        if stats is None or stats.ttft_samples < self.min_samples:
+            return None
+        return stats.p95_ttft_s
+
+    def _tokens_per_s(self, stats: Optional[_ModelStats]) -> Optional[float]:
+        if stats is None or stats.tps_samples < self.min_samples:
+            return None
+        return stats.tokens_per_s
+
+    def _key(
+        self, objective: str, index: int, model: str, price: Callable[[str], Optional[float]]
+    ) -> Tuple[int, float, int]:
+        stats = self._stats.get(model)
+        if not self._healthy(stats):
+            return (2, stats.error_rate, index)
+        p95 = self._p95(stats)
+        if objective == "fastest":
+            return (0, p95 or 0.0, index)
+        if objective == "throughput":
+            tps = self._tokens_per_s(stats)
+            return (0, -tps if tps is not None else -math.inf, index)
+        if p95 is not None and p95 > self.ttft_slo_s:
+            return (1, p95, index)
+        model_price = price(model)
+        return (0, model_price if model_price is not None else math.inf, index)
+
+    def rank(
+        self,
+        candidates: Sequence[str],
+        objective: str = "cheapest",
+        price: Callable[[str], Optional[float]] = lambda model: None,
+    ) -> List[str]:
+        """*candidates* best first for *objective*; see the module docstring."""
+        if objective not in OBJECTIVES:
+            raise ValueError(f"Unknown objective '{objective}' (expected one of {OBJECTIVES}).")
+        ranked = [
+            model
+            for _, model in sorted(
+                ((self._key(objective, i, m, price), m) for i, m in enumerate(candidates)),
+                key=lambda item: item[0],
+            )
+        ]
+        now = self.clock()
+        for model in ranked[1:]:
+            stats = self._stats.get(model)
+            if (
+                stats is not None
+                and now - stats.last_seen >= self.probe_interval_s
+                and now - stats.last_probe >= self.probe_interval_s
+            ):
+                stats.last_probe = now
+                ranked.remove(model)
+                ranked.insert(0, model)
+                break
+        return ranked
+
+    # -- reporting -------------------------------------------------------------
+
+    def snapshot(self) -> Dict[str, Dict[str, Optional[float]]]:
+        return {
+            model: {
+                "requests": float(stats.requests),
+                "error_rate": round(stats.error_rate, 4),
+                "p95_ttft_s": round(stats.p95_ttft_s, 4) if stats.ttft_samples else None,
+                "tokens_per_s": round(stats.tokens_per_s, 2) if stats.tps_samples else None,
+            }
+            for model, stats in self._stats.items()
+        }
+
+    def collect(self) -> Iterable[Metric]:
+        items = list(self._stats.items())
+        yield Metric(
+            "proxy_model_ttft_p95_seconds",
+            "EWMA log-normal estimate of p95 time to first token per target model.",
+            "gauge",
+            [({"model": m}, s.p95_ttft_s) for m, s in items if s.ttft_samples],
+        )
+        yield Metric(
+            "proxy_model_tokens_per_second",
+            "EWMA output tokens per second per target model.",
+            "gauge",
+            [({"model": m}, s.tokens_per_s) for m, s in items if s.tps_samples],
+        )
+        yield Metric(
+            "proxy_model_error_rate",
+            "EWMA share of upstream calls that failed per target model.",
+            "gauge",
+            [({"model": m}, s.error_rate) for m, s in items],
+        )
@@ -0,0 +1,160 @@
+"""
+profiler.py – on-demand in-process profilers for the admin endpoint.
+
+* sample   – a background thread snapshots every thread's stack via
+             sys._current_frames() at a fixed interval and aggregates them
+             as collapsed stacks ("a;b;c 42" per line), which flamegraph.pl,
+             speedscope and inferno read directly. The target threads never
+             pause, so this is the mode to use under production load.
+* cprofile – deterministic cProfile of the event-loop thread, i.e. every
+             coroutine step that runs during the window. Higher overhead.
+* yappi    – coroutine-aware wall/CPU profile (requires the yappi package).
+
+Only one profile runs at a time; callers check `busy` first.
+"""
+from __future__ import annotations
+
+import asyncio
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from types import CodeType, FrameType
+from typing import Dict, Optional
+
+MAX_DURATION_S = 60.0
+MIN_INTERVAL_S = 0.001
+_MAX_STACK_DEPTH = 128
+
+_lock = threading.Lock()
+
+
+def busy() -> bool:
+    return _lock.locked()
+
+
+class ProfilerBusyError(RuntimeError):
+    pass
+
+
+class SamplingProfiler:
+    """Collects collapsed stacks of all other threads every *interval_s*."""
+
+    def __init__(self, interval_s: float = 0.005) -> None:
+        self.interval_s = max(MIN_INTERVAL_S, interval_s)
+        self.samples = 0
+        self._stacks: Counter[str] = Counter()
+        self._labels: Dict[CodeType, str] = {}
+
+    def _label(self, code: CodeType) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = f"{os.path.basename(code.co_filename)}:{code.co_name}"
+            self._labels[code] = label
+        return label
+
+    def _collapse(self, frame: Optional[FrameType]) -> str:
+        parts = []
+        while frame is not None and len(parts) < _MAX_STACK_DEPTH:
+            parts.append(self._label(frame.f_code))
+            frame = frame.f_back
+        parts.reverse()
+        return ";".join(parts)
+
+    def sample_once(self, skip_thread_id: int) -> None:
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == skip_thread_id:
+                continue
+            thread_name = names.get(thread_id, str(thread_id)).replace(" ", "_")
+            self._stacks[f"{thread_name};{self._collapse(frame)}"] += 1
+        self.samples += 1
+
+    def run(self, duration_s: float) -> None:
+        """Blocks the calling thread for *duration_s* while sampling the others."""
+        me = threading.get_ident()
+        deadline = time.monotonic() + min(duration_s, MAX_DURATION_S)
+        next_at = time.monotonic()
+        while next_at < deadline:
+            self.sample_once(me)
+            next_at += self.interval_s
+            delay = next_at - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:  # fell behind; skip missed ticks rather than burst
+                next_at = time.monotonic()
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self._stacks.most_common())
+
+
+def _acquire() -> None:
+    if not _lock.acquire(blocking=False):
+        raise ProfilerBusyError("A profile is already running.")
+
+
+async def sample(duration_s: float, interval_s: float = 0.005) -> str:
+    """Collapsed stacks for every thread over *duration_s* seconds."""
+    _acquire()
+    try:
+        profiler = SamplingProfiler(interval_s)
+        await asyncio.to_thread(profiler.run, duration_s)
+        return profiler.collapsed()
+    finally:
+        _lock.release()
+
+
+def _pstats_text(stats: pstats.Stats, limit: int) -> str:
+    out = io.StringIO()
+    stats.stream = out  # type: ignore[attr-defined]
+    stats.sort_stats("cumulative").print_stats(limit)
+    return out.getvalue()
+
+
+async def cprofile(duration_s: float, limit: int = 60) -> str:
+    """pstats report (cumulative) for the event-loop thread."""
+    _acquire()
+    try:
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError as exc:  # another profiler (e.g. an external one) is active
+            raise ProfilerBusyError(f"Cannot start cProfile: {exc}") from exc
+        try:
+            await asyncio.sleep(min(duration_s, MAX_DURATION_S))
+        finally:
+            profile.disable()
+        return _pstats_text(pstats.Stats(profile), limit)
+    finally:
+        _lock.release()
+
+
+async def yappi_profile(duration_s: float, limit: int = 60, clock: str = "wall") -> str:
+    """yappi function stats; raises RuntimeError when yappi isn't installed."""
+    try:
+        import yappi  # type: ignore[import-not-found]
+    except ImportError as exc:
+        raise RuntimeError("mode=yappi requires the 'yappi' package (pip install yappi).") from exc
+    _acquire()
+    try:
+        yappi.clear_stats()
+        yappi.set_clock_type(clock)
+        yappi.start()
+        try:
+            await asyncio.sleep(min(duration_s, MAX_DURATION_S))
+        finally:
+            yappi.stop()
+        out = io.StringIO()
+        stats = yappi.get_func_stats()
+        stats.sort("ttot").print_all(
+            out=out,
+            columns={0: ("name", 80), 1: ("ncall", 10), 2: ("tsub", 10), 3: ("ttot", 10), 4: ("tavg", 10)},
+        )
+        yappi.clear_stats()
+        return "\n".join(out.getvalue().splitlines()[: limit + 4])
+    finally:
+        _lock.release()
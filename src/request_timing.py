@@ -0,0 +1,48 @@
+"""
+request_timing.py – cheap per-request stage timer.
+
+A RequestTimer lives on `request.state.timer`. Each stage calls
+`timer.mark("<stage>")` when it finishes; the stage's duration is the time
+since the previous mark. Non-streaming responses carry the result as a
+`Server-Timing` header, streams report it in their `request_completed` log.
+"""
+from __future__ import annotations
+
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+class RequestTimer:
+    __slots__ = ("start", "_marks")
+
+    def __init__(self, start: Optional[float] = None) -> None:
+        self.start = time.monotonic() if start is None else start
+        self._marks: List[Tuple[str, float]] = []
+
+    def mark(self, name: str) -> None:
+        self._marks.append((name, time.monotonic()))
+
+    def has(self, name: str) -> bool:
+        return any(mark == name for mark, _ in self._marks)
+
+    def elapsed_ms(self) -> float:
+        return (time.monotonic() - self.start) * 1000
+
+    def durations_ms(self) -> Dict[str, float]:
+        """Stage name -> milliseconds spent since the previous mark."""
+        out: Dict[str, float] = {}
+        previous = self.start
+        for name, at in self._marks:
+            out[name] = out.get(name, 0.0) + (at - previous) * 1000
+            previous = at
+        return out
+
+    def summary(self) -> Dict[str, float]:
+        """Stage durations plus `total`, rounded for logging."""
+        out = {name: round(ms, 3) for name, ms in self.durations_ms().items()}
+        out["total"] = round(self.elapsed_ms(), 3)
+        return out
+
+    def server_timing(self) -> str:
+        """RFC-style `Server-Timing` header value."""
+        return ", ".join(f"{name};dur={ms:.3f}" for name, ms in self.summary().items())
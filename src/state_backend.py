@@ -0,0 +1,129 @@
+"""
+state_backend.py – pluggable key/value store for state shared between workers.
+
+Counters that must hold across workers go through a StateBackend; today
+that is the per-user budgets (UserBudgets). The fair queue, circuit
+breakers, model telemetry and in-memory usage totals stay per process.
+"memory" keeps everything in-process (the default, and what a single worker
+needs); "redis" talks to any Redis-compatible server (Redis, Valkey, KeyDB,
+...).
+"""
+from __future__ import annotations
+
+import abc
+import time
+from typing import Dict, Optional, Tuple
+
+
+class StateBackend(abc.ABC):
+    """Minimal async key/value interface modelled on the Redis commands we need."""
+
+    name: str = "abstract"
+
+    @abc.abstractmethod
+    async def get(self, key: str) -> Optional[str]: ...
+
+    @abc.abstractmethod
+    async def set(self, key: str, value: str, ttl_s: Optional[float] = None) -> None: ...
+
+    @abc.abstractmethod
+    async def incr(
+        self, key: str, amount: float = 1.0, ttl_s: Optional[float] = None
+    ) -> float:
+        """Adds *amount* to a numeric key and returns the new value.
+        *ttl_s* only applies when the key is created."""
+
+    @abc.abstractmethod
+    async def delete(self, key: str) -> None: ...
+
+    async def close(self) -> None:
+        return None
+
+
+class InMemoryStateBackend(StateBackend):
+    """Process-local dict with lazy expiry."""
+
+    name = "memory"
+
+    def __init__(self) -> None:
+        self._data: Dict[str, Tuple[str, Optional[float]]] = {}
+
+    def _live(self, key: str) -> Optional[Tuple[str, Optional[float]]]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        if item[1] is not None and item[1] <= time.monotonic():
+            del self._data[key]
+            return None
+        return item
+
+    async def get(self, key: str) -> Optional[str]:
+        item = self._live(key)
+        return item[0] if item else None
+
+    async def set(self, key: str, value: str, ttl_s: Optional[float] = None) -> None:
+        expires = time.monotonic() + ttl_s if ttl_s else None
+        self._data[key] = (value, expires)
+
+    async def incr(
+        self, key: str, amount: float = 1.0, ttl_s: Optional[float] = None
+    ) -> float:
+        item = self._live(key)
+        if item is None:
+            value = amount
+            expires = time.monotonic() + ttl_s if ttl_s else None
+        else:
+            value = float(item[0]) + amount
+            expires = item[1]
+        self._data[key] = (repr(value), expires)
+        return value
+
+    async def delete(self, key: str) -> None:
+        self._data.pop(key, None)
+
+
+class RedisStateBackend(StateBackend):
+    """Shared state in a Redis-compatible server (requires the `redis` package)."""
+
+    name = "redis"
+
+    def __init__(self, url: str, key_prefix: str = "claude_proxy:") -> None:
+        try:
+            import redis.asyncio as aioredis  # type: ignore[import-not-found]
+        except ImportError as exc:
+            raise RuntimeError(
+                "STATE_BACKEND=redis requires the 'redis' package (pip install redis)."
+            ) from exc
+        self._client = aioredis.from_url(url, decode_responses=True)
+        self._prefix = key_prefix
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self._client.get(self._prefix + key)
+
+    async def set(self, key: str, value: str, ttl_s: Optional[float] = None) -> None:
+        px = int(ttl_s * 1000) if ttl_s else None
+        await self._client.set(self._prefix + key, value, px=px)
+
+    async def incr(
+        self, key: str, amount: float = 1.0, ttl_s: Optional[float] = None
+    ) -> float:
+        full_key = self._prefix + key
+        value = float(await self._client.incrbyfloat(full_key, amount))
+        if ttl_s and value == amount:
+            await self._client.pexpire(full_key, int(ttl_s * 1000))
+        return value
+
+    async def delete(self, key: str) -> None:
+        await self._client.delete(self._prefix + key)
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+
+def create_state_backend(kind: str, url: Optional[str] = None) -> StateBackend:
+    """Builds the backend selected by STATE_BACKEND."""
+    if kind == "memory":
+        return InMemoryStateBackend()
+    if kind == "redis":
+        return RedisStateBackend(url or "redis://127.0.0.1:6379/0")
+    raise ValueError(f"Unknown state backend '{kind}' (expected 'memory' or 'redis').")
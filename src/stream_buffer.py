@@ -0,0 +1,188 @@
+"""
+stream_buffer.py – bounded buffer between the upstream reader and the client.
+
+A streaming response runs the upstream reader (translation included) as its
+own task feeding a StreamBuffer, and the response body drains it. The
+reader can run ahead of a slow client only up to `high_water` bytes; what
+happens at the mark is the policy:
+
+  pause    – the reader waits for the client. Upstream reads stop, so the
+             provider sees TCP backpressure.
+  coalesce – keep reading until 4x the mark (absorbs bursts without
+             stalling the provider), then pause.
+  drop     – raise SlowConsumerError; the caller aborts the stream.
+
+The writer always takes everything queued in one piece, so a client that
+fell behind catches up with one large write instead of many small ones.
+Occupancy across live buffers is reported by collect() for GET /metrics.
+
+start_keepalive() arms a loop timer that queues a keepalive event whenever
+the writer took nothing for a whole interval (e.g. a reasoning model
+thinking before its first token). The per-chunk cost is one counter
+increment in get().
+"""
+from __future__ import annotations
+
+import asyncio
+import collections
+import weakref
+from typing import Deque, Dict, Iterable, Optional
+
+from metrics import Metric
+
+POLICIES = ("pause", "coalesce", "drop")
+COALESCE_LIMIT_FACTOR = 4
+
+_live: "weakref.WeakSet[StreamBuffer]" = weakref.WeakSet()
+_totals: Dict[str, int] = {"paused": 0, "coalesced": 0, "dropped": 0, "keepalive": 0}
+
+
+class SlowConsumerError(Exception):
+    """The client fell more than the high-water mark behind under policy=drop."""
+
+
+class StreamBuffer:
+    __slots__ = (
+        "high_water",
+        "policy",
+        "peak_bytes",
+        "_limit",
+        "_chunks",
+        "_bytes",
+        "_closed",
+        "_error",
+        "_readable",
+        "_writable",
+        "_writes",
+        "_writes_at_tick",
+        "_keepalive",
+        "__weakref__",
+    )
+
+    def __init__(self, high_water: int, policy: str = "pause") -> None:
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown stream buffer policy '{policy}' (expected one of {POLICIES}).")
+        self.high_water = high_water
+        self.policy = policy
+        self.peak_bytes = 0
+        self._limit = high_water * COALESCE_LIMIT_FACTOR if policy == "coalesce" else high_water
+        self._chunks: Deque[str] = collections.deque()
+        self._bytes = 0
+        self._closed = False
+        self._error: Optional[BaseException] = None
+        self._readable = asyncio.Event()
+        self._writable = asyncio.Event()
+        self._writable.set()
+        self._writes = 0
+        self._writes_at_tick = 0
+        self._keepalive: Optional[asyncio.TimerHandle] = None
+        _live.add(self)
+
+    @property
+    def occupancy(self) -> int:
+        """Bytes queued for the client (SSE events are ASCII, so len == bytes)."""
+        return self._bytes
+
+    # -- reader side -----------------------------------------------------------
+
+    async def put(self, chunk: str) -> None:
+        if self._bytes >= self.high_water:
+            if self.policy == "drop":
+                _totals["dropped"] += 1
+                raise SlowConsumerError(
+                    f"Client is {self._bytes} bytes behind (high-water mark {self.high_water})."
+                )
+            if self._bytes >= self._limit:
+                _totals["paused"] += 1
+                while self._bytes >= self._limit and not self._closed:
+                    self._writable.clear()
+                    await self._writable.wait()
+        self._chunks.append(chunk)
+        self._bytes += len(chunk)
+        if self._bytes > self.peak_bytes:
+            self.peak_bytes = self._bytes
+        self._readable.set()
+
+    def start_keepalive(self, interval_s: float, payload: str) -> None:
+        """Queues *payload* after every *interval_s* in which nothing was written."""
+        loop = asyncio.get_running_loop()
+
+        def tick() -> None:
+            if self._closed:
+                return
+            if self._writes == self._writes_at_tick and not self._chunks:
+                self._chunks.append(payload)
+                self._bytes += len(payload)
+                self._readable.set()
+                _totals["keepalive"] += 1
+                self._writes_at_tick = self._writes + 1  # the ping's own write
+            else:
+                self._writes_at_tick = self._writes
+            self._keepalive = loop.call_later(interval_s, tick)
+
+        self._writes_at_tick = self._writes
+        self._keepalive = loop.call_later(interval_s, tick)
+
+    def close(self, error: Optional[BaseException] = None) -> None:
+        """No more chunks; the writer re-raises *error* once the queue is drained."""
+        if self._keepalive is not None:
+            self._keepalive.cancel()
+            self._keepalive = None
+        self._closed = True
+        self._error = error
+        self._readable.set()
+        self._writable.set()
+
+    # -- writer side -----------------------------------------------------------
+
+    async def get(self) -> Optional[str]:
+        """Everything queued as one string, or None once closed and drained."""
+        while not self._chunks:
+            if self._closed:
+                if self._error is not None:
+                    raise self._error
+                return None
+            self._readable.clear()
+            await self._readable.wait()
+        if len(self._chunks) == 1:
+            data = self._chunks.popleft()
+        else:
+            _totals["coalesced"] += len(self._chunks) - 1
+            data = "".join(self._chunks)
+            self._chunks.clear()
+        self._bytes = 0
+        self._writes += 1
+        self._writable.set()
+        return data
+
+    def __aiter__(self) -> "StreamBuffer":
+        return self
+
+    async def __anext__(self) -> str:
+        data = await self.get()
+        if data is None:
+            raise StopAsyncIteration
+        return data
+
+
+def collect() -> Iterable[Metric]:
+    buffers = list(_live)
+    occupancy = [b.occupancy for b in buffers]
+    yield Metric(
+        "proxy_stream_buffers",
+        "Streaming responses with a live upstream/client buffer.",
+        "gauge",
+        [({}, float(len(buffers)))],
+    )
+    yield Metric(
+        "proxy_stream_buffer_bytes",
+        "Bytes queued for slow clients: sum over streams and the largest single stream.",
+        "gauge",
+        [({"stat": "total"}, float(sum(occupancy))), ({"stat": "max"}, float(max(occupancy, default=0)))],
+    )
+    yield Metric(
+        "proxy_stream_buffer_events_total",
+        "High-water mark hits (paused, dropped), events merged into a larger write (coalesced) and keepalive pings sent.",
+        "counter",
+        [({"action": action}, float(count)) for action, count in _totals.items()],
+    )
@@ -0,0 +1,257 @@
+"""
+tracing.py – optional OpenTelemetry tracing.
+
+Everything here is a no-op until configure_tracing() is called with
+enabled=True, and the OpenTelemetry packages are only imported then, so a
+proxy with tracing off pays one global lookup per call site. When enabled,
+spans are head-sampled (ParentBased(TraceIdRatioBased)) and handed to the
+selected exporter:
+
+  otlp    – OTLP/HTTP (opentelemetry-exporter-otlp-proto-http); endpoint and
+            headers come from the standard OTEL_EXPORTER_OTLP_* variables
+  console – pretty-printed to stdout
+  file    – one JSON span per line
+  memory  – kept in memory, see memory_exporter() (tests)
+  pkg.mod:factory – any callable returning a SpanExporter
+"""
+from __future__ import annotations
+
+import importlib
+import json
+from typing import Any, Dict, Optional, Sequence
+
+_tracer: Any = None
+_provider: Any = None
+_memory_exporter: Any = None
+
+
+class _NoopSpan:
+    """Stand-in used while tracing is off; every method does nothing."""
+
+    __slots__ = ()
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        return None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        return None
+
+    def set_attributes(self, attributes: Dict[str, Any]) -> None:
+        return None
+
+    def record_exception(self, exc: BaseException) -> None:
+        return None
+
+    def set_status_error(self, description: str) -> None:
+        return None
+
+    def is_recording(self) -> bool:
+        return False
+
+    def end(self) -> None:
+        return None
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class _Span:
+    """Thin wrapper so call sites don't import opentelemetry themselves."""
+
+    __slots__ = ("_span", "_token")
+
+    def __init__(self, span: Any) -> None:
+        self._span = span
+        self._token = None
+
+    def __enter__(self) -> "_Span":
+        from opentelemetry import context, trace
+
+        self._token = context.attach(trace.set_span_in_context(self._span))
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        from opentelemetry import context
+
+        if exc is not None:
+            self.record_exception(exc)
+        if self._token is not None:
+            context.detach(self._token)
+        self._span.end()
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self._span.set_attribute(key, value)
+
+    def set_attributes(self, attributes: Dict[str, Any]) -> None:
+        self._span.set_attributes({k: v for k, v in attributes.items() if v is not None})
+
+    def record_exception(self, exc: BaseException) -> None:
+        self._span.record_exception(exc)
+        self.set_status_error(type(exc).__name__)
+
+    def set_status_error(self, description: str) -> None:
+        from opentelemetry.trace import Status, StatusCode
+
+        self._span.set_status(Status(StatusCode.ERROR, description))
+
+    def is_recording(self) -> bool:
+        return self._span.is_recording()
+
+    def end(self) -> None:
+        self._span.end()
+
+
+# ---------------------------------------------------------------------------
+# Exporters
+# ---------------------------------------------------------------------------
+
+
+def _file_exporter(path: str) -> Any:
+    from opentelemetry.sdk.trace.export import SpanExporter, SpanExportResult
+
+    class JsonLinesSpanExporter(SpanExporter):
+        def __init__(self, file_path: str) -> None:
+            self._fh = open(file_path, "a", encoding="utf-8")
+
+        def export(self, spans: Sequence[Any]) -> Any:
+            for span in spans:
+                self._fh.write(json.dumps(json.loads(span.to_json())) + "\n")
+            self._fh.flush()
+            return SpanExportResult.SUCCESS
+
+        def shutdown(self) -> None:
+            self._fh.close()
+
+    return JsonLinesSpanExporter(path)
+
+
+def _build_exporter(kind: str, file_path: str) -> Any:
+    global _memory_exporter
+    if kind == "otlp":
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+
+        return OTLPSpanExporter()
+    if kind == "console":
+        from opentelemetry.sdk.trace.export import ConsoleSpanExporter
+
+        return ConsoleSpanExporter()
+    if kind == "file":
+        return _file_exporter(file_path)
+    if kind == "memory":
+        from opentelemetry.sdk.trace.export.in_memory_span_exporter import (
+            InMemorySpanExporter,
+        )
+
+        _memory_exporter = InMemorySpanExporter()
+        return _memory_exporter
+    if ":" in kind:
+        module_name, _, factory = kind.partition(":")
+        return getattr(importlib.import_module(module_name), factory)()
+    raise ValueError(
+        f"Unknown tracing exporter '{kind}' (expected otlp, console, file, memory or module:factory)."
+    )
+
+
+# ---------------------------------------------------------------------------
+# PUBLIC API
+# ---------------------------------------------------------------------------
+
+
+def configure_tracing(
+    enabled: bool,
+    exporter: str = "otlp",
+    sample_ratio: float = 1.0,
+    service_name: str = "claude-code-proxy",
+    service_version: str = "",
+    file_path: str = "traces.jsonl",
+) -> None:
+    """Installs a TracerProvider; raises RuntimeError if OpenTelemetry is missing."""
+    global _tracer, _provider
+    if not enabled:
+        return
+    try:
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import (
+            BatchSpanProcessor,
+            SimpleSpanProcessor,
+        )
+        from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+    except ImportError as exc:
+        raise RuntimeError(
+            "TRACING_ENABLED=true requires opentelemetry-sdk (pip install opentelemetry-sdk)."
+        ) from exc
+
+    span_exporter = _build_exporter(exporter, file_path)
+    processor_cls = SimpleSpanProcessor if exporter in ("memory", "console") else BatchSpanProcessor
+    _provider = TracerProvider(
+        resource=Resource.create({"service.name": service_name, "service.version": service_version}),
+        sampler=ParentBased(TraceIdRatioBased(sample_ratio)),
+    )
+    _provider.add_span_processor(processor_cls(span_exporter))
+    _tracer = _provider.get_tracer("claude_proxy")
+
+
+def shutdown_tracing() -> None:
+    """Flushes pending spans and returns to the disabled state."""
+    global _tracer, _provider
+    if _provider is not None:
+        _provider.shutdown()
+    _tracer = None
+    _provider = None
+
+
+def is_enabled() -> bool:
+    return _tracer is not None
+
+
+def memory_exporter() -> Any:
+    """The InMemorySpanExporter installed by exporter="memory", if any."""
+    return _memory_exporter
+
+
+def span(name: str, kind: str = "internal", attributes: Optional[Dict[str, Any]] = None) -> Any:
+    """Context manager making a child of the current span the current span."""
+    if _tracer is None:
+        return NOOP_SPAN
+    return _Span(_start(name, kind, attributes))
+
+
+def start_span(name: str, kind: str = "internal", attributes: Optional[Dict[str, Any]] = None) -> Any:
+    """
+    Span that is *not* made current; call .end() yourself. Meant for async
+    generators, where attaching a context across yields is unsafe.
+    """
+    if _tracer is None:
+        return NOOP_SPAN
+    return _Span(_start(name, kind, attributes))
+
+
+def current_span() -> Any:
+    if _tracer is None:
+        return NOOP_SPAN
+    from opentelemetry import trace
+
+    return _Span(trace.get_current_span())
+
+
+def propagation_headers() -> Dict[str, str]:
+    """W3C traceparent/tracestate for the current span ({} when off)."""
+    if _tracer is None:
+        return {}
+    from opentelemetry import propagate
+
+    carrier: Dict[str, str] = {}
+    propagate.inject(carrier)
+    return carrier
+
+
+def _start(name: str, kind: str, attributes: Optional[Dict[str, Any]]) -> Any:
+    from opentelemetry.trace import SpanKind
+
+    span_kind = {"server": SpanKind.SERVER, "client": SpanKind.CLIENT}.get(kind, SpanKind.INTERNAL)
+    attrs = {k: v for k, v in (attributes or {}).items() if v is not None}
+    return _tracer.start_span(name, kind=span_kind, attributes=attrs)
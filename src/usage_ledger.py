@@ -0,0 +1,315 @@
+"""
+usage_ledger.py – per-request token and cost accounting.
+
+Every completed, failed or cancelled /v1/messages call becomes one
+UsageRecord: the provider-reported usage when the upstream sent it
+(non-streaming `usage`, or the final chunk of a stream opened with
+stream_options.include_usage), the proxy's own estimate otherwise, and
+the cost – OpenRouter's `usage.cost` when present, else catalog pricing.
+
+record() is O(1) and never blocks the event loop. It updates in-memory
+totals per (user, model) and queues the record. A background task appends
+queued records to SQLite every flush interval (and once more on shutdown).
+summary() answers GET /v1/usage: totals since process start from memory, or
+any time window from SQLite, which also covers every worker.
+"""
+from __future__ import annotations
+
+import asyncio
+import sqlite3
+import time
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from metrics import Metric
+
+GROUP_FIELDS = ("user_id", "target_model", "client_model")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage (
+    ts REAL NOT NULL,
+    request_id TEXT,
+    user_id TEXT,
+    client_model TEXT,
+    target_model TEXT,
+    stream INTEGER,
+    status TEXT,
+    usage_source TEXT,
+    input_tokens INTEGER,
+    output_tokens INTEGER,
+    reasoning_tokens INTEGER,
+    cost_usd REAL,
+    duration_ms REAL
+);
+CREATE INDEX IF NOT EXISTS usage_ts ON usage (ts);
+"""
+
+
+class UsageRecord(NamedTuple):
+    ts: float
+    request_id: str
+    user_id: Optional[str]
+    client_model: str
+    target_model: str
+    stream: bool
+    status: str  # "completed" | "error" | "cancelled"
+    usage_source: str  # "provider" | "estimated"
+    input_tokens: int
+    output_tokens: int
+    reasoning_tokens: int
+    cost_usd: Optional[float]
+    duration_ms: float
+
+
+def _field(obj: Any, name: str) -> Any:
+    if obj is None:
+        return None
+    if isinstance(obj, dict):
+        return obj.get(name)
+    return getattr(obj, name, None)
+
+
+def provider_usage(usage: Any) -> Optional[Tuple[int, int, int, Optional[float]]]:
+    """
+    (prompt, completion, reasoning tokens, cost) from an SDK object or raw
+    dict, OpenAI-shaped or Anthropic-shaped (input/output_tokens, where cache
+    writes and reads count as prompt tokens).
+    """
+    if usage is None:
+        return None
+    prompt = _field(usage, "prompt_tokens")
+    completion = _field(usage, "completion_tokens")
+    if prompt is None and completion is None:
+        prompt = _field(usage, "input_tokens")
+        completion = _field(usage, "output_tokens")
+        if prompt is None and completion is None:
+            return None
+        prompt = (
+            int(prompt or 0)
+            + int(_field(usage, "cache_creation_input_tokens") or 0)
+            + int(_field(usage, "cache_read_input_tokens") or 0)
+        )
+    reasoning = _field(_field(usage, "completion_tokens_details"), "reasoning_tokens")
+    cost = _field(usage, "cost")
+    return (
+        int(prompt or 0),
+        int(completion or 0),
+        int(reasoning or 0),
+        float(cost) if cost is not None else None,
+    )
+
+
+class _Totals:
+    __slots__ = ("requests", "input_tokens", "output_tokens", "cost_usd", "duration_ms", "errors")
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cost_usd = 0.0
+        self.duration_ms = 0.0
+        self.errors = 0
+
+    def add(self, record: UsageRecord) -> None:
+        self.requests += 1
+        self.input_tokens += record.input_tokens
+        self.output_tokens += record.output_tokens
+        self.cost_usd += record.cost_usd or 0.0
+        self.duration_ms += record.duration_ms
+        if record.status == "error":
+            self.errors += 1
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "cost_usd": round(float(self.cost_usd), 6),
+            "avg_duration_ms": round(self.duration_ms / self.requests, 1) if self.requests else 0.0,
+        }
+
+
+class UsageLedger:
+    def __init__(self, db_path: Optional[str] = None, flush_interval_s: float = 10.0) -> None:
+        self.db_path = db_path or None
+        self.flush_interval_s = flush_interval_s
+        self.started_at = time.time()
+        self._pending: List[UsageRecord] = []
+        # (user_id, target_model, client_model) -> totals since process start
+        self._totals: Dict[Tuple[str, str, str], _Totals] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+
+    # -- recording -------------------------------------------------------------
+
+    def record(self, record: UsageRecord) -> None:
+        key = (record.user_id or "", record.target_model, record.client_model)
+        totals = self._totals.get(key)
+        if totals is None:
+            totals = self._totals[key] = _Totals()
+        totals.add(record)
+        if self.db_path:
+            self._pending.append(record)
+
+    # -- persistence -----------------------------------------------------------
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=5.0)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        return conn
+
+    def _write(self, records: Sequence[UsageRecord]) -> None:
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany(
+                    f"INSERT INTO usage ({', '.join(UsageRecord._fields)}) "
+                    f"VALUES ({', '.join('?' * len(UsageRecord._fields))})",
+                    records,
+                )
+        finally:
+            conn.close()
+
+    async def flush(self) -> int:
+        """Writes queued records to SQLite in a worker thread; returns the count."""
+        if not self.db_path:
+            return 0
+        async with self._flush_lock:
+            records, self._pending = self._pending, []
+            if records:
+                try:
+                    await asyncio.to_thread(self._write, records)
+                except Exception:
+                    self._pending[:0] = records  # keep them for the next attempt
+                    raise
+            return len(records)
+
+    async def _flush_periodically(self, on_error: Any) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval_s)
+            try:
+                await self.flush()
+            except Exception as exc:
+                if on_error is not None:
+                    on_error(exc)
+
+    def start(self, on_error: Any = None) -> None:
+        if self.db_path and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._flush_periodically(on_error))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    # -- reporting ---------------------------------------------------------------
+
+    def _memory_summary(self, group_by: Sequence[str]) -> List[Dict[str, Any]]:
+        indexes = [GROUP_FIELDS.index(field) for field in group_by]
+        groups: Dict[Tuple[str, ...], _Totals] = {}
+        for key, totals in self._totals.items():
+            group_key = tuple(key[i] for i in indexes)
+            merged = groups.get(group_key)
+            if merged is None:
+                merged = groups[group_key] = _Totals()
+            for slot in _Totals.__slots__:
+                setattr(merged, slot, getattr(merged, slot) + getattr(totals, slot))
+        return [
+            {**dict(zip(group_by, group_key)), **totals.as_dict()}
+            for group_key, totals in groups.items()
+        ]
+
+    def _db_summary(self, group_by: Sequence[str], since: float) -> List[Dict[str, Any]]:
+        columns = ", ".join(group_by)
+        select = f"{columns}, " if group_by else ""
+        group = f"GROUP BY {columns}" if group_by else ""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                f"SELECT {select}COUNT(*), SUM(status = 'error'), SUM(input_tokens), "
+                f"SUM(output_tokens), SUM(COALESCE(cost_usd, 0)), SUM(duration_ms) "
+                f"FROM usage WHERE ts >= ? {group}",
+                (since,),
+            ).fetchall()
+        finally:
+            conn.close()
+        out = []
+        for row in rows:
+            totals = _Totals()
+            (
+                totals.requests,
+                totals.errors,
+                totals.input_tokens,
+                totals.output_tokens,
+                totals.cost_usd,
+                totals.duration_ms,
+            ) = (value or 0 for value in row[len(group_by) :])
+            if totals.requests:
+                out.append({**dict(zip(group_by, row[: len(group_by)])), **totals.as_dict()})
+        return out
+
+    async def summary(
+        self, group_by: Sequence[str] = ("user_id", "target_model"), since: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """
+        Usage grouped by any of GROUP_FIELDS. Without *since* (a Unix time)
+        the totals cover this process's lifetime; with it they come from
+        SQLite, which raises RuntimeError when persistence is off.
+        """
+        unknown = [field for field in group_by if field not in GROUP_FIELDS]
+        if unknown:
+            raise ValueError(f"Cannot group by {unknown}; expected any of {list(GROUP_FIELDS)}.")
+        if since is None:
+            groups = self._memory_summary(group_by)
+            window_start = self.started_at
+            source = "memory"
+        else:
+            if not self.db_path:
+                raise RuntimeError("'since' needs USAGE_DB_PATH (usage persistence is off).")
+            await self.flush()
+            groups = await asyncio.to_thread(self._db_summary, group_by, since)
+            window_start = since
+            source = "sqlite"
+        groups.sort(key=lambda g: g["cost_usd"], reverse=True)
+        total = _Totals()
+        for g in groups:
+            total.requests += g["requests"]
+            total.errors += g["errors"]
+            total.input_tokens += g["input_tokens"]
+            total.output_tokens += g["output_tokens"]
+            total.cost_usd += g["cost_usd"]
+            total.duration_ms += g["avg_duration_ms"] * g["requests"]
+        return {
+            "since": window_start,
+            "source": source,
+            "group_by": list(group_by),
+            "totals": total.as_dict(),
+            "groups": groups,
+        }
+
+    def collect(self) -> Iterable[Metric]:
+        by_model: Dict[str, _Totals] = {}
+        for (_, model, _), totals in self._totals.items():
+            merged = by_model.setdefault(model, _Totals())
+            merged.input_tokens += totals.input_tokens
+            merged.output_tokens += totals.output_tokens
+            merged.cost_usd += totals.cost_usd
+        yield Metric(
+            "proxy_usage_tokens_total",
+            "Tokens per target model, provider-reported where available.",
+            "counter",
+            [({"model": m, "kind": "input"}, float(t.input_tokens)) for m, t in by_model.items()]
+            + [({"model": m, "kind": "output"}, float(t.output_tokens)) for m, t in by_model.items()],
+        )
+        yield Metric(
+            "proxy_usage_cost_usd_total",
+            "Spend per target model in USD.",
+            "counter",
+            [({"model": m}, t.cost_usd) for m, t in by_model.items()],
+        )
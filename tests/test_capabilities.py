@@ -31,4 +31,18 @@ def test_provider_supports_tools_true():
 
 
 def test_provider_supports_tools_false():
-    assert capabilities.provider_supports_tools("no-tools") is False
\ No newline at end of file
+    assert capabilities.provider_supports_tools("no-tools") is False
+
+def test_get_model_limits_reads_catalog(monkeypatch, tmp_path):
+    catalog = tmp_path / "models.json"
+    catalog.write_text(
+        '{"data": [{"id": "m", "context_length": 1000,'
+        ' "top_provider": {"context_length": 800, "max_completion_tokens": 100}}]}'
+    )
+    monkeypatch.setattr(capabilities, "CAPS_PATH", catalog)
+    capabilities._load_model_limits_file.cache_clear()
+    try:
+        assert capabilities.get_model_limits("m") == (800, 100)
+        assert capabilities.get_model_limits("unknown") is None
+    finally:
+        capabilities._load_model_limits_file.cache_clear()
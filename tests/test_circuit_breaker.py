@@ -0,0 +1,99 @@
+import pytest
+
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreakers, CircuitOpenError
+from model_telemetry import FakeClock
+
+KEY = ("http://upstream/v1", "a/model")
+
+
+class Overloaded(Exception):
+    pass
+
+
+def _breakers(clock, **kwargs):
+    transitions = []
+    breakers = CircuitBreakers(
+        failure_threshold=3,
+        open_duration_s=30.0,
+        is_failure=lambda exc: isinstance(exc, Overloaded),
+        on_state_change=lambda key, old, new: transitions.append(new),
+        clock=clock,
+        **kwargs,
+    )
+    return breakers, transitions
+
+
+def _call(breakers, exc=None):
+    with breakers.guard(KEY):
+        if exc is not None:
+            raise exc
+
+
+def test_opens_after_consecutive_failures_and_fails_fast():
+    clock = FakeClock()
+    breakers, transitions = _breakers(clock)
+    for _ in range(2):
+        with pytest.raises(Overloaded):
+            _call(breakers, Overloaded())
+    _call(breakers)  # a success resets the count
+    with pytest.raises(ValueError):
+        _call(breakers, ValueError())  # not a failure: ignored
+    for _ in range(3):
+        with pytest.raises(Overloaded):
+            _call(breakers, Overloaded())
+    assert breakers.state(KEY) == OPEN
+
+    clock.advance(10)
+    with pytest.raises(CircuitOpenError) as excinfo:
+        _call(breakers)
+    assert excinfo.value.retry_after_s == pytest.approx(20)
+    assert transitions == [OPEN]
+
+
+def test_half_open_probe_closes_or_reopens():
+    clock = FakeClock()
+    breakers, transitions = _breakers(clock)
+    for _ in range(3):
+        with pytest.raises(Overloaded):
+            _call(breakers, Overloaded())
+
+    clock.advance(30)
+    assert breakers.state(KEY) == HALF_OPEN
+    with pytest.raises(Overloaded):
+        _call(breakers, Overloaded())  # the probe fails: open for another 30 s
+    assert breakers.state(KEY) == OPEN
+
+    clock.advance(30)
+    with breakers.guard(KEY):
+        with pytest.raises(CircuitOpenError):  # only one probe at a time
+            _call(breakers)
+    assert breakers.state(KEY) == CLOSED
+    assert transitions == [OPEN, HALF_OPEN, OPEN, HALF_OPEN, CLOSED]
+
+
+def test_disabled_breakers_and_metrics():
+    clock = FakeClock()
+    disabled = CircuitBreakers(failure_threshold=0, clock=clock)
+    for _ in range(10):
+        with pytest.raises(Overloaded):
+            _call(disabled, Overloaded())
+    _call(disabled)
+
+    breakers, _ = _breakers(clock)
+    for _ in range(3):
+        with pytest.raises(Overloaded):
+            _call(breakers, Overloaded())
+    with pytest.raises(CircuitOpenError):
+        _call(breakers)
+    metrics = {m.name: m.samples for m in breakers.collect()}
+    labels = {"upstream": KEY[0], "model": KEY[1]}
+    assert metrics["proxy_circuit_breaker_state"] == [(labels, 2.0)]
+    assert metrics["proxy_circuit_breaker_rejections_total"] == [(labels, 1.0)]
+
+
+def test_failures_reported_without_an_exception():
+    breakers, _ = _breakers(FakeClock())
+    for _ in range(3):
+        with breakers.guard(KEY) as call:
+            call.mark_failed()
+    assert breakers.state(KEY) == OPEN
@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+
+from fair_share import BudgetExceeded, FairQueue, UserBudgets
+from state_backend import InMemoryStateBackend
+
+
+async def _grant_order(queue, requests):
+    """Queues *requests* (user, cost) behind a held slot; returns the users in grant order."""
+    holder = await queue.acquire("holder", 1)
+    order = []
+
+    async def one(user, cost):
+        slot = await queue.acquire(user, cost)
+        order.append(user)
+        await asyncio.sleep(0)
+        slot.release()
+
+    tasks = [asyncio.create_task(one(user, cost)) for user, cost in requests]
+    await asyncio.sleep(0)
+    holder.release()
+    await asyncio.gather(*tasks)
+    return order
+
+
+async def test_fair_queue_interleaves_users_by_deficit_round_robin():
+    queue = FairQueue(max_concurrency=1, quantum=100)
+    order = await _grant_order(queue, [("heavy", 100)] * 4 + [("light", 100)] * 2)
+    assert order == ["heavy", "light", "heavy", "light", "heavy", "heavy"]
+    assert queue.active == 0
+
+
+async def test_fair_queue_shares_tokens_not_requests_and_honours_weights():
+    queue = FairQueue(max_concurrency=1, quantum=100)
+    # "big" asks for 300 tokens per call, so it goes once per three turns
+    order = await _grant_order(queue, [("big", 300)] * 2 + [("small", 100)] * 4)
+    assert order == ["small", "small", "big", "small", "small", "big"]
+
+    weighted = FairQueue(max_concurrency=1, quantum=100, weights={"gold": 2.0})
+    order = await _grant_order(weighted, [("gold", 100)] * 4 + [("basic", 100)] * 2)
+    assert order == ["gold", "gold", "basic", "gold", "gold", "basic"]
+
+
+async def test_large_costs_are_scheduled_without_a_pass_per_quantum():
+    # a pass per quantum would take ~10^8 passes here
+    queue = FairQueue(max_concurrency=1, quantum=1024, weights={"low": 0.001})
+    order = await asyncio.wait_for(
+        _grant_order(queue, [("low", 10**9), ("mid", 300_000), ("mid", 300_000)]), timeout=1
+    )
+    assert order == ["mid", "mid", "low"]
+    assert queue.active == 0
+
+
+async def test_cancelled_waiter_does_not_leak_its_slot():
+    queue = FairQueue(max_concurrency=1)
+    holder = await queue.acquire("a", 10)
+    waiter = asyncio.create_task(queue.acquire("b", 10))
+    await asyncio.sleep(0)
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    holder.release()
+    holder.release()  # idempotent
+    assert queue.active == 0 and queue.waiting == 0
+    (await queue.acquire("c", 10)).release()
+
+
+async def test_user_budgets_reject_with_retry_after():
+    budgets = UserBudgets(InMemoryStateBackend(), request_budget=2, token_budget=1000, window_s=60)
+    await budgets.admit("u1")
+    await budgets.admit("u1")
+    with pytest.raises(BudgetExceeded) as exc_info:
+        await budgets.admit("u1")
+    assert 0 < exc_info.value.retry_after_s <= 60
+    await budgets.admit("u2")  # budgets are per user
+
+    await budgets.charge("u2", 1500)
+    with pytest.raises(BudgetExceeded, match="tokens"):
+        await budgets.admit("u2")
@@ -0,0 +1,51 @@
+import base64
+import struct
+
+import image_store
+
+
+def _png_b64(width, height):
+    header = b"\x89PNG\r\n\x1a\n" + struct.pack(">I", 13) + b"IHDR"
+    header += struct.pack(">II", width, height) + b"\x08\x02\x00\x00\x00"
+    return base64.b64encode(header).decode()
+
+
+def test_png_dimensions_drive_token_estimate():
+    store = image_store.ImageStore()
+    entry = store.get("image/png", _png_b64(750, 100))
+    assert (entry.width, entry.height) == (750, 100)
+    assert entry.tokens == 100
+    assert entry.data_url.startswith("data:image/png;base64,")
+
+
+def test_large_image_is_billed_at_capped_edge():
+    assert image_store.estimate_image_tokens(3136, 3136) == 1568 * 1568 // 750
+
+
+def test_unknown_format_uses_flat_estimate():
+    store = image_store.ImageStore()
+    entry = store.get("image/png", base64.b64encode(b"not an image").decode())
+    assert entry.tokens == image_store.DEFAULT_IMAGE_TOKENS
+
+
+def test_identical_images_are_processed_once():
+    store = image_store.ImageStore(max_entries=1)
+    data = _png_b64(10, 10)
+    first = store.get("image/png", data)
+    assert store.get("image/png", data) is first
+    assert (store.hits, store.misses) == (1, 1)
+    store.get("image/png", _png_b64(20, 20))
+    assert len(store) == 1
+
+
+def test_cache_is_bounded_by_total_bytes():
+    small, large = _png_b64(10, 10), _png_b64(20, 20) + "A" * 400
+    store = image_store.ImageStore(max_cache_bytes=500)
+    store.get("image/png", small)
+    store.get("image/png", large)
+    assert len(store) == 1 and store.cached_bytes <= 500  # the small one went
+    store.get("image/png", large)
+    assert store.hits == 1
+
+    store.get("image/png", "A" * 1000)  # larger than the whole budget: not kept
+    assert len(store) == 1
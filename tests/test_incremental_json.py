@@ -0,0 +1,45 @@
+import json
+import random
+
+import pytest
+
+from incremental_json import IncrementalJSONValidator
+
+DOC = json.dumps(
+    {"path": "a.py", "content": "print(\"hi\")\né\U0001f600", "n": [-1.5e3, 0, True, None], "o": {}}
+)
+
+
+def _feed(text, size):
+    validator = IncrementalJSONValidator()
+    for i in range(0, len(text), size):
+        validator.feed(text[i : i + size])
+    return validator
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, len(DOC)])
+def test_validates_any_fragmentation(size):
+    validator = _feed(DOC, size)
+    assert validator.complete and validator.error is None
+    assert validator.closing_suffix() == ""
+
+
+@pytest.mark.parametrize("bad", ['{"a" 1}', "[1,]", '{"a": 01}', '{"a": tru}', '"\\x"', "{} {}"])
+def test_reports_first_error(bad):
+    validator = _feed(bad, 2)
+    assert validator.error is not None and not validator.complete
+    assert validator.closing_suffix() is None
+
+
+def test_closing_suffix_repairs_every_prefix():
+    rng = random.Random(0)
+    for cut in range(1, len(DOC)):
+        validator = _feed(DOC[:cut], rng.randint(1, 5))
+        assert validator.error is None
+        json.loads(DOC[:cut] + validator.closing_suffix())
+
+
+def test_empty_arguments_are_not_truncated():
+    validator = _feed("", 1)
+    assert validator.empty and not validator.complete
+    assert validator.closing_suffix() == "{}"
@@ -0,0 +1,39 @@
+import asyncio
+import time
+
+from loop_watchdog import LoopWatchdog
+
+
+def _blocking_call():
+    time.sleep(0.25)
+
+
+async def test_reports_blocking_stack_and_lag():
+    reports = []
+    watchdog = LoopWatchdog(
+        interval_s=0.01, threshold_s=0.05, on_block=lambda s, stack: reports.append((s, stack))
+    )
+    watchdog.start()
+    try:
+        await asyncio.sleep(0.05)
+        _blocking_call()
+        await asyncio.sleep(0.05)
+    finally:
+        await watchdog.stop()
+
+    assert len(reports) == 1
+    blocked_s, stack = reports[0]
+    assert blocked_s >= 0.05
+    assert "_blocking_call" in stack[-1]
+    snap = watchdog.snapshot()
+    assert snap["max"] >= 0.2
+    assert snap["blocked"] == 1
+
+
+def test_metrics_endpoint_exports_loop_lag(main_module):
+    from fastapi.testclient import TestClient
+
+    with TestClient(main_module.create_app()) as client:
+        body = client.get("/metrics").text
+    assert 'proxy_event_loop_lag_seconds{quantile="0.99"}' in body
+    assert "proxy_event_loop_blocked_total" in body
@@ -35,4 +35,184 @@ def test_count_tokens_with_tool(main_module):
         tools=[tool],
     )
     # 4 base +4 role +2 content +2 tool-prefix +6 name +4 desc +2 schema
-    assert total == 24
\ No newline at end of file
+    assert total == 24
+
+def _fake_limits(monkeypatch, main_module, table):
+    import capabilities
+
+    monkeypatch.setattr(
+        main_module,
+        "get_model_limits",
+        lambda name: capabilities.ModelLimits(*table[name]) if name in table else None,
+    )
+
+
+def test_preflight_clamps_max_tokens(monkeypatch, main_module):
+    _fake_limits(monkeypatch, main_module, {"big-model": (1000, None)})
+    monkeypatch.setattr(main_module.settings, "context_overflow_policy", "clamp")
+    model, max_tokens = main_module.preflight_context_window("big-model", 800, 500, "r1")
+    assert (model, max_tokens) == ("big-model", 200)
+
+
+def test_preflight_rejects_oversized_prompt(monkeypatch, main_module):
+    _fake_limits(monkeypatch, main_module, {"big-model": (1000, None)})
+    monkeypatch.setattr(main_module.settings, "context_overflow_policy", "clamp")
+    with pytest.raises(main_module.ContextWindowExceededError):
+        main_module.preflight_context_window("big-model", 1200, 100, "r1")
+
+
+def test_preflight_reroutes_to_fallback(monkeypatch, main_module):
+    _fake_limits(
+        monkeypatch, main_module, {"big-model": (1000, None), "huge-model": (100000, 8000)}
+    )
+    monkeypatch.setattr(main_module.settings, "context_overflow_policy", "reroute")
+    monkeypatch.setattr(main_module.settings, "context_fallback_model_name", "huge-model")
+    model, max_tokens = main_module.preflight_context_window("big-model", 1200, 4000, "r1")
+    assert (model, max_tokens) == ("huge-model", 4000)
+
+
+def test_preflight_drops_fallbacks_that_cannot_fit(monkeypatch, main_module):
+    _fake_limits(
+        monkeypatch, main_module, {"small-ctx": (8000, None), "big-ctx": (200000, None)}
+    )
+    monkeypatch.setattr(main_module.settings, "context_overflow_policy", "clamp")
+    fallbacks = ["small-ctx", "big-ctx", "unknown-model"]
+    assert main_module.preflight_fallbacks(fallbacks, 10000, 1000, "r1") == ("big-ctx", "unknown-model")
+    monkeypatch.setattr(main_module.settings, "context_overflow_policy", "off")
+    assert main_module.preflight_fallbacks(fallbacks, 10000, 1000, "r1") == tuple(fallbacks)
+
+
+def test_preflight_unknown_model_passes_through(monkeypatch, main_module):
+    _fake_limits(monkeypatch, main_module, {})
+    monkeypatch.setattr(main_module.settings, "context_overflow_policy", "reject")
+    assert main_module.preflight_context_window("x", 10**9, 10, "r1") == ("x", 10)
+
+
+def _tool_turns(main_module, n, body):
+    msgs = []
+    for i in range(n):
+        msgs.append(
+            main_module.Message(
+                role="assistant",
+                content=[{"type": "tool_use", "id": f"t{i}", "name": "read", "input": {}}],
+            )
+        )
+        msgs.append(
+            main_module.Message(
+                role="user",
+                content=[{"type": "tool_result", "tool_use_id": f"t{i}", "content": body}],
+            )
+        )
+    return msgs
+
+
+def test_compaction_elides_old_tool_results(main_module):
+    msgs = _tool_turns(main_module, 3, "word " * 2000)
+    before = main_module.count_tokens_for_anthropic_request(msgs, None, "gpt-4")
+    compacted, after = main_module.compact_anthropic_messages(
+        msgs, before, token_budget=before // 2, keep_recent_messages=2,
+        tool_result_max_tokens=50, model_name="gpt-4",
+    )
+    assert after <= before // 2
+    assert after == main_module.count_tokens_for_anthropic_request(compacted, None, "gpt-4")
+    # most recent turn untouched, pairing intact
+    assert compacted[-1] is msgs[-1]
+    assert [m.content[0].tool_use_id for m in compacted[1::2]] == ["t0", "t1", "t2"]
+    assert "elided by proxy" in compacted[1].content[0].content
+
+
+def test_compaction_keeps_images_in_tool_results(main_module):
+    image = {"type": "image", "source": {"type": "base64", "media_type": "image/png", "data": "iVBORw0KGgo" * 500}}
+    body = [{"type": "text", "text": "log " * 2000}, image, {"type": "text", "text": "tail"}]
+    msgs = _tool_turns(main_module, 2, body)
+    before = main_module.count_tokens_for_anthropic_request(msgs, None, "gpt-4")
+    compacted, after = main_module.compact_anthropic_messages(
+        msgs, before, token_budget=before - 1000, keep_recent_messages=2,
+        tool_result_max_tokens=50, model_name="gpt-4",
+    )
+    assert after < before
+    text, kept = compacted[1].content[0].content
+    assert "elided by proxy" in text["text"] and "iVBOR" not in text["text"]
+    assert kept == image
+
+
+def test_compaction_noop_under_budget(main_module):
+    msgs = _tool_turns(main_module, 1, "small")
+    compacted, after = main_module.compact_anthropic_messages(
+        msgs, 100, token_budget=1000, keep_recent_messages=0,
+        tool_result_max_tokens=1, model_name="gpt-4",
+    )
+    assert compacted is msgs and after == 100
+
+
+def test_compaction_budget_skips_when_max_tokens_leaves_none(monkeypatch, main_module):
+    _fake_limits(monkeypatch, main_module, {"big-model": (10000, None)})
+    monkeypatch.setattr(main_module.settings, "compaction_max_input_tokens", None)
+    monkeypatch.setattr(main_module.settings, "compaction_context_ratio", 0.75)
+    assert main_module._compaction_budget("big-model", 1500) == 6000
+    assert main_module._compaction_budget("big-model", 7500) is None
+    assert main_module._compaction_budget("big-model", 32000) is None
+
+
+def test_import_defers_upstream_client(main_module):
+    assert main_module._openai_client is None
+
+
+def test_openai_errors_have_their_own_handler(main_module):
+    import httpx
+    import openai
+    from fastapi.testclient import TestClient
+
+    application = main_module.create_app()
+
+    async def boom():
+        raise openai.APIConnectionError(request=httpx.Request("POST", "http://upstream/v1"))
+
+    application.add_api_route("/boom", boom)
+    # an Exception handler would re-raise through ServerErrorMiddleware here
+    resp = TestClient(application).get("/boom")
+    assert resp.status_code >= 500 and resp.json()["error"]["type"] == "api_error"
+    assert main_module.app is main_module.app
+
+
+def test_lifespan_builds_and_closes_client(main_module):
+    from fastapi.testclient import TestClient
+
+    with TestClient(main_module.create_app()) as client:
+        assert main_module._openai_client is not None
+        assert client.get("/").json()["status"] == "ok"
+    assert main_module._openai_client is None
+
+
+def test_count_tokens_sets_server_timing(main_module):
+    from fastapi.testclient import TestClient
+
+    resp = TestClient(main_module.create_app()).post(
+        "/v1/messages/count_tokens",
+        json={"model": "claude-3-haiku", "messages": [{"role": "user", "content": "hi"}]},
+    )
+    stages = [part.split(";")[0] for part in resp.headers["server-timing"].split(", ")]
+    assert stages == ["parse", "validate", "token_count", "total"]
+
+
+def test_over_budget_user_gets_rate_limit_error(main_module, monkeypatch):
+    import asyncio
+
+    from fastapi.testclient import TestClient
+
+    from fair_share import UserBudgets
+
+    budgets = UserBudgets(main_module.state_backend, request_budget=1, window_s=30)
+    asyncio.run(budgets.admit("heavy"))  # the one request this window allows
+    monkeypatch.setattr(main_module, "user_budgets", budgets)
+    client = TestClient(main_module.create_app())
+    body = {
+        "model": "claude-3-haiku",
+        "max_tokens": 10,
+        "metadata": {"user_id": "heavy"},
+        "messages": [{"role": "user", "content": "hi"}],
+    }
+    resp = client.post("/v1/messages", json=body)
+    assert resp.status_code == 429
+    assert resp.json()["error"]["type"] == "rate_limit_error"
+    assert 1 <= int(resp.headers["retry-after"]) <= 30
@@ -0,0 +1,90 @@
+import os
+
+import pytest
+
+from model_router import RoutingTable, RoutingTableError, RoutingTableLoader, builtin_routing_table
+
+RULES = [
+    {"name": "long", "client_model": ["*sonnet*", "*opus*"], "min_input_tokens": 100_000,
+     "target": "google/gemini-2.5-pro", "fallbacks": ["@big", "google/gemini-2.5-pro"]},
+    {"name": "vision", "images": True, "target": "openai/gpt-4o"},
+    {"name": "ci", "users": "ci-*", "tools": True, "target": "@small"},
+    {"name": "sonnet", "client_model": "*sonnet*", "target": "@big"},
+]
+
+
+def test_first_matching_rule_wins():
+    table = RoutingTable(RULES, default="fallback/model")
+
+    long = table.match("claude-sonnet-4", input_tokens=150_000)
+    assert (long.target, long.fallbacks, long.rule) == ("google/gemini-2.5-pro", ("@big",), "long")
+    assert table.match("claude-sonnet-4", input_tokens=1_000).rule == "sonnet"
+    assert table.match("claude-sonnet-4").rule == "sonnet"  # unknown size: no token rule matches
+    assert table.match("claude-haiku", has_images=True).rule == "vision"
+    assert table.match("claude-haiku", has_tools=True, user_id="CI-runner-7").rule == "ci"
+    assert table.match("claude-haiku", has_tools=False, user_id="ci-runner-7").rule is None
+    assert table.match("claude-haiku").target == "fallback/model"
+
+
+def test_candidates_become_target_and_are_not_repeated_as_fallbacks():
+    table = RoutingTable(
+        [
+            {"name": "pool", "candidates": ["a/one", "b/two", "a/one"], "fallbacks": ["b/two", "@big"]},
+            {"name": "pinned", "target": "c/three", "candidates": ["a/one"]},
+        ]
+    )
+    pool = table.match("claude-haiku")
+    assert (pool.target, pool.candidates, pool.fallbacks) == ("a/one", ("a/one", "b/two"), ("@big",))
+    assert table.rules[1].route.candidates == ("c/three", "a/one")
+    assert builtin_routing_table().match("claude-haiku").candidates == ()
+
+
+def test_builtin_table_is_the_classic_mapping():
+    table = builtin_routing_table()
+    assert table.match("claude-3-opus-latest").target == "@big"
+    assert table.match("claude-sonnet-4").target == "@big"
+    assert table.match("claude-3-5-haiku").target == "@small"
+    assert table.match("something-else").rule is None
+
+
+@pytest.mark.parametrize(
+    "rule",
+    [
+        {"target": "m", "tool": True},
+        {"client_model": "*"},
+        {"target": "@medium"},
+        {"target": "m", "min_input_tokens": "100k"},
+        {"target": "m", "tools": "yes"},
+        {"candidates": "a/one"},
+        {"candidates": []},
+    ],
+)
+def test_malformed_rules_are_rejected(rule):
+    with pytest.raises(RoutingTableError):
+        RoutingTable([rule])
+
+
+def test_loader_hot_reloads_and_keeps_the_last_good_table(tmp_path):
+    path = tmp_path / "routes.toml"
+    path.write_text('[[rules]]\nclient_model = "*haiku*"\ntarget = "a/one"\n')
+    reloads = []
+    loader = RoutingTableLoader(str(path), reload_interval_s=0, on_reload=lambda p, e: reloads.append(e))
+    assert loader.table.match("claude-haiku").target == "a/one"
+
+    path.write_text('default = "z/default"\n[[rules]]\nclient_model = "*haiku*"\ntarget = "a/two"\n')
+    os.utime(path, (1, 1))  # a distinct mtime even on coarse-grained filesystems
+    assert loader.table.match("claude-haiku").target == "a/two"
+    assert loader.table.match("other").target == "z/default"
+
+    path.write_text("[[rules]]\ntarget = \n")
+    os.utime(path, (2, 2))
+    assert loader.table.match("claude-haiku").target == "a/two"
+    assert reloads[0] is None and isinstance(reloads[1], RoutingTableError)
+
+
+def test_yaml_tables(tmp_path):
+    pytest.importorskip("yaml")
+    path = tmp_path / "routes.yaml"
+    path.write_text("rules:\n  - client_model: '*opus*'\n    target: '@big'\n    fallbacks: ['@small']\n")
+    route = RoutingTableLoader(str(path)).table.match("claude-opus-4")
+    assert (route.target, route.fallbacks) == ("@big", ("@small",))
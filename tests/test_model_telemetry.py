@@ -0,0 +1,80 @@
+import pytest
+
+from model_telemetry import FakeClock, ModelTelemetry
+
+PRICES = {"cheap/model": 1.0, "mid/model": 2.0, "pricey/model": 5.0}
+
+
+def _telemetry(clock, **kwargs):
+    kwargs.setdefault("min_samples", 3)
+    kwargs.setdefault("ttft_slo_s", 1.0)
+    kwargs.setdefault("probe_interval_s", 60.0)
+    return ModelTelemetry(alpha=0.5, clock=clock, **kwargs)
+
+
+def _serve(telemetry, model, n, ttft_s=0.2, tokens_per_s=50.0, ok=True):
+    for _ in range(n):
+        telemetry.record(model, ok, ttft_s=ttft_s, tokens_per_s=tokens_per_s)
+
+
+def test_cheapest_within_slo_and_shift_away_from_a_degrading_model():
+    clock = FakeClock()
+    telemetry = _telemetry(clock)
+    candidates = ["pricey/model", "mid/model", "cheap/model"]
+
+    # unmeasured models are assumed to meet the SLO: cheapest first
+    assert telemetry.rank(candidates, "cheapest", PRICES.get) == ["cheap/model", "mid/model", "pricey/model"]
+
+    _serve(telemetry, "cheap/model", 3)
+    _serve(telemetry, "mid/model", 3)
+    assert telemetry.rank(candidates, "cheapest", PRICES.get)[0] == "cheap/model"
+
+    _serve(telemetry, "cheap/model", 4, ttft_s=4.0)  # p95 TTFT well past the 1 s SLO
+    assert telemetry.snapshot()["cheap/model"]["p95_ttft_s"] > 1.0
+    assert telemetry.rank(candidates, "cheapest", PRICES.get) == ["mid/model", "pricey/model", "cheap/model"]
+
+    _serve(telemetry, "mid/model", 4, ok=False)  # over the error budget: last
+    assert telemetry.rank(candidates, "cheapest", PRICES.get) == ["pricey/model", "cheap/model", "mid/model"]
+
+
+def test_fastest_and_throughput_objectives():
+    telemetry = _telemetry(FakeClock())
+    _serve(telemetry, "a/model", 3, ttft_s=0.8, tokens_per_s=120.0)
+    _serve(telemetry, "b/model", 3, ttft_s=0.3, tokens_per_s=40.0)
+    assert telemetry.rank(["a/model", "b/model"], "fastest") == ["b/model", "a/model"]
+    assert telemetry.rank(["a/model", "b/model"], "throughput") == ["a/model", "b/model"]
+    # ties and missing prices keep the configured order
+    assert telemetry.rank(["a/model", "b/model"], "cheapest") == ["a/model", "b/model"]
+    with pytest.raises(ValueError):
+        telemetry.rank(["a/model"], "cheapest-ish")
+
+
+def test_model_routed_away_from_is_probed_once_per_interval():
+    clock = FakeClock()
+    telemetry = _telemetry(clock)
+    candidates = ["cheap/model", "mid/model"]
+    _serve(telemetry, "cheap/model", 3, ok=False)
+    _serve(telemetry, "mid/model", 3)
+    assert telemetry.rank(candidates, "cheapest", PRICES.get)[0] == "mid/model"
+
+    clock.advance(30)
+    _serve(telemetry, "mid/model", 1)
+    assert telemetry.rank(candidates, "cheapest", PRICES.get)[0] == "mid/model"
+
+    clock.advance(30)  # cheap/model unused for 60 s: one probe
+    assert telemetry.rank(candidates, "cheapest", PRICES.get)[0] == "cheap/model"
+    assert telemetry.rank(candidates, "cheapest", PRICES.get)[0] == "mid/model"
+
+    # the probe succeeds and the provider recovers over a few requests
+    _serve(telemetry, "cheap/model", 3)
+    assert telemetry.rank(candidates, "cheapest", PRICES.get)[0] == "cheap/model"
+
+
+def test_metrics_report_per_model_gauges():
+    telemetry = _telemetry(FakeClock())
+    telemetry.record("a/model", True, ttft_s=0.5, tokens_per_s=10.0)
+    telemetry.record("b/model", False)
+    metrics = {m.name: m.samples for m in telemetry.collect()}
+    assert metrics["proxy_model_ttft_p95_seconds"] == [({"model": "a/model"}, pytest.approx(0.5))]
+    assert metrics["proxy_model_tokens_per_second"] == [({"model": "a/model"}, 10.0)]
+    assert metrics["proxy_model_error_rate"] == [({"model": "a/model"}, 0.0), ({"model": "b/model"}, 1.0)]
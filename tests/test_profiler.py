@@ -0,0 +1,85 @@
+import asyncio
+import threading
+
+import httpx
+import pytest
+
+import profiler
+
+
+def _spin_until(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_sampler_collects_collapsed_stacks():
+    stop = threading.Event()
+    worker = threading.Thread(target=_spin_until, args=(stop,), name="busy worker")
+    worker.start()
+    try:
+        sampler = profiler.SamplingProfiler(interval_s=0.002)
+        sampler.run(0.1)
+    finally:
+        stop.set()
+        worker.join()
+
+    assert sampler.samples > 5
+    lines = sampler.collapsed().splitlines()
+    busy = [line for line in lines if line.startswith("busy_worker;")]
+    assert busy and any("test_profiler.py:_spin_until" in line for line in busy)
+    assert int(busy[0].rsplit(" ", 1)[1]) > 0
+
+
+async def test_only_one_profile_at_a_time():
+    task = asyncio.ensure_future(profiler.cprofile(0.05))
+    await asyncio.sleep(0)
+    with pytest.raises(profiler.ProfilerBusyError):
+        await profiler.sample(0.01)
+    report = await task
+    assert "function calls" in report
+
+
+def test_admin_profile_endpoint_requires_token(monkeypatch, main_module):
+    from fastapi.testclient import TestClient
+
+    client = TestClient(main_module.create_app())
+    assert client.get("/admin/profile?seconds=0.01").status_code == 404
+
+    monkeypatch.setattr(main_module.settings, "admin_token", "s3cret")
+    assert client.get("/admin/profile?seconds=0.01").status_code == 403
+
+    resp = client.get(
+        "/admin/profile?seconds=0.05&interval_ms=2",
+        headers={"Authorization": "Bearer s3cret"},
+    )
+    assert resp.status_code == 200
+    assert resp.headers["content-disposition"].endswith('profile.collapsed"')
+    assert resp.text.strip()
+
+
+async def test_overlapping_profile_requests_get_409(monkeypatch, main_module):
+    monkeypatch.setattr(main_module.settings, "admin_token", "s3cret")
+    transport = httpx.ASGITransport(app=main_module.create_app())
+    async with httpx.AsyncClient(transport=transport, base_url="http://proxy") as client:
+        headers = {"Authorization": "Bearer s3cret"}
+        first, second = await asyncio.gather(
+            client.get("/admin/profile?seconds=0.2&mode=cprofile", headers=headers),
+            client.get("/admin/profile?seconds=0.2&mode=cprofile", headers=headers),
+        )
+    assert sorted([first.status_code, second.status_code]) == [200, 409]
+    busy = first if first.status_code == 409 else second
+    assert busy.json()["error"] == {
+        "type": "invalid_request_error",
+        "message": "A profile is already running.",
+    }
+
+
+async def test_cprofile_conflict_with_another_profiler_is_busy(monkeypatch):
+    class ActiveElsewhere:
+        def enable(self):
+            raise ValueError("Another profiling tool is already active")
+
+    monkeypatch.setattr(profiler.cProfile, "Profile", ActiveElsewhere)
+    with pytest.raises(profiler.ProfilerBusyError):
+        await profiler.cprofile(0.01)
+    assert not profiler.busy()
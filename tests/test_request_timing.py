@@ -0,0 +1,21 @@
+from request_timing import RequestTimer
+
+
+def test_durations_are_measured_between_marks(monkeypatch):
+    clock = iter([10.0, 10.002, 10.010, 10.011, 10.030])
+    monkeypatch.setattr("request_timing.time.monotonic", lambda: next(clock))
+
+    timer = RequestTimer()
+    timer.mark("parse")
+    timer.mark("validate")
+    timer.mark("parse")  # repeated stages accumulate
+
+    assert timer.summary() == {"parse": 3.0, "validate": 8.0, "total": 30.0}
+
+
+def test_server_timing_header_format():
+    timer = RequestTimer()
+    timer.mark("parse")
+    header = timer.server_timing()
+    assert header.startswith("parse;dur=")
+    assert ", total;dur=" in header
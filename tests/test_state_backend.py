@@ -0,0 +1,28 @@
+import pytest
+
+import state_backend
+
+
+async def test_memory_backend_incr_and_expiry(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(state_backend.time, "monotonic", lambda: now[0])
+    backend = state_backend.create_state_backend("memory")
+
+    assert await backend.incr("tokens", 5, ttl_s=10) == 5
+    assert await backend.incr("tokens", 2.5) == 7.5
+    now[0] += 11
+    assert await backend.get("tokens") is None
+    assert await backend.incr("tokens") == 1
+
+
+async def test_memory_backend_set_get_delete():
+    backend = state_backend.InMemoryStateBackend()
+    await backend.set("k", "v")
+    assert await backend.get("k") == "v"
+    await backend.delete("k")
+    assert await backend.get("k") is None
+
+
+def test_unknown_backend_rejected():
+    with pytest.raises(ValueError):
+        state_backend.create_state_backend("etcd")
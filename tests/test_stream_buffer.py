@@ -0,0 +1,53 @@
+import asyncio
+
+import pytest
+
+from stream_buffer import SlowConsumerError, StreamBuffer
+
+
+async def test_pause_blocks_the_reader_at_the_high_water_mark():
+    buffer = StreamBuffer(high_water=10, policy="pause")
+    await buffer.put("a" * 10)
+    put = asyncio.create_task(buffer.put("b"))
+    await asyncio.sleep(0)
+    assert not put.done() and buffer.occupancy == 10
+
+    assert await buffer.get() == "a" * 10
+    await put
+    buffer.close()
+    assert [chunk async for chunk in buffer] == ["b"]
+
+
+async def test_coalesce_reads_ahead_and_merges_writes():
+    buffer = StreamBuffer(high_water=10, policy="coalesce")
+    for _ in range(4):
+        await buffer.put("x" * 9)  # below 4x the mark: never waits
+    assert buffer.occupancy == 36 and buffer.peak_bytes == 36
+    assert await buffer.get() == "x" * 36
+    assert buffer.occupancy == 0
+
+
+async def test_drop_raises_and_writer_sees_reader_errors():
+    buffer = StreamBuffer(high_water=4, policy="drop")
+    await buffer.put("abcd")
+    with pytest.raises(SlowConsumerError):
+        await buffer.put("e")
+
+    buffer.close(RuntimeError("upstream failed"))
+    assert await buffer.get() == "abcd"
+    with pytest.raises(RuntimeError):
+        await buffer.get()
+
+
+async def test_keepalive_fills_only_idle_intervals():
+    buffer = StreamBuffer(high_water=100)
+    buffer.start_keepalive(0.01, "ping")
+    await buffer.put("data")
+    assert await buffer.get() == "data"
+
+    assert await asyncio.wait_for(buffer.get(), 1) == "ping"
+    started = asyncio.get_running_loop().time()
+    assert await asyncio.wait_for(buffer.get(), 1) == "ping"
+    assert asyncio.get_running_loop().time() - started < 0.1  # one interval, not two
+    buffer.close()
+    assert await buffer.get() is None
@@ -0,0 +1,878 @@
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+
+
+def _sse(*chunks):
+    lines = [f"data: {json.dumps(c)}\n\n" for c in chunks]
+    return ("".join(lines) + "data: [DONE]\n\n").encode()
+
+
+TEXT_AND_TOOL = [
+    {"choices": [{"index": 0, "delta": {"content": "Hel"}}]},
+    {"choices": [{"index": 0, "delta": {"content": "lo"}}]},
+    {"choices": [{"index": 0, "delta": {"tool_calls": [
+        {"index": 0, "id": "call_1", "function": {"name": "read", "arguments": "{\"pa"}}
+    ]}}]},
+    {"choices": [{"index": 0, "delta": {"tool_calls": [
+        {"index": 0, "function": {"arguments": "th\": \"a\"}"}}
+    ]}}]},
+    {"choices": [{"index": 0, "delta": {}, "finish_reason": "tool_calls"}]},
+]
+
+
+def _events(raw):
+    out = []
+    for block in raw.strip().split("\n\n"):
+        lines = block.split("\n")
+        out.append((lines[0][len("event: "):], json.loads(lines[1][len("data: "):])))
+    return out
+
+
+async def _drain(main_module, stream):
+    parts = []
+    async for part in main_module.handle_anthropic_streaming_response_from_openai_stream(
+        stream, "claude-sonnet", 10, "r1", time.monotonic()
+    ):
+        parts.append(part)
+    return _events("".join(parts))
+
+
+@pytest.fixture
+def upstream(main_module):
+    requests = []
+    responses = []
+
+    def handler(request):
+        requests.append(json.loads(request.content))
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    main_module._upstream_http_client = httpx.AsyncClient(
+        transport=httpx.MockTransport(handler), base_url="http://upstream/v1/"
+    )
+    return requests, responses
+
+
+async def test_raw_stream_translates_text_and_tool_calls(main_module, upstream):
+    requests, responses = upstream
+    responses.append(httpx.Response(200, content=_sse(*TEXT_AND_TOOL)))
+
+    stream = await main_module._safe_create_raw_stream(
+        {"model": "m", "messages": [], "stream": True}, "r1"
+    )
+    events = await _drain(main_module, stream)
+
+    deltas = [d["delta"] for e, d in events if e == "content_block_delta"]
+    assert [d.get("text") for d in deltas[:2]] == ["Hel", "lo"]
+    assert "".join(d.get("partial_json", "") for d in deltas) == '{"path": "a"}'
+    tool_start = [d for e, d in events if e == "content_block_start"][1]
+    assert tool_start["content_block"]["id"] == "call_1"
+    assert events[-2][1]["delta"]["stop_reason"] == "tool_use"
+
+
+async def test_raw_stream_retries_without_tools_on_404(main_module, upstream):
+    requests, responses = upstream
+    responses.append(
+        httpx.Response(404, json={"error": {"message": "No endpoints found that support tool use", "code": 404}})
+    )
+    responses.append(httpx.Response(200, content=_sse(TEXT_AND_TOOL[0], TEXT_AND_TOOL[-1])))
+
+    params = {"model": "m", "messages": [], "stream": True, "tools": [{"type": "function"}]}
+    stream = await main_module._safe_create_raw_stream(params, "r1")
+    await _drain(main_module, stream)
+    assert "tools" in requests[0] and "tools" not in requests[1]
+
+
+async def test_raw_stream_maps_upstream_errors(main_module, upstream):
+    _, responses = upstream
+    responses.append(httpx.Response(429, json={"error": {"message": "slow down", "code": 429}}))
+    with pytest.raises(main_module.openai.RateLimitError):
+        await main_module._safe_create_raw_stream({"model": "m", "messages": []}, "r1")
+
+
+@pytest.fixture
+def anthropic_upstream(monkeypatch, main_module):
+    monkeypatch.setattr(
+        main_module.settings, "anthropic_passthrough_base_url", "http://anthropic/v1"
+    )
+    monkeypatch.setattr(main_module.settings, "big_model_name", "anthropic/claude-sonnet-4")
+    requests = []
+    responses = []
+
+    def handler(request):
+        requests.append(request)
+        return responses.pop(0)
+
+    main_module._anthropic_http_client = httpx.AsyncClient(
+        transport=httpx.MockTransport(handler), base_url="http://anthropic/v1/"
+    )
+    return requests, responses
+
+
+def test_passthrough_rewrites_only_model_bytes(main_module, anthropic_upstream):
+    from fastapi.testclient import TestClient
+
+    requests, responses = anthropic_upstream
+    sse = (
+        b'event: message_start\ndata: {"type":"message_start"}\n\n'
+        b'event: message_stop\ndata: {"type":"message_stop"}\n\n'
+    )
+    responses.append(
+        httpx.Response(200, content=sse, headers={"content-type": "text/event-stream"})
+    )
+    body = b'{"model":"claude-sonnet-4","max_tokens":5,  "stream":true,"messages":[{"role":"user","content":"x \\"model\\": y"}]}'
+
+    resp = TestClient(main_module.create_app()).post(
+        "/v1/messages",
+        content=body,
+        headers={"content-type": "application/json", "anthropic-beta": "b1"},
+    )
+
+    assert resp.status_code == 200
+    assert resp.content == sse
+    sent = requests[0]
+    assert sent.url.path == "/v1/messages"
+    assert sent.headers["anthropic-beta"] == "b1"
+    assert sent.content == body.replace(
+        b'"model":"claude-sonnet-4"', b'"model": "anthropic/claude-sonnet-4"'
+    )
+
+
+def test_passthrough_relays_upstream_errors(main_module, anthropic_upstream):
+    from fastapi.testclient import TestClient
+
+    requests, responses = anthropic_upstream
+    error = b'{"type":"error","error":{"type":"overloaded_error","message":"busy"}}'
+    responses.append(
+        httpx.Response(529, content=error, headers={"content-type": "application/json"})
+    )
+
+    resp = TestClient(main_module.create_app()).post(
+        "/v1/messages",
+        json={"model": "claude-sonnet-4", "max_tokens": 5, "messages": []},
+    )
+
+    assert resp.status_code == 529
+    assert resp.content == error
+
+
+def test_passthrough_applies_budgets_and_the_fair_queue(main_module, anthropic_upstream, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    from fair_share import FairQueue, UserBudgets
+
+    budgets = UserBudgets(main_module.state_backend, request_budget=2, window_s=30)
+    monkeypatch.setattr(main_module, "user_budgets", budgets)
+    queue = FairQueue(max_concurrency=1)
+    monkeypatch.setattr(main_module, "fair_queue", queue)
+    requests, responses = anthropic_upstream
+    client = TestClient(main_module.create_app())
+
+    def send(content, stream=False):
+        return client.post(
+            "/v1/messages",
+            json={"model": "claude-sonnet-4", "max_tokens": 5, "stream": stream,
+                  "metadata": {"user_id": "heavy"},
+                  "messages": [{"role": "user", "content": content}]},
+        )
+
+    responses.append(httpx.Response(200, content=b'{"type":"message","content":[]}'))
+    assert send("hi").status_code == 200
+    sse = b'event: message_stop\ndata: {"type":"message_stop"}\n\n'
+    responses.append(httpx.Response(200, content=sse, headers={"content-type": "text/event-stream"}))
+    assert send("hi", stream=True).content == sse
+    granted = list(queue.collect())[1].samples
+    assert queue.active == 0 and sum(count for _, count in granted) == 2
+
+    resp = send("hi")
+    assert resp.status_code == 429
+    assert resp.json()["error"]["type"] == "rate_limit_error"
+    assert len(requests) == 2
+
+
+def test_passthrough_usage_is_recorded_in_the_ledger(main_module, anthropic_upstream, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    from capabilities import ModelPricing
+
+    monkeypatch.setattr(main_module.settings, "usage_ledger_enabled", True)
+    monkeypatch.setattr(main_module.settings, "admin_token", "s3cret")
+    monkeypatch.setattr(
+        main_module, "get_model_pricing", lambda model: ModelPricing(1e-6, 2e-6, 0.0)
+    )
+    requests, responses = anthropic_upstream
+    sse = (
+        b'event: message_start\ndata: {"type":"message_start","message":{"usage":'
+        b'{"input_tokens":900,"cache_read_input_tokens":100,"output_tokens":1}}}\n\n'
+        b'event: content_block_delta\ndata: {"type":"content_block_delta","delta":{"text":"hi"}}\n\n'
+        b'event: message_delta\ndata: {"type":"message_delta","usage":{"output_tokens":50}}\n\n'
+        b'event: message_stop\ndata: {"type":"message_stop"}\n\n'
+    )
+
+    async def chunked():
+        for i in range(0, len(sse), 7):  # events split across reads
+            yield sse[i:i + 7]
+
+    responses.append(httpx.Response(200, content=chunked(), headers={"content-type": "text/event-stream"}))
+    responses.append(httpx.Response(200, json={"type": "message", "content": [],
+                                               "usage": {"input_tokens": 10, "output_tokens": 5}}))
+    client = TestClient(main_module.create_app())
+    for stream in (True, False):
+        resp = client.post(
+            "/v1/messages",
+            json={"model": "claude-sonnet-4", "max_tokens": 100, "stream": stream,
+                  "metadata": {"user_id": "alice"},
+                  "messages": [{"role": "user", "content": "hi"}]},
+        )
+        assert resp.status_code == 200
+    assert resp.content and len(requests) == 2
+
+    summary = client.get("/v1/usage", headers={"x-admin-token": "s3cret"}).json()
+    assert summary["groups"] == [
+        {
+            "user_id": "alice",
+            "target_model": "anthropic/claude-sonnet-4",
+            "requests": 2,
+            "errors": 0,
+            "input_tokens": 1010,
+            "output_tokens": 55,
+            "cost_usd": 0.00112,
+            "avg_duration_ms": summary["groups"][0]["avg_duration_ms"],
+        }
+    ]
+
+
+def test_passthrough_stream_that_breaks_off_is_recorded_as_an_error(
+    main_module, anthropic_upstream, monkeypatch
+):
+    from fastapi.testclient import TestClient
+
+    monkeypatch.setattr(main_module.settings, "usage_ledger_enabled", True)
+    monkeypatch.setattr(main_module.settings, "admin_token", "s3cret")
+    requests, responses = anthropic_upstream
+
+    async def broken():
+        yield b'event: message_start\ndata: {"type":"message_start","message":{"usage":{"input_tokens":9}}}\n\n'
+        raise httpx.ReadError("connection reset")
+
+    responses.append(httpx.Response(200, content=broken(), headers={"content-type": "text/event-stream"}))
+    client = TestClient(main_module.create_app())
+    resp = client.post(
+        "/v1/messages",
+        json={"model": "claude-sonnet-4", "max_tokens": 5, "stream": True,
+              "messages": [{"role": "user", "content": "hi"}]},
+    )
+    assert _events(resp.text)[-1][0] == "error"
+    (group,) = client.get("/v1/usage", headers={"x-admin-token": "s3cret"}).json()["groups"]
+    assert (group["requests"], group["errors"], group["input_tokens"]) == (1, 1, 9)
+
+
+def test_passthrough_is_guarded_by_the_circuit_breaker(main_module, anthropic_upstream, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    from circuit_breaker import CircuitBreakers
+    from model_telemetry import FakeClock
+
+    clock = FakeClock()
+    breakers = CircuitBreakers(failure_threshold=2, is_failure=main_module._is_failover_error, clock=clock)
+    monkeypatch.setattr(main_module, "circuit_breakers", breakers)
+    requests, responses = anthropic_upstream
+    client = TestClient(main_module.create_app())
+
+    def send():
+        return client.post(
+            "/v1/messages",
+            json={"model": "claude-sonnet-4", "max_tokens": 5, "messages": [{"role": "user", "content": "hi"}]},
+        )
+
+    error = b'{"type":"error","error":{"type":"overloaded_error","message":"busy"}}'
+    for _ in range(2):
+        responses.append(httpx.Response(529, content=error, headers={"content-type": "application/json"}))
+        assert send().status_code == 529  # relayed as-is
+    key = ("http://anthropic/v1", "anthropic/claude-sonnet-4")
+    assert breakers.state(key) == "open"
+
+    resp = send()  # fails fast without reaching the upstream
+    assert resp.status_code == 503
+    assert resp.json()["error"]["type"] == "overloaded_error"
+    assert len(requests) == 2
+
+    clock.advance(30)  # the half-open probe succeeds and closes the circuit
+    responses.append(httpx.Response(200, content=b'{"type":"message","content":[]}'))
+    assert send().status_code == 200
+    assert breakers.state(key) == "closed"
+
+
+def test_passthrough_routing_sees_prompt_size_and_images(
+    main_module, anthropic_upstream, upstream, monkeypatch
+):
+    from fastapi.testclient import TestClient
+
+    from model_router import RoutingTable
+
+    monkeypatch.setattr(main_module.settings, "upstream_stream_mode", "raw")
+    table = RoutingTable(
+        [
+            {"name": "vision", "images": True, "target": "small/vision"},
+            {"name": "long", "min_input_tokens": 200, "target": "@big"},
+        ],
+        default="@small",
+    )
+    monkeypatch.setattr(main_module.model_routing, "_table", table)
+    monkeypatch.setattr(main_module.model_routing, "path", None)
+    passthrough_requests, passthrough_responses = anthropic_upstream
+    openai_requests, openai_responses = upstream
+    client = TestClient(main_module.create_app())
+
+    def send(content, stream=False):
+        return client.post(
+            "/v1/messages",
+            json={"model": "claude-sonnet-4", "max_tokens": 5, "stream": stream,
+                  "messages": [{"role": "user", "content": content}]},
+        )
+
+    # a long prompt passes through
+    passthrough_responses.append(httpx.Response(200, content=b'{"type":"message","content":[]}'))
+    assert send("word " * 400).status_code == 200
+    assert len(passthrough_requests) == 1
+
+    # the same long prompt with an image matches the earlier vision rule instead
+    openai_responses.append(httpx.Response(200, content=_sse(*TEXT_AND_TOOL)))
+    image = {"type": "image", "source": {"type": "base64", "media_type": "image/png", "data": "iVBORw0KGgo="}}
+    assert send([{"type": "text", "text": "word " * 400}, image], stream=True).status_code == 200
+    assert openai_requests[-1]["model"] == "small/vision"
+    # a body the proxy can't validate is rejected, never passed through
+    document = [{"type": "document", "source": {"type": "text", "data": "word " * 400}}]
+    assert send(document).status_code == 422
+    assert len(passthrough_requests) == 1
+
+
+class _Enc:
+    def encode(self, text):
+        return text.split()
+
+
+def _translate(main_module, chunks, **kwargs):
+    translator = main_module.AnthropicStreamTranslator("claude-sonnet", 10, "r1", _Enc(), **kwargs)
+    out = translator.start()
+    for chunk in chunks:
+        out += translator.feed(main_module._RawChunk(chunk))
+    out += translator.finish()
+    return translator, _events("".join(out))
+
+
+def test_translator_flushes_arguments_received_before_tool_name(main_module):
+    chunks = [
+        {"choices": [{"index": 0, "delta": {"tool_calls": [{"index": 0, "function": {"arguments": "{\"a\""}}]}}]},
+        {"choices": [{"index": 0, "delta": {"tool_calls": [
+            {"index": 0, "id": "call_9", "function": {"name": "write", "arguments": ": 1}"}}
+        ]}}]},
+        {"choices": [{"index": 0, "delta": {}, "finish_reason": "tool_calls"}]},
+    ]
+    translator, events = _translate(main_module, chunks)
+
+    names = [e for e, _ in events]
+    assert names == [
+        "message_start", "ping", "content_block_start", "content_block_delta",
+        "content_block_stop", "message_delta", "message_stop",
+    ]
+    assert events[3][1]["delta"]["partial_json"] == '{"a": 1}'
+    assert translator.stop_reason == "tool_use"
+    assert translator.chunk_count == 3
+
+
+def test_translator_keeps_no_argument_buffer_unless_validating(main_module):
+    translator, _ = _translate(main_module, TEXT_AND_TOOL)
+    tool = next(iter(translator._tools.values()))
+    assert tool.validator is None and tool.pending == []
+
+    translator, _ = _translate(main_module, TEXT_AND_TOOL, validate_tool_arguments=True)
+    assert next(iter(translator._tools.values())).validator.complete
+
+
+def test_translator_closes_arguments_truncated_by_max_tokens(main_module):
+    chunks = [
+        {"choices": [{"index": 0, "delta": {"tool_calls": [
+            {"index": 0, "id": "call_1", "function": {"name": "write", "arguments": "{\"path\": \"a.py\", \"content\": \"x = \\"}}
+        ]}}]},
+        {"choices": [{"index": 0, "delta": {}, "finish_reason": "length"}]},
+    ]
+    _, events = _translate(main_module, chunks)
+    assert [e for e, _ in events].count("content_block_delta") == 1
+
+    translator, events = _translate(main_module, chunks, repair_truncated_arguments=True)
+    partial = "".join(d["delta"]["partial_json"] for e, d in events if e == "content_block_delta")
+    assert json.loads(partial) == {"path": "a.py", "content": "x = \\"}
+    assert translator.stop_reason == "max_tokens"
+
+
+class _EndlessStream:
+    """Upstream that keeps producing text until closed; blocks after *block_after* chunks."""
+
+    def __init__(self, main_module, block_after=None):
+        self.main_module = main_module
+        self.block_after = block_after
+        self.sent = 0
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.closed:
+            raise StopAsyncIteration
+        if self.block_after is not None and self.sent >= self.block_after:
+            await asyncio.Event().wait()
+        self.sent += 1
+        return self.main_module._RawChunk({"choices": [{"index": 0, "delta": {"content": "tok "}}]})
+
+    async def close(self):
+        self.closed = True
+
+
+async def test_stream_closes_upstream_when_client_disconnects(main_module, monkeypatch):
+    monkeypatch.setattr(main_module.settings, "stream_disconnect_check_interval", 1e-9)
+    logged = []
+    monkeypatch.setattr(main_module, "info", lambda record: logged.append(record))
+    monkeypatch.setattr(main_module, "get_token_encoder", lambda *a: _Enc())
+    checks = iter([False, False, True])
+
+    async def is_disconnected():
+        return next(checks)
+
+    stream = _EndlessStream(main_module)
+    parts = [
+        part
+        async for part in main_module.handle_anthropic_streaming_response_from_openai_stream(
+            stream, "claude-sonnet", 10, "r1", time.monotonic(),
+            max_tokens=100, is_disconnected=is_disconnected,
+        )
+    ]
+
+    assert stream.closed and stream.sent == 3
+    assert not any("message_stop" in p for p in parts)
+    record = logged[-1]
+    assert record.event == "stream_cancelled"
+    assert record.data["status_code"] == 499
+    assert record.data["tokens_saved"] == 97
+
+
+def test_stream_handler_gets_the_clamped_max_tokens(main_module, upstream, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    import capabilities
+
+    monkeypatch.setattr(main_module.settings, "upstream_stream_mode", "raw")
+    monkeypatch.setattr(main_module.settings, "context_overflow_policy", "clamp")
+    monkeypatch.setattr(
+        main_module, "get_model_limits", lambda name: capabilities.ModelLimits(1000, None)
+    )
+    handler = main_module.handle_anthropic_streaming_response_from_openai_stream
+    seen = {}
+
+    def spy(*args, **kwargs):
+        seen.update(kwargs)
+        return handler(*args, **kwargs)
+
+    monkeypatch.setattr(main_module, "handle_anthropic_streaming_response_from_openai_stream", spy)
+    requests, responses = upstream
+    responses.append(httpx.Response(200, content=_sse(
+        {"choices": [{"index": 0, "delta": {"content": "ok"}, "finish_reason": "stop"}]},
+    )))
+    TestClient(main_module.create_app()).post(
+        "/v1/messages",
+        json={"model": "claude-sonnet-4", "max_tokens": 4000, "stream": True,
+              "messages": [{"role": "user", "content": "hi"}]},
+    )
+    assert requests[0]["max_tokens"] == seen["max_tokens"] < 1000
+
+
+async def test_stream_closes_upstream_when_cancelled(main_module):
+    stream = _EndlessStream(main_module, block_after=1)
+
+    async def consume():
+        async for _ in main_module.handle_anthropic_streaming_response_from_openai_stream(
+            stream, "claude-sonnet", 10, "r1", time.monotonic()
+        ):
+            pass
+
+    task = asyncio.create_task(consume())
+    for _ in range(10):
+        await asyncio.sleep(0)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert stream.closed and stream.sent == 1
+
+
+async def test_stream_drops_slow_client_under_drop_policy(main_module, monkeypatch):
+    monkeypatch.setattr(main_module.settings, "stream_buffer_high_water_bytes", 64)
+    monkeypatch.setattr(main_module.settings, "stream_buffer_policy", "drop")
+    stream = _EndlessStream(main_module)
+    events = main_module.handle_anthropic_streaming_response_from_openai_stream(
+        stream, "claude-sonnet", 10, "r1", time.monotonic()
+    )
+
+    await events.__anext__()
+    for _ in range(10):  # client stalls while the reader runs ahead
+        await asyncio.sleep(0)
+    rest = [part async for part in events]
+
+    assert stream.closed
+    assert len("".join(rest)) <= 64 * 2
+
+
+def test_translator_maps_reasoning_to_a_thinking_block(main_module):
+    chunks = [
+        {"choices": [{"index": 0, "delta": {"reasoning": "Let me "}}]},
+        {"choices": [{"index": 0, "delta": {"reasoning": "think."}}]},
+        {"choices": [{"index": 0, "delta": {"content": "Answer"}}]},
+        {"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]},
+    ]
+    translator, events = _translate(main_module, chunks)
+
+    blocks = [(e, d.get("index"), d.get("content_block", d.get("delta", {})).get("type")) for e, d in events[2:-2]]
+    assert blocks == [
+        ("content_block_start", 0, "thinking"),
+        ("content_block_delta", 0, "thinking_delta"),
+        ("content_block_delta", 0, "thinking_delta"),
+        ("content_block_delta", 0, "signature_delta"),
+        ("content_block_stop", 0, None),
+        ("content_block_start", 1, "text"),
+        ("content_block_delta", 1, "text_delta"),
+        ("content_block_stop", 1, None),
+    ]
+    assert translator.output_tokens == 4
+
+
+def test_thinking_budget_is_forwarded_as_reasoning(main_module, upstream, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    monkeypatch.setattr(main_module.settings, "upstream_stream_mode", "raw")
+    requests, responses = upstream
+    responses.append(httpx.Response(200, content=_sse(
+        {"choices": [{"index": 0, "delta": {"reasoning": "hmm"}}]},
+        {"choices": [{"index": 0, "delta": {"content": "ok"}, "finish_reason": "stop"}]},
+    )))
+
+    resp = TestClient(main_module.create_app()).post(
+        "/v1/messages",
+        json={
+            "model": "claude-sonnet-4",
+            "max_tokens": 2000,
+            "stream": True,
+            "thinking": {"type": "enabled", "budget_tokens": 1024},
+            "messages": [
+                {"role": "user", "content": "hi"},
+                {"role": "assistant", "content": [
+                    {"type": "thinking", "thinking": "earlier", "signature": "sig"},
+                    {"type": "text", "text": "hello"},
+                ]},
+                {"role": "user", "content": "again"},
+            ],
+        },
+    )
+
+    assert resp.status_code == 200
+    assert requests[0]["reasoning"] == {"max_tokens": 1024}
+    assert "earlier" not in json.dumps(requests[0]["messages"])
+    assert '"thinking_delta"' in resp.text
+
+
+def test_reasoning_is_dropped_unless_thinking_is_requested(main_module, upstream, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    monkeypatch.setattr(main_module.settings, "upstream_stream_mode", "raw")
+    requests, responses = upstream
+    responses.append(httpx.Response(200, content=_sse(
+        {"choices": [{"index": 0, "delta": {"reasoning": "hmm"}}]},
+        {"choices": [{"index": 0, "delta": {"content": "ok"}, "finish_reason": "stop"}]},
+    )))
+    resp = TestClient(main_module.create_app()).post(
+        "/v1/messages",
+        json={"model": "claude-sonnet-4", "max_tokens": 100, "stream": True,
+              "messages": [{"role": "user", "content": "hi"}]},
+    )
+    assert "thinking" not in resp.text
+    assert [d["content_block"]["type"] for e, d in _events(resp.text) if e == "content_block_start"] == ["text"]
+
+    from openai.types.chat import ChatCompletion
+
+    completion = ChatCompletion.model_validate({
+        "id": "c1", "object": "chat.completion", "created": 0, "model": "m",
+        "choices": [{"index": 0, "finish_reason": "stop",
+                     "message": {"role": "assistant", "content": "ok", "reasoning": "hmm"}}],
+    })
+    convert = main_module.convert_openai_to_anthropic_response
+    assert [b.type for b in convert(completion, "claude-sonnet-4").content] == ["text"]
+    thinking = convert(completion, "claude-sonnet-4", forward_reasoning=True).content[0]
+    assert (thinking.type, thinking.thinking, thinking.signature) == ("thinking", "hmm", "")
+
+
+def test_stream_usage_is_recorded_in_the_ledger(main_module, upstream, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    from capabilities import ModelPricing
+
+    monkeypatch.setattr(main_module.settings, "usage_ledger_enabled", True)
+    monkeypatch.setattr(main_module.settings, "admin_token", "s3cret")
+    monkeypatch.setattr(main_module.settings, "upstream_stream_mode", "raw")
+    monkeypatch.setattr(
+        main_module, "get_model_pricing", lambda model: ModelPricing(1e-6, 2e-6, 0.0)
+    )
+    requests, responses = upstream
+    responses.append(httpx.Response(200, content=_sse(
+        {"choices": [{"index": 0, "delta": {"content": "ok"}, "finish_reason": "stop"}]},
+        {"choices": [], "usage": {"prompt_tokens": 1000, "completion_tokens": 50}},
+    )))
+
+    client = TestClient(main_module.create_app())
+    resp = client.post(
+        "/v1/messages",
+        json={
+            "model": "claude-sonnet-4",
+            "max_tokens": 100,
+            "stream": True,
+            "metadata": {"user_id": "alice"},
+            "messages": [{"role": "user", "content": "hi"}],
+        },
+    )
+
+    assert requests[0]["stream_options"] == {"include_usage": True}
+    assert _events(resp.text)[-2][1]["usage"] == {"output_tokens": 50}
+    assert client.get("/v1/usage").status_code == 403
+    admin = {"x-admin-token": "s3cret"}
+    summary = client.get("/v1/usage", headers=admin).json()
+    assert summary["groups"] == [
+        {
+            "user_id": "alice",
+            "target_model": "big-model",
+            "requests": 1,
+            "errors": 0,
+            "input_tokens": 1000,
+            "output_tokens": 50,
+            "cost_usd": 0.0011,
+            "avg_duration_ms": summary["groups"][0]["avg_duration_ms"],
+        }
+    ]
+    assert client.get("/v1/usage", params={"group_by": "nope"}, headers=admin).status_code == 400
+
+
+def test_streams_omit_include_usage_while_the_ledger_is_off(main_module, upstream, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    monkeypatch.setattr(main_module.settings, "upstream_stream_mode", "raw")
+    requests, responses = upstream
+    responses.append(httpx.Response(200, content=_sse(
+        {"choices": [{"index": 0, "delta": {"content": "ok"}, "finish_reason": "stop"}]},
+    )))
+    client = TestClient(main_module.create_app())
+    client.post(
+        "/v1/messages",
+        json={"model": "claude-sonnet-4", "max_tokens": 100, "stream": True,
+              "messages": [{"role": "user", "content": "hi"}]},
+    )
+    assert "stream_options" not in requests[0]
+
+
+def test_usage_endpoint_is_hidden_without_an_admin_token(main_module):
+    from fastapi.testclient import TestClient
+
+    client = TestClient(main_module.create_app())
+    assert client.get("/v1/usage").status_code == 404
+
+
+async def test_raw_transport_errors_surface_as_sdk_errors(main_module, upstream):
+    import openai
+
+    requests, responses = upstream
+    params = {"model": "m", "messages": [], "stream": True}
+    responses.append(httpx.ConnectError("refused"))
+    with pytest.raises(openai.APIConnectionError):
+        await main_module._safe_create_raw_stream(params, "r1")
+    responses.append(httpx.ReadTimeout("slow"))
+    with pytest.raises(openai.APITimeoutError):
+        await main_module._safe_create_raw_stream(params, "r1")
+
+    async def broken():
+        yield b'data: {"choices": [{"index": 0, "delta": {"content": "hi"}}]}\n\n'
+        raise httpx.ReadError("reset")
+
+    responses.append(httpx.Response(200, content=broken()))
+    stream = await main_module._safe_create_raw_stream(params, "r1")
+    with pytest.raises(openai.APIConnectionError):
+        async for _ in stream:
+            pass
+
+
+async def test_upstream_failure_falls_back_to_the_next_model(main_module, upstream, monkeypatch):
+    monkeypatch.setattr(main_module.settings, "upstream_stream_mode", "raw")
+    requests, responses = upstream
+    responses.append(httpx.Response(503, json={"error": {"message": "overloaded", "code": 503}}))
+    responses.append(httpx.Response(200, content=_sse(*TEXT_AND_TOOL)))
+
+    model, stream, _ = await main_module._create_with_fallbacks(
+        {"model": "primary/model", "messages": [], "stream": True}, "r1", ["backup/model"]
+    )
+    events = await _drain(main_module, stream)
+
+    assert model == "backup/model"
+    assert [r["model"] for r in requests] == ["primary/model", "backup/model"]
+    assert events[-2][1]["delta"]["stop_reason"] == "tool_use"
+
+
+def test_candidates_are_chosen_from_live_telemetry(main_module, upstream, monkeypatch, tmp_path):
+    from fastapi.testclient import TestClient
+
+    from capabilities import ModelPricing
+    from model_router import RoutingTableLoader
+    from model_telemetry import FakeClock, ModelTelemetry
+
+    monkeypatch.setattr(main_module.settings, "upstream_stream_mode", "raw")
+    prices = {"cheap/model": ModelPricing(1e-6, 1e-6, 0.0), "mid/model": ModelPricing(2e-6, 2e-6, 0.0)}
+    monkeypatch.setattr(main_module, "get_model_pricing", prices.get)
+    routes = tmp_path / "routes.toml"
+    routes.write_text('[[rules]]\nname = "pool"\ncandidates = ["mid/model", "cheap/model"]\n')
+    monkeypatch.setattr(main_module, "model_routing", RoutingTableLoader(str(routes)))
+    telemetry = ModelTelemetry(min_samples=1, clock=FakeClock())
+    monkeypatch.setattr(main_module, "model_telemetry", telemetry)
+    requests, responses = upstream
+    client = TestClient(main_module.create_app())
+
+    def send():
+        return client.post(
+            "/v1/messages",
+            json={"model": "claude-haiku", "max_tokens": 100, "stream": True,
+                  "messages": [{"role": "user", "content": "hi"}]},
+        )
+
+    # the cheapest candidate is overloaded: the next one serves the request
+    responses.append(httpx.Response(503, json={"error": {"message": "overloaded", "code": 503}}))
+    responses.append(httpx.Response(200, content=_sse(*TEXT_AND_TOOL)))
+    assert send().status_code == 200
+    assert [r["model"] for r in requests] == ["cheap/model", "mid/model"]
+    snapshot = telemetry.snapshot()
+    assert snapshot["cheap/model"]["error_rate"] == 1.0
+    assert snapshot["mid/model"]["error_rate"] == 0.0
+    assert snapshot["mid/model"]["p95_ttft_s"] > 0
+
+    # cheap/model is over the error budget now, so mid/model goes first
+    responses.append(httpx.Response(200, content=_sse(*TEXT_AND_TOOL)))
+    assert send().status_code == 200
+    assert requests[-1]["model"] == "mid/model"
+
+
+def test_open_circuit_fails_fast_or_falls_back(main_module, upstream, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    from circuit_breaker import CircuitBreakers
+    from model_telemetry import FakeClock
+
+    monkeypatch.setattr(main_module.settings, "upstream_stream_mode", "raw")
+    monkeypatch.setattr(main_module.settings, "big_model_name", "big/model")
+    monkeypatch.setattr(
+        main_module,
+        "circuit_breakers",
+        CircuitBreakers(failure_threshold=2, is_failure=main_module._is_failover_error, clock=FakeClock()),
+    )
+    requests, responses = upstream
+    client = TestClient(main_module.create_app())
+
+    def send():
+        return client.post(
+            "/v1/messages",
+            json={"model": "claude-sonnet-4", "max_tokens": 100, "stream": True,
+                  "messages": [{"role": "user", "content": "hi"}]},
+        )
+
+    for _ in range(2):
+        responses.append(httpx.Response(503, json={"error": {"message": "down", "code": 503}}))
+        assert send().status_code == 503
+    resp = send()  # no upstream call this time
+    assert resp.status_code == 503
+    assert resp.json()["error"]["type"] == "overloaded_error"
+    assert resp.headers["retry-after"] == "30"
+    assert len(requests) == 2
+
+    # with a fallback, the open circuit just skips the target
+    responses.append(httpx.Response(200, content=_sse(*TEXT_AND_TOOL)))
+    model, stream, _ = asyncio.run(
+        main_module._create_with_fallbacks(
+            {"model": "big/model", "messages": [], "stream": True}, "r1", ["backup/model"]
+        )
+    )
+    assert model == "backup/model"
+    assert requests[-1]["model"] == "backup/model"
+
+
+def test_fallbacks_get_tools_in_their_own_dialect(main_module, upstream, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    from model_router import RoutingTable
+
+    monkeypatch.setattr(main_module.settings, "upstream_stream_mode", "raw")
+    table = RoutingTable(
+        [{"target": "openai/gpt-4o", "fallbacks": ["google/gemini-2.5-pro", "google/palm-2-chat-bison"]}]
+    )
+    monkeypatch.setattr(main_module.model_routing, "_table", table)
+    monkeypatch.setattr(main_module.model_routing, "path", None)
+    requests, responses = upstream
+    for _ in range(2):
+        responses.append(httpx.Response(503, json={"error": {"message": "overloaded", "code": 503}}))
+    responses.append(httpx.Response(200, content=_sse(*TEXT_AND_TOOL)))
+
+    schema = {"type": "object", "additionalProperties": False, "properties": {"path": {"type": "string"}}}
+    resp = TestClient(main_module.create_app()).post(
+        "/v1/messages",
+        json={"model": "claude-sonnet-4", "max_tokens": 100, "stream": True,
+              "tools": [{"name": "read", "input_schema": schema}],
+              "tool_choice": {"type": "auto"},
+              "messages": [{"role": "user", "content": "hi"}]},
+    )
+
+    assert resp.status_code == 200
+    primary, gemini, palm = requests
+    assert primary["tools"][0]["function"]["parameters"] == schema
+    assert "additionalProperties" not in gemini["tools"][0]["function"]["parameters"]
+    assert gemini["tool_choice"] == "auto"
+    assert "tools" not in palm and "tool_choice" not in palm
+
+
+def test_ttft_of_a_fallback_excludes_failed_attempts(main_module, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    from model_router import RoutingTable
+    from model_telemetry import FakeClock, ModelTelemetry
+
+    monkeypatch.setattr(main_module.settings, "upstream_stream_mode", "raw")
+    table = RoutingTable([{"target": "slow/model", "fallbacks": ["backup/model"]}])
+    monkeypatch.setattr(main_module.model_routing, "_table", table)
+    monkeypatch.setattr(main_module.model_routing, "path", None)
+    telemetry = ModelTelemetry(clock=FakeClock())
+    monkeypatch.setattr(main_module, "model_telemetry", telemetry)
+
+    def handler(request):
+        if json.loads(request.content)["model"] == "slow/model":
+            time.sleep(0.3)  # a slow 503 before failing over
+            return httpx.Response(503, json={"error": {"message": "overloaded", "code": 503}})
+        return httpx.Response(200, content=_sse(*TEXT_AND_TOOL))
+
+    main_module._upstream_http_client = httpx.AsyncClient(
+        transport=httpx.MockTransport(handler), base_url="http://upstream/v1/"
+    )
+    resp = TestClient(main_module.create_app()).post(
+        "/v1/messages",
+        json={"model": "claude-sonnet-4", "max_tokens": 100, "stream": True,
+              "messages": [{"role": "user", "content": "hi"}]},
+    )
+
+    assert resp.status_code == 200
+    snapshot = telemetry.snapshot()
+    assert snapshot["slow/model"]["error_rate"] == 1.0
+    assert 0 < snapshot["backup/model"]["p95_ttft_s"] < 0.3
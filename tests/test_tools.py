@@ -21,4 +21,42 @@ def test_token_counter_skips_empty_schema():
         tools=[tool],
     )
     # empty schema should add **no** extra tokens
-    assert tokens > 0  # still counts message
\ No newline at end of file
+    assert tokens > 0  # still counts message
+
+SCHEMA = {
+    "$schema": "http://json-schema.org/draft-07/schema#",
+    "type": "object",
+    "additionalProperties": False,
+    "properties": {
+        "default": {"type": "string", "format": "uri", "default": "x"},
+        "when": {"type": "string", "format": "date-time"},
+    },
+    "required": ["default"],
+}
+
+
+def test_repeated_toolset_reuses_converted_tools(main_module):
+    first = main_module.convert_anthropic_tools_to_openai(
+        [main_module.Tool(name="fetch", description="d", input_schema=SCHEMA)]
+    )
+    second = main_module.convert_anthropic_tools_to_openai(
+        [main_module.Tool(name="fetch", description="d", input_schema=SCHEMA)]
+    )
+    assert first[0] is second[0]
+    assert first[0]["function"]["parameters"] == SCHEMA
+
+
+def test_gemini_targets_get_sanitized_schema(main_module):
+    tools = main_module.convert_anthropic_tools_to_openai(
+        [main_module.Tool(name="fetch", input_schema=SCHEMA)],
+        target_model_name="google/gemini-2.5-pro",
+    )
+    params = tools[0]["function"]["parameters"]
+    assert params == {
+        "type": "object",
+        "properties": {
+            "default": {"type": "string"},
+            "when": {"type": "string", "format": "date-time"},
+        },
+        "required": ["default"],
+    }
@@ -0,0 +1,74 @@
+import json
+
+import httpx
+import pytest
+
+import tracing
+
+
+@pytest.fixture
+def memory_tracing():
+    tracing.configure_tracing(True, exporter="memory")
+    yield tracing.memory_exporter()
+    tracing.shutdown_tracing()
+
+
+def test_disabled_tracing_is_noop():
+    assert not tracing.is_enabled()
+    with tracing.span("anything") as span:
+        assert span is tracing.NOOP_SPAN
+    assert tracing.propagation_headers() == {}
+
+
+def test_stream_spans_and_trace_propagation(monkeypatch, main_module, memory_tracing):
+    from fastapi.testclient import TestClient
+
+    seen = []
+
+    def handler(request):
+        seen.append(request)
+        chunks = [
+            {"choices": [{"index": 0, "delta": {"content": "hi"}}]},
+            {"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]},
+        ]
+        body = "".join(f"data: {json.dumps(c)}\n\n" for c in chunks) + "data: [DONE]\n\n"
+        return httpx.Response(200, content=body.encode())
+
+    monkeypatch.setattr(main_module.settings, "upstream_stream_mode", "raw")
+    main_module._upstream_http_client = httpx.AsyncClient(
+        transport=httpx.MockTransport(handler), base_url="http://upstream/v1/"
+    )
+
+    resp = TestClient(main_module.create_app()).post(
+        "/v1/messages",
+        json={
+            "model": "claude-sonnet-4",
+            "max_tokens": 10,
+            "stream": True,
+            "messages": [{"role": "user", "content": "hello"}],
+        },
+    )
+    assert resp.status_code == 200
+
+    spans = {s.name: s for s in memory_tracing.get_finished_spans()}
+    assert {"proxy.request", "convert_request", "upstream.chat_completions", "stream_translation"} <= set(spans)
+
+    root = spans["proxy.request"]
+    assert root.attributes["proxy.target_model"] == "big-model"
+    assert root.attributes["proxy.stream"] is True
+    assert spans["upstream.chat_completions"].parent.span_id == root.context.span_id
+    assert spans["stream_translation"].attributes["proxy.chunk_count"] == 2
+
+    trace_id = format(root.context.trace_id, "032x")
+    assert trace_id in seen[0].headers["traceparent"]
+
+
+def test_sample_ratio_zero_records_nothing(main_module):
+    from fastapi.testclient import TestClient
+
+    tracing.configure_tracing(True, exporter="memory", sample_ratio=0.0)
+    try:
+        TestClient(main_module.create_app()).get("/")
+        assert tracing.memory_exporter().get_finished_spans() == ()
+    finally:
+        tracing.shutdown_tracing()
@@ -0,0 +1,60 @@
+import time
+
+from usage_ledger import UsageLedger, UsageRecord, provider_usage
+
+
+def _record(user="u1", model="m1", input_tokens=100, output_tokens=10, cost=0.5, status="completed"):
+    return UsageRecord(
+        ts=time.time(),
+        request_id="r",
+        user_id=user,
+        client_model="claude-sonnet",
+        target_model=model,
+        stream=True,
+        status=status,
+        usage_source="provider",
+        input_tokens=input_tokens,
+        output_tokens=output_tokens,
+        reasoning_tokens=0,
+        cost_usd=cost,
+        duration_ms=20.0,
+    )
+
+
+def test_provider_usage_reads_sdk_objects_and_dicts():
+    raw = {"prompt_tokens": 7, "completion_tokens": 3, "cost": "0.01",
+           "completion_tokens_details": {"reasoning_tokens": 2}}
+    assert provider_usage(raw) == (7, 3, 2, 0.01)
+    anthropic = {"input_tokens": 7, "cache_read_input_tokens": 90, "output_tokens": 3}
+    assert provider_usage(anthropic) == (97, 3, 0, None)
+    assert provider_usage({"total_tokens": 5}) is None
+    assert provider_usage(None) is None
+
+
+async def test_summary_groups_in_memory():
+    ledger = UsageLedger()
+    ledger.record(_record())
+    ledger.record(_record(status="error", cost=None, output_tokens=0))
+    ledger.record(_record(user="u2", model="m2", cost=2.0))
+
+    by_user = await ledger.summary(["user_id"])
+    assert by_user["source"] == "memory"
+    assert [g["user_id"] for g in by_user["groups"]] == ["u2", "u1"]  # by cost
+    u1 = by_user["groups"][1]
+    assert (u1["requests"], u1["errors"], u1["input_tokens"], u1["cost_usd"]) == (2, 1, 200, 0.5)
+    assert by_user["totals"]["cost_usd"] == 2.5
+
+
+async def test_flush_persists_and_since_queries_sqlite(tmp_path):
+    db = str(tmp_path / "usage.sqlite3")
+    ledger = UsageLedger(db)
+    ledger.record(_record())
+    ledger.record(_record(model="m2", cost=1.0))
+    assert await ledger.flush() == 2
+    assert await ledger.flush() == 0
+
+    # a second process (or a restart) sees the same ledger
+    summary = await UsageLedger(db).summary(["target_model"], since=0)
+    assert summary["source"] == "sqlite"
+    assert {g["target_model"]: g["cost_usd"] for g in summary["groups"]} == {"m1": 0.5, "m2": 1.0}
+    assert (await UsageLedger(db).summary(["target_model"], since=time.time() + 60))["groups"] == []